@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 按需启动显示器
+作者: Xander Xu
+
+管理器在每个显示器的websocket_port上监听，收到第一个连接时才通过
+start_vnc_display启动显示器（后端端口为 websocket_port + activation_port_offset，
+只监听127.0.0.1），等待后端端口可连接后双向转发字节流。
+TLS由KasmVNC自身终止，转发层不解析内容，HTTPS与HTTP均可使用。
+"""
+
+import time
+import asyncio
+import threading
+from typing import Dict, Optional
+
+# 转发缓冲区大小
+PIPE_BUFFER_SIZE = 64 * 1024
+
+# 用户数据变化时重新同步监听端口的检查间隔（秒）
+REFRESH_INTERVAL = 10.0
+
+
+async def pipe_stream(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """单向转发直到读到EOF，随后关闭写端"""
+    try:
+        while True:
+            data = await reader.read(PIPE_BUFFER_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (OSError, asyncio.CancelledError):
+        pass
+    finally:
+        try:
+            if writer.can_write_eof():
+                writer.write_eof()
+            else:
+                # TLS连接不支持半关闭
+                writer.close()
+        except (OSError, RuntimeError):
+            writer.close()
+
+
+class DisplayListener:
+    """单个显示器的监听状态"""
+
+    def __init__(self, username: str, display_number: int, public_port: int, backend_port: int):
+        self.username = username
+        self.display_number = display_number
+        self.public_port = public_port
+        self.backend_port = backend_port
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.start_lock = asyncio.Lock()
+        self.error: Optional[str] = None
+        self.connections = 0
+        self.total_connections = 0
+        self.activations = 0
+        self.last_activation_seconds: Optional[float] = None
+
+    def status(self) -> Dict:
+        return {
+            "username": self.username,
+            "display_number": self.display_number,
+            "public_port": self.public_port,
+            "backend_port": self.backend_port,
+            "listening": self.server is not None,
+            "error": self.error,
+            "connections": self.connections,
+            "total_connections": self.total_connections,
+            "activations": self.activations,
+            "last_activation_seconds": self.last_activation_seconds
+        }
+
+
+class SocketActivator:
+    """按需启动: 在公开端口监听，首个连接时启动显示器并转发"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.logger = manager.logger
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.listeners: Dict[int, DisplayListener] = {}
+        self.started_time: Optional[float] = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动监听线程"""
+        if self.is_running():
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="socket-activator", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start_listeners(), self._loop).result(timeout=30)
+        self.started_time = time.time()
+        self.manager.log_operation(
+            "activation_start",
+            details=f"按需启动已开启: 监听 {sum(1 for l in self.listeners.values() if l.server)} 个端口"
+        )
+
+    def stop(self):
+        """关闭所有监听端口，已建立的转发连接随之断开"""
+        if not self.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(self._close_listeners(), self._loop).result(timeout=30)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+        self._loop.close()
+        self._thread = None
+        self._loop = None
+        self.manager.log_operation("activation_stop", details="按需启动已关闭")
+
+    def status(self) -> Dict:
+        return {
+            "running": self.is_running(),
+            "enabled": self.manager.config.activation_enabled,
+            "port_offset": self.manager.config.activation_port_offset,
+            "started_time": self.started_time,
+            "displays": [listener.status() for listener in self.listeners.values()]
+        }
+
+    def connection_count(self, display_number: int) -> int:
+        listener = self.listeners.get(display_number)
+        return listener.connections if listener else 0
+
+    # ------------------------------------------------------------------
+    # 以下方法在监听线程的事件循环中执行
+    # ------------------------------------------------------------------
+
+    async def _start_listeners(self):
+        await self._sync_listeners()
+        self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def _close_listeners(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        for listener in list(self.listeners.values()):
+            await self._close_listener(listener)
+        self.listeners = {}
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await self._sync_listeners()
+            except Exception as e:
+                self.logger.error(f"同步按需启动监听端口失败: {e}")
+
+    async def _sync_listeners(self):
+        """按用户数据增删监听端口"""
+        users = self.manager.load_users_data()
+        wanted = {}
+        for user in users:
+            for display in user.displays:
+                wanted[display.display_number] = (user.username, display.websocket_port)
+
+        for display_number in set(self.listeners) - set(wanted):
+            await self._close_listener(self.listeners.pop(display_number))
+
+        for display_number, (username, port) in wanted.items():
+            listener = self.listeners.get(display_number)
+            if listener and listener.public_port == port and listener.server:
+                continue
+            if listener:
+                await self._close_listener(listener)
+            listener = DisplayListener(username, display_number, port,
+                                       self.manager.display_backend_port(port))
+            self.listeners[display_number] = listener
+            await self._open_listener(listener)
+
+    async def _open_listener(self, listener: DisplayListener):
+        async def handle(reader, writer):
+            await self._handle_client(listener, reader, writer)
+
+        try:
+            listener.server = await asyncio.start_server(handle, host="0.0.0.0", port=listener.public_port)
+            listener.error = None
+        except OSError as e:
+            # 端口被占用，通常是显示器以普通模式运行在公开端口上
+            listener.error = str(e)
+            self.logger.warning(f"按需启动无法监听端口 {listener.public_port}: {e}")
+
+    async def _close_listener(self, listener: DisplayListener):
+        if listener.server:
+            listener.server.close()
+            await listener.server.wait_closed()
+            listener.server = None
+
+    async def _handle_client(self, listener: DisplayListener, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter):
+        listener.connections += 1
+        listener.total_connections += 1
+        backend_writer = None
+        try:
+            if not await self._ensure_backend(listener):
+                return
+            backend_reader, backend_writer = await asyncio.open_connection("127.0.0.1", listener.backend_port)
+            await asyncio.gather(
+                pipe_stream(reader, backend_writer),
+                pipe_stream(backend_reader, writer)
+            )
+        except OSError as e:
+            self.logger.warning(f"显示器 :{listener.display_number} 转发失败: {e}")
+        finally:
+            listener.connections -= 1
+            for stream in (writer, backend_writer):
+                if stream is not None:
+                    stream.close()
+
+    async def _ensure_backend(self, listener: DisplayListener) -> bool:
+        """后端未运行时启动显示器并等待端口可连接，并发连接只启动一次"""
+        async with listener.start_lock:
+            if await self._backend_ready(listener.backend_port):
+                return True
+
+            start = time.time()
+            loop = asyncio.get_running_loop()
+            started = await loop.run_in_executor(
+                None, self.manager.start_vnc_display, listener.username, listener.display_number
+            )
+            if not started:
+                return False
+
+            deadline = start + self.manager.config.activation_timeout
+            while time.time() < deadline:
+                if await self._backend_ready(listener.backend_port):
+                    listener.activations += 1
+                    listener.last_activation_seconds = round(time.time() - start, 3)
+                    self.manager.log_operation(
+                        "activation", listener.username,
+                        f"显示器 :{listener.display_number} 按需启动完成，"
+                        f"耗时 {listener.last_activation_seconds}s"
+                    )
+                    return True
+                await asyncio.sleep(0.2)
+
+            self.manager.log_operation(
+                "activation", listener.username,
+                error_message=f"显示器 :{listener.display_number} 启动后端口 {listener.backend_port} 未就绪",
+                success=False
+            )
+            return False
+
+    @staticmethod
+    async def _backend_ready(port: int) -> bool:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            return False
+        writer.close()
+        return True
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 启动准入控制
+作者: Xander Xu
+
+根据运行中显示器实测的内存（进程树RSS）和CPU占用，学习单个显示器的平均开销；
+启动前预估启动后的内存和CPU余量，余量不足时排队等待，超时仍不足则拒绝，
+并给出具体原因。新启动的显示器按预估值预留，直到实测到它一个采样周期的CPU占用
+（此时它已计入实测的系统CPU和可用内存）才释放；启动失败或已退出的显示器释放预留。
+启动后稳定期内的开销不参与学习。
+当前CPU占用由两次采样之间的系统CPU时间计算，不使用滞后的1分钟平均负载。
+"""
+
+import os
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import psutil
+
+
+# 开销估计的指数加权系数
+EWMA_ALPHA = 0.2
+
+# 显示器启动后多久视为开销稳定（秒），稳定前不参与学习
+SETTLE_SECONDS = 30.0
+
+# 计算CPU占用的最短采样间隔（秒）
+MIN_CPU_WINDOW = 1.0
+
+# 预留的最长保留时间（秒），无权限读取进程开销时也不会一直预留
+RESERVATION_MAX_AGE = 300.0
+
+# 计为忙碌的系统CPU时间字段（guest已计入user）
+BUSY_CPU_FIELDS = ("user", "nice", "system", "irq", "softirq", "steal")
+
+# 排队时重新检查余量的间隔（秒）
+QUEUE_POLL_INTERVAL = 1.0
+
+# 保留的准入决策记录数
+HISTORY_SIZE = 100
+
+
+class AdmissionDecision:
+    """准入决策"""
+
+    def __init__(self, admitted: bool, reason: str, waited: float = 0.0,
+                 projected: Optional[Dict] = None):
+        self.admitted = admitted
+        self.reason = reason
+        self.waited = waited
+        self.projected = projected or {}
+
+    def to_dict(self) -> Dict:
+        return {
+            "admitted": self.admitted,
+            "reason": self.reason,
+            "waited": round(self.waited, 2),
+            "projected": self.projected
+        }
+
+
+class AdmissionController:
+    """显示器启动准入控制"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._lock = threading.Lock()
+        self._admit_lock = threading.Lock()
+        self.rss_estimate: Optional[float] = None
+        self.cpu_estimate: Optional[float] = None
+        self.samples = 0
+        # pid -> (CPU时间, 采样时刻)
+        self._cpu_marks: Dict[int, Tuple[float, float]] = {}
+        # 显示器编号 -> 预留 (预留时刻, 内存字节, CPU核数)
+        self._reservations: Dict[int, Tuple[float, float, float]] = {}
+        # 系统CPU时间采样 (忙碌CPU秒数, 采样时刻)，以及据此计算的占用核数
+        self._system_mark: Optional[Tuple[float, float]] = None
+        self.system_cpu: Optional[float] = None
+        self.queued = 0
+        self.admitted_count = 0
+        self.rejected_count = 0
+        self.history: List[Dict] = []
+
+    def footprint(self) -> Tuple[float, float]:
+        """单个显示器的预估开销 (内存字节, CPU核数)，未学习到时使用配置的默认值"""
+        config = self.manager.config
+        rss = self.rss_estimate if self.rss_estimate is not None else config.admission_default_rss_mb * 1024 * 1024
+        cpu = self.cpu_estimate if self.cpu_estimate is not None else config.admission_default_cpu
+        return rss, cpu
+
+    def observe(self, process_map: Dict[int, psutil.Process] = None):
+        """采样运行中显示器的实际开销，更新预估值"""
+        if process_map is None:
+            process_map = self.manager.get_display_process_map()
+        now = time.time()
+        rss_values = []
+        cpu_values = []
+        marks = {}
+        measured = set()
+        for display_num, proc in process_map.items():
+            try:
+                settled = now - proc.create_time() >= SETTLE_SECONDS
+                rss, cpu_time = 0, 0.0
+                for member in [proc] + proc.children(recursive=True):
+                    try:
+                        with member.oneshot():
+                            rss += member.memory_info().rss
+                            times = member.cpu_times()
+                            cpu_time += times.user + times.system
+                    except (psutil.NoSuchProcess, psutil.AccessDenied):
+                        continue
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            # 稳定前的开销不参与学习，但已反映在实测的系统CPU和可用内存中
+            if settled:
+                rss_values.append(rss)
+            marks[proc.pid] = (cpu_time, now)
+            previous = self._cpu_marks.get(proc.pid)
+            if previous and now - previous[1] >= MIN_CPU_WINDOW:
+                if settled:
+                    cpu_values.append(max(cpu_time - previous[0], 0.0) / (now - previous[1]))
+                measured.add(display_num)
+            elif previous:
+                # 间隔太短，保留上次的基准
+                marks[proc.pid] = previous
+
+        times = psutil.cpu_times()
+        busy = sum(getattr(times, field, 0.0) for field in BUSY_CPU_FIELDS)
+
+        with self._lock:
+            self._cpu_marks = marks
+            if self._system_mark is None or now - self._system_mark[1] >= MIN_CPU_WINDOW:
+                if self._system_mark is not None:
+                    self.system_cpu = max(busy - self._system_mark[0], 0.0) / (now - self._system_mark[1])
+                self._system_mark = (busy, now)
+            # 已实测到开销的显示器计入了系统CPU占用，不再预留；未运行的显示器启动失败或已退出
+            for display_num, (reserved_at, _, _) in list(self._reservations.items()):
+                age = now - reserved_at
+                if display_num in measured or age >= RESERVATION_MAX_AGE or (
+                        display_num not in process_map and age >= SETTLE_SECONDS):
+                    del self._reservations[display_num]
+            if rss_values:
+                self.rss_estimate = self._ewma(self.rss_estimate, sum(rss_values) / len(rss_values))
+                self.samples += 1
+            if cpu_values:
+                self.cpu_estimate = self._ewma(self.cpu_estimate, sum(cpu_values) / len(cpu_values))
+
+    @staticmethod
+    def _ewma(previous: Optional[float], value: float) -> float:
+        if previous is None:
+            return value
+        return previous + EWMA_ALPHA * (value - previous)
+
+    def _reserved(self) -> Tuple[float, float]:
+        return (sum(r[1] for r in self._reservations.values()),
+                sum(r[2] for r in self._reservations.values()))
+
+    def release(self, display_num: int):
+        """启动失败时释放预留"""
+        with self._lock:
+            self._reservations.pop(display_num, None)
+
+    def evaluate(self) -> AdmissionDecision:
+        """按当前余量判断能否再启动一个显示器"""
+        config = self.manager.config
+        rss, cpu = self.footprint()
+        memory = psutil.virtual_memory()
+        cpu_count = os.cpu_count() or 1
+        with self._lock:
+            reserved_rss, reserved_cpu = self._reserved()
+            # 尚未有两次采样时用1分钟平均负载近似
+            cpu_used = self.system_cpu if self.system_cpu is not None else os.getloadavg()[0]
+
+        memory_floor = memory.total * config.admission_memory_reserve
+        memory_after = memory.available - reserved_rss - rss
+        cpu_limit = cpu_count * config.admission_cpu_limit
+        cpu_after = cpu_used + reserved_cpu + cpu
+        projected = {
+            "display_rss_mb": round(rss / 1024 / 1024, 1),
+            "display_cpu": round(cpu, 3),
+            "memory_available_after_mb": round(memory_after / 1024 / 1024, 1),
+            "memory_floor_mb": round(memory_floor / 1024 / 1024, 1),
+            "cpu_after": round(cpu_after, 2),
+            "cpu_limit": round(cpu_limit, 2)
+        }
+
+        if memory_after < memory_floor:
+            return AdmissionDecision(
+                False,
+                f"内存不足: 启动后可用内存预计 {projected['memory_available_after_mb']} MB，"
+                f"低于保留下限 {projected['memory_floor_mb']} MB（单个显示器约 {projected['display_rss_mb']} MB）",
+                projected=projected
+            )
+        if cpu_after > cpu_limit:
+            return AdmissionDecision(
+                False,
+                f"CPU不足: 启动后预计占用 {projected['cpu_after']} 核，超过上限 {projected['cpu_limit']} 核",
+                projected=projected
+            )
+        return AdmissionDecision(True, "资源充足", projected=projected)
+
+    def acquire(self, username: str, display_num: int) -> AdmissionDecision:
+        """
+        启动前申请资源
+
+        余量不足时最多排队admission_queue_timeout秒，通过后按预估开销预留资源
+        """
+        config = self.manager.config
+        if not config.admission_enabled:
+            return AdmissionDecision(True, "准入控制未开启")
+
+        start = time.time()
+        deadline = start + max(config.admission_queue_timeout, 0)
+        queued = False
+        try:
+            while True:
+                # 每次检查前重新采样，释放已实测的预留
+                self.observe()
+                # 判断与预留需原子完成，避免并发启动同时通过
+                with self._admit_lock:
+                    decision = self.evaluate()
+                    if decision.admitted:
+                        rss, cpu = self.footprint()
+                        with self._lock:
+                            self._reservations[display_num] = (time.time(), rss, cpu)
+                if decision.admitted or time.time() >= deadline:
+                    break
+                if not queued:
+                    queued = True
+                    with self._lock:
+                        self.queued += 1
+                time.sleep(QUEUE_POLL_INTERVAL)
+        finally:
+            if queued:
+                with self._lock:
+                    self.queued -= 1
+        decision.waited = time.time() - start
+
+        with self._lock:
+            if decision.admitted:
+                self.admitted_count += 1
+            else:
+                self.rejected_count += 1
+            self.history.append({
+                "username": username,
+                "display_number": display_num,
+                "timestamp": time.time(),
+                **decision.to_dict()
+            })
+            del self.history[:-HISTORY_SIZE]
+        return decision
+
+    def status(self) -> Dict:
+        """准入控制状态"""
+        config = self.manager.config
+        rss, cpu = self.footprint()
+        decision = self.evaluate()
+        with self._lock:
+            reserved_rss, reserved_cpu = self._reserved()
+            return {
+                "enabled": config.admission_enabled,
+                "learned": self.rss_estimate is not None,
+                "samples": self.samples,
+                "display_rss_mb": round(rss / 1024 / 1024, 1),
+                "display_cpu": round(cpu, 3),
+                "reserved_rss_mb": round(reserved_rss / 1024 / 1024, 1),
+                "reserved_cpu": round(reserved_cpu, 3),
+                "reserved_displays": sorted(self._reservations),
+                "system_cpu": round(self.system_cpu, 2) if self.system_cpu is not None else None,
+                "queued": self.queued,
+                "admitted_count": self.admitted_count,
+                "rejected_count": self.rejected_count,
+                "next_start": decision.to_dict(),
+                "history": list(self.history)
+            }
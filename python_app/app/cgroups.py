@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - cgroup v2 资源隔离
+作者: Xander Xu
+
+每个用户的会话放入独立的cgroup（<cgroup_root>/<cgroup_base>/<用户名>），
+设置 cpu.weight、memory.max、memory.high、io.weight，并读取各cgroup的
+CPU、内存、IO使用量。启动命令在子进程中先加入cgroup；若PAM（pam_systemd）
+把会话移到了其他cgroup，启动完成后再把显示器进程树迁回。
+"""
+
+import os
+from typing import Dict, List, Optional
+
+import psutil
+
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# 需要在父cgroup中启用的控制器
+CONTROLLERS = ("cpu", "memory", "io")
+
+
+def is_available(root: str = CGROUP_ROOT) -> bool:
+    """是否为cgroup v2（统一层级）"""
+    return os.path.exists(os.path.join(root, "cgroup.controllers"))
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _write(path: str, value: str):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def _read_keyed(path: str) -> Dict[str, int]:
+    """读取 "键 值" 每行一项的文件，如cpu.stat、memory.events"""
+    result = {}
+    content = _read(path)
+    for line in (content or "").splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].lstrip('-').isdigit():
+            result[parts[0]] = int(parts[1])
+    return result
+
+
+def _read_int(path: str) -> Optional[int]:
+    content = _read(path)
+    if content is None or not content.isdigit():
+        return None
+    return int(content)
+
+
+def parse_io_stat(content: Optional[str]) -> Dict[str, int]:
+    """汇总io.stat中所有设备的读写字节数和次数"""
+    totals = {"rbytes": 0, "wbytes": 0, "rios": 0, "wios": 0}
+    for line in (content or "").splitlines():
+        for field in line.split()[1:]:
+            key, _, value = field.partition("=")
+            if key in totals and value.isdigit():
+                totals[key] += int(value)
+    return totals
+
+
+class CgroupManager:
+    """用户会话cgroup管理"""
+
+    def __init__(self, manager, root: str = CGROUP_ROOT):
+        self.manager = manager
+        self.logger = manager.logger
+        self.root = root
+
+    @property
+    def base_path(self) -> str:
+        return os.path.join(self.root, self.manager.config.cgroup_base)
+
+    def user_path(self, username: str) -> str:
+        return os.path.join(self.base_path, username)
+
+    def enabled(self) -> bool:
+        return self.manager.config.cgroup_enabled and is_available(self.root)
+
+    def user_limits(self, username: str) -> Dict[str, str]:
+        """用户的资源限制，单用户配置覆盖全局默认值"""
+        config = self.manager.config
+        limits = {
+            "cpu.weight": str(config.cgroup_cpu_weight),
+            "memory.max": config.cgroup_memory_max,
+            "memory.high": config.cgroup_memory_high,
+            "io.weight": str(config.cgroup_io_weight)
+        }
+        limits.update({key: str(value) for key, value in config.cgroup_user_limits.get(username, {}).items()})
+        return limits
+
+    def _enable_controllers(self, path: str):
+        """在path的subtree_control中启用控制器，使其子cgroup可设置限制"""
+        available = (_read(os.path.join(path, "cgroup.controllers")) or "").split()
+        enabled = (_read(os.path.join(path, "cgroup.subtree_control")) or "").split()
+        wanted = [c for c in CONTROLLERS if c in available and c not in enabled]
+        if wanted:
+            _write(os.path.join(path, "cgroup.subtree_control"), " ".join(f"+{c}" for c in wanted))
+
+    def ensure_user_cgroup(self, username: str) -> Optional[str]:
+        """创建用户cgroup并写入限制，cgroup v2不可用或未开启时返回None"""
+        if not self.enabled():
+            return None
+
+        self._enable_controllers(self.root)
+        os.makedirs(self.base_path, exist_ok=True)
+        self._enable_controllers(self.base_path)
+
+        path = self.user_path(username)
+        os.makedirs(path, exist_ok=True)
+        for name, value in self.user_limits(username).items():
+            control_file = os.path.join(path, name)
+            if not os.path.exists(control_file):
+                # 对应控制器未启用（如内核未开启io控制器）
+                continue
+            try:
+                _write(control_file, value)
+            except OSError as e:
+                self.logger.warning(f"设置cgroup {name}={value} 失败 ({username}): {e}")
+        return path
+
+    def attach_process_tree(self, username: str, proc: psutil.Process) -> int:
+        """把进程及其子进程迁入用户cgroup，返回迁移的进程数"""
+        if not self.enabled():
+            return 0
+        procs_file = os.path.join(self.user_path(username), "cgroup.procs")
+        try:
+            members = [proc] + proc.children(recursive=True)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            members = [proc]
+
+        moved = 0
+        for member in members:
+            try:
+                _write(procs_file, str(member.pid))
+                moved += 1
+            except OSError:
+                continue
+        return moved
+
+    def remove_user_cgroup(self, username: str):
+        """删除用户cgroup（其中已无进程时）"""
+        path = self.user_path(username)
+        if os.path.isdir(path):
+            try:
+                os.rmdir(path)
+            except OSError as e:
+                self.logger.warning(f"删除cgroup失败 {path}: {e}")
+
+    def usage(self, username: str) -> Optional[Dict]:
+        """读取用户cgroup的资源使用量"""
+        path = self.user_path(username)
+        if not os.path.isdir(path):
+            return None
+
+        cpu_stat = _read_keyed(os.path.join(path, "cpu.stat"))
+        memory_events = _read_keyed(os.path.join(path, "memory.events"))
+        procs = (_read(os.path.join(path, "cgroup.procs")) or "").split()
+        return {
+            "path": path,
+            "limits": {
+                name: _read(os.path.join(path, name))
+                for name in ("cpu.weight", "memory.max", "memory.high", "io.weight")
+            },
+            "processes": len(procs),
+            "cpu_usage_seconds": cpu_stat.get("usage_usec", 0) / 1e6,
+            "cpu_throttled_seconds": cpu_stat.get("throttled_usec", 0) / 1e6,
+            "memory_current": _read_int(os.path.join(path, "memory.current")),
+            "memory_peak": _read_int(os.path.join(path, "memory.peak")),
+            "memory_events": {
+                key: memory_events.get(key, 0) for key in ("high", "max", "oom", "oom_kill")
+            },
+            "io": parse_io_stat(_read(os.path.join(path, "io.stat")))
+        }
+
+    def status(self, usernames: List[str]) -> Dict:
+        return {
+            "available": is_available(self.root),
+            "enabled": self.manager.config.cgroup_enabled,
+            "base_path": self.base_path,
+            "users": {username: self.usage(username) for username in usernames}
+        }
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 外部命令执行与统计
+作者: Xander Xu
+
+所有外部命令（id、useradd、chpasswd、su、kasmvncpasswd、openssl等）统一经由
+CommandRunner执行，记录参数（敏感信息已脱敏）、耗时、退出码和输出大小，
+按命令汇总为耗时直方图，用于分析创建用户和服务控制的耗时分布。
+"""
+
+import os
+import time
+import threading
+import subprocess
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Sequence
+
+from .timing import span
+
+
+REDACTED = "***"
+
+# 耗时直方图分桶上限（毫秒），最后一个桶收集其余
+HISTOGRAM_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000, 30000)
+
+# 每个命令保留的最近耗时样本数，用于计算分位数
+SAMPLE_SIZE = 1000
+
+
+def redact_argv(argv: Sequence[str], secrets: Iterable[str] = ()) -> List[str]:
+    """将参数中出现的敏感字符串替换为***"""
+    secrets = [secret for secret in secrets if secret]
+    redacted = []
+    for arg in argv:
+        arg = str(arg)
+        for secret in secrets:
+            arg = arg.replace(secret, REDACTED)
+        redacted.append(arg)
+    return redacted
+
+
+def command_name(argv: Sequence[str]) -> str:
+    """命令统计名称: 可执行文件名；su -c 时附带实际执行的程序"""
+    if not argv:
+        return ""
+    name = os.path.basename(str(argv[0]))
+    if name == "su" and "-c" in argv:
+        index = list(argv).index("-c")
+        if index + 1 < len(argv):
+            inner = str(argv[index + 1]).split()
+            skip = {"nohup", "bash", "sh", "exec"}
+            inner_name = next((os.path.basename(token) for token in inner if token not in skip), "")
+            if inner_name:
+                name = f"su:{inner_name}"
+    return name
+
+
+class CommandStats:
+    """单个命令的耗时统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max = 0.0
+        self.stderr_bytes = 0
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.samples: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+
+    def add(self, duration: float, failed: bool, stderr_bytes: int):
+        self.count += 1
+        self.failures += int(failed)
+        self.total += duration
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.max = max(self.max, duration)
+        self.stderr_bytes += stderr_bytes
+        self.samples.append(duration)
+
+        duration_ms = duration * 1000
+        for index, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if duration_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def summary(self) -> Dict:
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+        labels = [f"le_{bound}ms" for bound in HISTOGRAM_BUCKETS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "failures": self.failures,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else None,
+            "min_ms": round(self.min * 1000, 3) if self.min is not None else None,
+            "max_ms": round(self.max * 1000, 3),
+            "p50_ms": percentile(50),
+            "p95_ms": percentile(95),
+            "p99_ms": percentile(99),
+            "stderr_bytes": self.stderr_bytes,
+            "histogram": dict(zip(labels, self.buckets))
+        }
+
+
+class CommandRunner:
+    """外部命令执行器"""
+
+    def __init__(self, logger=None, history_size: int = 500):
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._stats: Dict[str, CommandStats] = {}
+        self._history: Deque[Dict] = deque(maxlen=history_size)
+
+    def run(self, argv: Sequence[str], input: str = None, check: bool = False,
+            timeout: float = None, secrets: Iterable[str] = (),
+            name: str = None, env: Dict[str, str] = None, user: int = None, group: int = None,
+            extra_groups: List[int] = None) -> subprocess.CompletedProcess:
+        """
+        执行命令并记录
+
+        - secrets: 需要在记录中脱敏的字符串（如密码），标准输入内容从不记录
+        - name: 统计名称，默认由命令行推断
+        - check: 为True时退出码非0抛出CalledProcessError，与subprocess.run一致
+        - env: 子进程环境变量，默认继承当前进程
+        - user/group/extra_groups: 以指定用户和组运行，与subprocess.run一致（参见 supervisor.user_credentials）
+        """
+        name = name or command_name(argv)
+        start = time.perf_counter()
+        result = None
+        error = None
+        try:
+            with span(f"cmd_{name.replace(':', '_')}"):
+                result = subprocess.run(list(argv), input=input, capture_output=True,
+                                        text=True, timeout=timeout, env=env, user=user,
+                                        group=group, extra_groups=extra_groups)
+        except (OSError, subprocess.SubprocessError) as e:
+            error = e
+            raise
+        finally:
+            self._record(name, argv, secrets, time.perf_counter() - start, result, error)
+
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, result.args,
+                                                result.stdout, result.stderr)
+        return result
+
+    def _record(self, name: str, argv: Sequence[str], secrets: Iterable[str],
+                duration: float, result: Optional[subprocess.CompletedProcess],
+                error: Optional[Exception]):
+        returncode = result.returncode if result is not None else None
+        stderr_bytes = len(result.stderr.encode('utf-8')) if result is not None and result.stderr else 0
+        stdout_bytes = len(result.stdout.encode('utf-8')) if result is not None and result.stdout else 0
+        failed = error is not None or returncode != 0
+        record = {
+            "name": name,
+            "argv": redact_argv(argv, secrets),
+            "timestamp": time.time(),
+            "duration_ms": round(duration * 1000, 3),
+            "returncode": returncode,
+            "stdout_bytes": stdout_bytes,
+            "stderr_bytes": stderr_bytes,
+            "error": f"{type(error).__name__}: {error}" if error is not None else None
+        }
+
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = CommandStats()
+            stats.add(duration, failed, stderr_bytes)
+            self._history.append(record)
+
+        if self.logger and failed:
+            self.logger.debug(f"命令执行失败 {record['argv']}: returncode={returncode} {record['error'] or ''}")
+
+    def stats(self) -> Dict[str, Dict]:
+        """按命令汇总，按总耗时降序"""
+        with self._lock:
+            summaries = {name: stats.summary() for name, stats in self._stats.items()}
+        return dict(sorted(summaries.items(), key=lambda item: -item[1]["total_ms"]))
+
+    def recent(self, limit: int = 50, name: str = None, failed_only: bool = False) -> List[Dict]:
+        """最近的命令记录，新的在前"""
+        with self._lock:
+            history = list(self._history)
+        records = []
+        for record in reversed(history):
+            if name and record["name"] != name:
+                continue
+            if failed_only and record["returncode"] == 0:
+                continue
+            records.append(record)
+            if len(records) >= limit:
+                break
+        return records
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._history.clear()
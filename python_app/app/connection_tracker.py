@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 客户端连接跟踪
+作者: Xander Xu
+
+进程存在只说明显示器在运行，不说明有人在用。连接跟踪器定期读取一次
+/proc/net/tcp{,6}，统计每个显示器端口上已建立的客户端连接：
+- 有客户端连接时才更新用户的最后活跃时间
+- 连接数从0变为非0记为一次会话开始，降为0时会话结束并累计时长
+- 按用户汇总会话数、活跃时长和最后登录时间，持久化到文件
+
+统计的是显示器实际监听的端口（按需启动模式下为内部端口），反向代理预建的空闲
+后端连接不计入。会话起止的精度为采样间隔。
+"""
+
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .netstat import TCP_ESTABLISHED, read_tcp_table
+
+
+# 保留的会话记录数
+HISTORY_SIZE = 200
+
+
+class ConnectionTracker:
+    """显示器客户端连接跟踪器"""
+
+    def __init__(self, manager, stats_file: str = "connection_stats.json"):
+        self.manager = manager
+        self.logger = manager.logger
+        self.stats_file = stats_file
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 显示器编号 -> 当前连接状态 {"username", "clients", "session_start"}
+        self.displays: Dict[int, Dict] = {}
+        # 用户名 -> 累计统计 {"total_sessions", "active_time", "last_login", "last_active"}
+        self.users: Dict[str, Dict] = {}
+        self.history: List[Dict] = []
+        self.poll_count = 0
+        self.last_poll_time: Optional[float] = None
+        self.load()
+
+    def load(self):
+        """从文件加载用户累计统计"""
+        if not os.path.exists(self.stats_file):
+            return
+        with open(self.stats_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.users = data.get("users", {})
+
+    def save(self):
+        """保存用户累计统计到文件（调用方持有锁）"""
+        tmp_file = f"{self.stats_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"users": self.users}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, self.stats_file)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动后台采样线程"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="connection-tracker", daemon=True)
+        self._thread.start()
+        self.logger.info(f"客户端连接跟踪已启动: 采样间隔 {self.manager.config.connection_poll_interval}s")
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join(timeout=10)
+        self._thread = None
+        # 进行中的会话计入累计时长
+        with self._lock:
+            now = time.time()
+            for display_num, state in self.displays.items():
+                if state["clients"]:
+                    self._end_session(display_num, state, now)
+            self.save()
+
+    def _run(self):
+        while not self._stop_event.wait(max(self.manager.config.connection_poll_interval, 1)):
+            try:
+                self.poll()
+            except Exception as e:
+                self.logger.error(f"客户端连接采样失败: {e}")
+
+    def _display_ports(self) -> Dict[int, Tuple[int, str]]:
+        """显示器实际监听的端口 -> (显示器编号, 用户名)，包括预启动池账号"""
+        manager = self.manager
+        users = manager.load_users_data() + list(manager.warm_pool.accounts)
+        return {
+            manager.display_backend_port(display.websocket_port): (display.display_number, user.username)
+            for user in users for display in user.displays
+        }
+
+    def count_clients(self, display_ports: Dict[int, Tuple[int, str]] = None) -> Dict[int, int]:
+        """读取一次套接字表，返回 显示器编号 -> 已建立的客户端连接数"""
+        if display_ports is None:
+            display_ports = self._display_ports()
+        counts = {display_num: 0 for display_num, _ in display_ports.values()}
+        for entry in read_tcp_table(states={TCP_ESTABLISHED}):
+            target = display_ports.get(entry.local_port)
+            if target is not None:
+                counts[target[0]] += 1
+
+        # 反向代理预建的后端连接还没有客户端使用
+        for display_num, pooled in self.manager.session_proxy.pooled_connections().items():
+            if display_num in counts:
+                counts[display_num] = max(counts[display_num] - pooled, 0)
+        return counts
+
+    def poll(self) -> Dict[int, int]:
+        """采样一次，更新会话和用户活跃时间，返回各显示器连接数"""
+        display_ports = self._display_ports()
+        owners = dict(display_ports.values())
+        counts = self.count_clients(display_ports)
+        now = time.time()
+        with self._lock:
+            changed = False
+            for display_num, clients in counts.items():
+                username = owners[display_num]
+                state = self.displays.get(display_num)
+                if state is None or state["username"] != username:
+                    if state is not None and state["clients"]:
+                        self._end_session(display_num, state, now)
+                    state = {"username": username, "clients": 0, "session_start": None}
+                    self.displays[display_num] = state
+
+                if clients and not state["clients"]:
+                    state["session_start"] = now
+                    stats = self._user_stats(username)
+                    stats["total_sessions"] += 1
+                    stats["last_login"] = now
+                    changed = True
+                elif not clients and state["clients"]:
+                    self._end_session(display_num, state, now)
+                    changed = True
+                state["clients"] = clients
+                if clients:
+                    self._user_stats(username)["last_active"] = now
+
+            # 已删除的显示器
+            for display_num in set(self.displays) - set(counts):
+                state = self.displays.pop(display_num)
+                if state["clients"]:
+                    self._end_session(display_num, state, now)
+                    changed = True
+
+            if changed:
+                self.save()
+            self.poll_count += 1
+            self.last_poll_time = now
+        return counts
+
+    def _user_stats(self, username: str) -> Dict:
+        return self.users.setdefault(username, {
+            "total_sessions": 0, "active_time": 0.0, "last_login": None, "last_active": None
+        })
+
+    def _end_session(self, display_num: int, state: Dict, now: float):
+        """会话结束，累计时长（调用方持有锁）"""
+        start = state.get("session_start") or now
+        duration = max(now - start, 0.0)
+        stats = self._user_stats(state["username"])
+        stats["active_time"] += duration
+        stats["last_active"] = now
+        state["clients"], state["session_start"] = 0, None
+        self.history.append({
+            "username": state["username"],
+            "display_number": display_num,
+            "start_time": start,
+            "end_time": now,
+            "duration": round(duration, 1)
+        })
+        del self.history[:-HISTORY_SIZE]
+
+    def clients(self, display_num: int) -> int:
+        """显示器最近一次采样的客户端连接数"""
+        with self._lock:
+            state = self.displays.get(display_num)
+            return state["clients"] if state else 0
+
+    def last_active(self, username: str) -> Optional[float]:
+        """用户最后一次有客户端连接的时间，从未连接过返回None"""
+        with self._lock:
+            stats = self.users.get(username)
+            return stats["last_active"] if stats else None
+
+    def user_statistics(self, username: str) -> Dict:
+        """用户累计统计，进行中的会话计入活跃时长"""
+        now = time.time()
+        with self._lock:
+            stats = dict(self.users.get(username) or {
+                "total_sessions": 0, "active_time": 0.0, "last_login": None, "last_active": None
+            })
+            active_sessions = 0
+            for state in self.displays.values():
+                if state["username"] == username and state["clients"]:
+                    active_sessions += 1
+                    stats["active_time"] += now - state["session_start"]
+                    stats["last_active"] = now
+            stats["active_sessions"] = active_sessions
+            return stats
+
+    def remove_user(self, username: str):
+        """删除用户的累计统计"""
+        with self._lock:
+            if self.users.pop(username, None) is not None:
+                self.save()
+
+    def status(self) -> Dict:
+        """各显示器当前连接和最近结束的会话"""
+        now = time.time()
+        with self._lock:
+            displays = {
+                str(display_num): {
+                    "username": state["username"],
+                    "clients": state["clients"],
+                    "session_seconds": round(now - state["session_start"], 1) if state["session_start"] else None
+                }
+                for display_num, state in sorted(self.displays.items())
+            }
+            return {
+                "running": self.is_running(),
+                "poll_interval": self.manager.config.connection_poll_interval,
+                "poll_count": self.poll_count,
+                "last_poll_time": self.last_poll_time,
+                "connected_displays": sum(1 for state in self.displays.values() if state["clients"]),
+                "total_clients": sum(state["clients"] for state in self.displays.values()),
+                "displays": displays,
+                "history": list(self.history)
+            }
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 桌面持续同步
+作者: Xander Xu
+
+监听源用户的桌面、图标、自启动目录，事件经防抖合并后增量推送到所有目标用户。
+"""
+
+import os
+import time
+import threading
+from typing import Dict, List, Optional
+
+from . import inotify
+from .inotify import Inotify
+
+
+WATCH_MASK = (
+    inotify.IN_CLOSE_WRITE | inotify.IN_CREATE | inotify.IN_DELETE |
+    inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_ATTRIB |
+    inotify.IN_DELETE_SELF | inotify.IN_ONLYDIR | inotify.IN_DONT_FOLLOW
+)
+
+# 防抖的最长等待倍数，持续有事件时也保证按时推送
+MAX_DELAY_FACTOR = 5
+
+
+class DesktopSyncWatcher:
+    """基于inotify的桌面持续同步"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.logger = manager.logger
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._inotify: Optional[Inotify] = None
+        self._watches: Dict[int, str] = {}
+        self._pending: Dict[str, None] = {}
+        self._first_pending: Optional[float] = None
+        self._last_event: Optional[float] = None
+
+        self.source_user: Optional[str] = None
+        self.source_home: Optional[str] = None
+        self.target_users: List[str] = []
+        self.sync_flags: Dict[str, bool] = {}
+        self.debounce = manager.config.desktop_watch_debounce
+        self.missing_roots: List[str] = []
+        self.started_time: Optional[float] = None
+        self.event_count = 0
+        self.flush_count = 0
+        self.synced_path_count = 0
+        self.overflow_count = 0
+        self.last_flush_time: Optional[float] = None
+        self.last_results: Dict[str, bool] = {}
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, source_user: str, target_users: List[str] = None,
+              sync_desktop: bool = True, sync_icons: bool = True,
+              sync_autostart: bool = True, debounce: float = None):
+        """启动监听，已在运行时先停止"""
+        if not inotify.is_available():
+            raise Exception("当前系统不支持inotify")
+
+        self.stop()
+
+        self.source_user = source_user
+        self.source_home = self.manager.get_source_home(source_user)
+        self.target_users = list(target_users or [])
+        self.sync_flags = {
+            "sync_desktop": sync_desktop,
+            "sync_icons": sync_icons,
+            "sync_autostart": sync_autostart
+        }
+        self.debounce = debounce if debounce is not None else self.manager.config.desktop_watch_debounce
+        self.event_count = 0
+        self.flush_count = 0
+        self.synced_path_count = 0
+        self.overflow_count = 0
+        self.last_flush_time = None
+        self.last_results = {}
+        self._pending = {}
+        self._first_pending = None
+
+        self._inotify = Inotify()
+        self._watches = {}
+        self.missing_roots = []
+        for root in self.manager.desktop_sync_roots(**self.sync_flags):
+            if os.path.isdir(os.path.join(self.source_home, root)):
+                self._add_tree(root)
+            else:
+                self.missing_roots.append(root)
+
+        self._stop_event.clear()
+        self.started_time = time.time()
+        self._thread = threading.Thread(target=self._run, name="desktop-sync-watcher", daemon=True)
+        self._thread.start()
+
+        self.manager.log_operation(
+            "desktop_watch_start", source_user,
+            f"桌面监听已启动: {len(self._watches)} 个目录, 防抖 {self.debounce}s"
+        )
+
+    def stop(self):
+        """停止监听，未推送的变更会先推送"""
+        thread = self._thread
+        if thread is None:
+            return
+
+        self._stop_event.set()
+        thread.join(timeout=10)
+        self._thread = None
+
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+        self._watches = {}
+
+        self.manager.log_operation("desktop_watch_stop", self.source_user, "桌面监听已停止")
+
+    def status(self) -> Dict:
+        """监听状态"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "running": self.is_running(),
+            "source_user": self.source_user,
+            "target_users": self.target_users,
+            "sync_flags": self.sync_flags,
+            "debounce": self.debounce,
+            "watched_dirs": len(self._watches),
+            "missing_roots": self.missing_roots,
+            "pending_paths": pending,
+            "event_count": self.event_count,
+            "flush_count": self.flush_count,
+            "synced_path_count": self.synced_path_count,
+            "overflow_count": self.overflow_count,
+            "started_time": self.started_time,
+            "last_flush_time": self.last_flush_time,
+            "last_results": self.last_results
+        }
+
+    def _add_tree(self, rel_dir: str):
+        """递归添加目录监听"""
+        top = os.path.join(self.source_home, rel_dir)
+        for root, dirs, files in os.walk(top):
+            self._add_watch(os.path.relpath(root, self.source_home))
+
+    def _add_watch(self, rel_dir: str):
+        try:
+            wd = self._inotify.add_watch(os.path.join(self.source_home, rel_dir), WATCH_MASK)
+            self._watches[wd] = rel_dir
+        except OSError as e:
+            self.logger.warning(f"添加目录监听失败 {rel_dir}: {e}")
+
+    def _run(self):
+        """事件循环"""
+        while not self._stop_event.is_set():
+            try:
+                events = self._inotify.read_events(timeout=min(self.debounce, 1.0))
+            except OSError as e:
+                self.logger.error(f"读取inotify事件失败: {e}")
+                break
+
+            for event in events:
+                self._handle_event(event)
+
+            if self._should_flush():
+                self._flush()
+
+        # 退出前推送剩余变更
+        if self._pending:
+            self._flush()
+
+    def _handle_event(self, event: inotify.InotifyEvent):
+        """处理单个事件，记录变更路径"""
+        if event.mask & inotify.IN_Q_OVERFLOW:
+            self._full_resync()
+            return
+
+        rel_dir = self._watches.get(event.wd)
+        if rel_dir is None:
+            return
+
+        if event.mask & (inotify.IN_IGNORED | inotify.IN_DELETE_SELF):
+            self._watches.pop(event.wd, None)
+            return
+
+        if not event.name:
+            return
+
+        rel_path = os.path.join(rel_dir, event.name)
+        if event.mask & inotify.IN_ISDIR and event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+            self._add_tree(rel_path)
+
+        now = time.time()
+        with self._lock:
+            self._pending[rel_path] = None
+            if self._first_pending is None:
+                self._first_pending = now
+            self._last_event = now
+            self.event_count += 1
+
+    def _should_flush(self) -> bool:
+        """安静期超过防抖时间或等待超过上限时推送"""
+        with self._lock:
+            if not self._pending:
+                return False
+            now = time.time()
+            return (now - self._last_event >= self.debounce or
+                    now - self._first_pending >= self.debounce * MAX_DELAY_FACTOR)
+
+    def _flush(self):
+        """推送合并后的变更"""
+        with self._lock:
+            paths = list(self._pending)
+            self._pending = {}
+            self._first_pending = None
+
+        try:
+            results = self.manager.sync_desktop_paths(self.source_user, paths, self.target_users)
+            self.last_results = results
+            self.flush_count += 1
+            self.synced_path_count += len(paths)
+            self.last_flush_time = time.time()
+        except Exception as e:
+            self.manager.log_operation("desktop_watch_flush", self.source_user,
+                                       error_message=str(e), success=False)
+
+    def _full_resync(self):
+        """事件队列溢出，无法得知具体变更，退回全量同步"""
+        self.overflow_count += 1
+        with self._lock:
+            self._pending = {}
+            self._first_pending = None
+        self.logger.warning("inotify事件队列溢出，执行全量同步")
+        self.manager.sync_desktop(self.source_user, self.target_users, **self.sync_flags)
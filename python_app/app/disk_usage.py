@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 用户主目录磁盘占用统计
+作者: Xander Xu
+
+对几百个主目录反复执行du很慢。磁盘统计为每个目录缓存 (mtime, 直接包含的文件占用,
+文件数, 子目录)，用户占用为其主目录下所有目录之和，增量维护:
+- 启动后扫描一次（有缓存文件时只stat目录，mtime未变的目录沿用缓存）
+- 每个目录添加inotify监听，目录内有文件创建、删除、写入时标记为脏，防抖后只重新扫描该目录；
+  新出现的子目录整棵扫描，消失的子目录整棵移除
+- 超出inotify监听数上限或不支持inotify时，未监听的目录按sweep间隔比较mtime
+- 按verify间隔全量重新扫描，修正事件丢失造成的偏差
+占用按已分配块（st_blocks）计算，与du一致；不跟随符号链接，硬链接按每个链接分别计入。
+仅靠mtime检查的目录发现不了已有文件的原地增长，由全量扫描修正。
+"""
+
+import os
+import json
+import time
+import errno
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import psutil
+
+from . import inotify
+from .inotify import Inotify
+
+
+WATCH_MASK = (
+    inotify.IN_CREATE | inotify.IN_DELETE | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO |
+    inotify.IN_MODIFY | inotify.IN_CLOSE_WRITE | inotify.IN_ONLYDIR | inotify.IN_DONT_FOLLOW
+)
+
+# 同步用户列表（新增、删除的用户）的间隔（秒）
+USER_SYNC_INTERVAL = 30.0
+
+# 缓存写入文件的最小间隔（秒），停止时总会保存
+SAVE_INTERVAL = 300.0
+
+# 刷新方式: 全部重新扫描 / 比较所有目录的mtime / 只比较未监听目录的mtime
+MODE_FULL = "full"
+MODE_MTIME = "mtime"
+MODE_UNWATCHED = "unwatched"
+
+
+class DirUsage(NamedTuple):
+    """单个目录的缓存: 修改时间、目录自身及直接包含的文件占用字节、文件数、子目录名"""
+    mtime_ns: int
+    bytes: int
+    files: int
+    subdirs: Tuple[str, ...]
+
+
+class DiskUsageTracker:
+    """用户主目录磁盘占用统计"""
+
+    def __init__(self, manager, cache_file: str = "disk_usage.json"):
+        self.manager = manager
+        self.logger = manager.logger
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._inotify: Optional[Inotify] = None
+        # 用户名 -> 主目录
+        self._homes: Dict[str, str] = {}
+        # 用户名 -> {目录路径: DirUsage}
+        self._dirs: Dict[str, Dict[str, DirUsage]] = {}
+        # 用户名 -> {"bytes", "files", "dirs"}
+        self._totals: Dict[str, Dict[str, int]] = {}
+        # watch描述符 -> (用户名, 目录路径)，以及反向索引
+        self._watches: Dict[int, Tuple[str, str]] = {}
+        self._watched_paths: Dict[str, int] = {}
+        # 待重新扫描的目录 -> 用户名
+        self._dirty: Dict[str, str] = {}
+        self._first_dirty: Optional[float] = None
+        self._verify_pending = False
+        self._changed = False
+        self._last_save = 0.0
+        self.watch_limit_reached = False
+        self.scanned_users = set()
+        self.event_count = 0
+        self.rescan_count = 0
+        self.overflow_count = 0
+        self.last_sweep_time: Optional[float] = None
+        self.last_verify_time: Optional[float] = None
+        self.last_verify_duration: Optional[float] = None
+        self._cached: Dict[str, Tuple[str, Dict[str, DirUsage]]] = {}
+        self.load()
+
+    def load(self):
+        """加载目录缓存，首次扫描时只需stat目录"""
+        if not os.path.exists(self.cache_file):
+            return
+        with open(self.cache_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for username, entry in data.get("users", {}).items():
+            home = entry["home"]
+            self._cached[username] = (home, {
+                os.path.normpath(os.path.join(home, rel_path)): DirUsage(
+                    mtime_ns, size, files, tuple(subdirs))
+                for rel_path, (mtime_ns, size, files, subdirs) in entry["dirs"].items()
+            })
+
+    def save(self):
+        """保存目录缓存到文件，路径相对主目录存放"""
+        with self._lock:
+            data = {"users": {
+                username: {
+                    "home": home,
+                    "dirs": {os.path.relpath(path, home): [usage.mtime_ns, usage.bytes, usage.files,
+                                                           list(usage.subdirs)]
+                             for path, usage in self._dirs.get(username, {}).items()}
+                }
+                for username, home in self._homes.items() if username in self.scanned_users
+            }}
+            self._changed = False
+        tmp_file = f"{self.cache_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, self.cache_file)
+        self._last_save = time.monotonic()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动统计线程，首次扫描在线程中进行"""
+        if self.is_running():
+            return
+        if inotify.is_available():
+            try:
+                self._inotify = Inotify()
+            except OSError as e:
+                self.logger.warning(f"磁盘统计无法使用inotify，改为按mtime检查: {e}")
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="disk-usage", daemon=True)
+        self._thread.start()
+        config = self.manager.config
+        self.logger.info(
+            f"磁盘占用统计已启动: inotify {'可用' if self._inotify else '不可用'}, "
+            f"mtime检查间隔 {config.disk_usage_sweep_interval}s, 全量扫描间隔 {config.disk_usage_verify_interval}s"
+        )
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join(timeout=30)
+        self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        with self._lock:
+            self._watches, self._watched_paths = {}, {}
+        if self.scanned_users:
+            self.save()
+
+    def _run(self):
+        last_user_sync = None
+        last_sweep = last_verify = time.monotonic()
+        while not self._stop_event.is_set():
+            config = self.manager.config
+            try:
+                if config.disk_usage_enabled:
+                    last_user_sync, last_sweep, last_verify = self._tick(last_user_sync, last_sweep, last_verify)
+                if self._inotify is not None:
+                    for event in self._inotify.read_events(timeout=1.0):
+                        self._handle_event(event)
+                else:
+                    self._stop_event.wait(1.0)
+            except Exception as e:
+                self.logger.error(f"磁盘占用统计失败: {e}")
+                self._stop_event.wait(5)
+
+    def _tick(self, last_user_sync, last_sweep, last_verify):
+        """执行到期的用户同步、脏目录扫描、mtime检查、全量扫描和缓存保存，返回更新后的时间点"""
+        config = self.manager.config
+        now = time.monotonic()
+        if last_user_sync is None or now - last_user_sync >= USER_SYNC_INTERVAL:
+            self._sync_users()
+            last_user_sync = now
+        if self._dirty and now - self._first_dirty >= config.disk_usage_debounce:
+            self._rescan_dirty()
+        if config.disk_usage_sweep_interval and now - last_sweep >= config.disk_usage_sweep_interval:
+            mode = MODE_UNWATCHED if self._inotify is not None else MODE_MTIME
+            for username, home in list(self._homes.items()):
+                self._refresh_tree(username, home, mode)
+            self.last_sweep_time = time.time()
+            last_sweep = now
+        if self._verify_pending or (config.disk_usage_verify_interval and
+                                    now - last_verify >= config.disk_usage_verify_interval):
+            self.verify()
+            last_verify = time.monotonic()
+        if self._changed and time.monotonic() - self._last_save >= SAVE_INTERVAL:
+            self.save()
+        return last_user_sync, last_sweep, last_verify
+
+    def _sync_users(self):
+        """扫描新用户，移除已删除的用户"""
+        users = {user.username: user.home_directory for user in self.manager.load_users_data()}
+        for username in set(self._homes) - set(users):
+            self.remove_user(username)
+        for username, home in users.items():
+            if self._homes.get(username) == home:
+                continue
+            if username in self._homes:
+                self.remove_user(username)
+            with self._lock:
+                self._homes[username] = home
+                self._dirs[username] = {}
+                self._totals[username] = {"bytes": 0, "files": 0, "dirs": 0}
+            start = time.monotonic()
+            cached_home, cached_dirs = self._cached.pop(username, (None, {}))
+            if cached_home == home:
+                # 沿用缓存，mtime变化的目录重新扫描
+                with self._lock:
+                    for path, usage in cached_dirs.items():
+                        self._set_dir(username, path, usage)
+            if os.path.isdir(home):
+                self._refresh_tree(username, home, MODE_MTIME)
+            self.scanned_users.add(username)
+            self._changed = True
+            self.logger.debug(f"用户 {username} 主目录扫描完成: {time.monotonic() - start:.2f}s")
+        self._cached.clear()
+
+    def remove_user(self, username: str):
+        """移除用户的统计和目录监听"""
+        with self._lock:
+            self._homes.pop(username, None)
+            dirs = self._dirs.pop(username, {})
+            self._totals.pop(username, None)
+            self.scanned_users.discard(username)
+            for path in dirs:
+                self._unwatch(path)
+                self._dirty.pop(path, None)
+            self._changed = True
+
+    def verify(self):
+        """全量重新扫描所有用户主目录"""
+        start = time.monotonic()
+        self._verify_pending = False
+        for username, home in list(self._homes.items()):
+            self._refresh_tree(username, home, MODE_FULL)
+        self.last_verify_time = time.time()
+        self.last_verify_duration = time.monotonic() - start
+
+    def _refresh_tree(self, username: str, top: str, mode: str):
+        """
+        从top开始刷新目录树
+
+        MODE_FULL重新扫描每个目录；其余方式只重新扫描mtime变化或未缓存的目录，
+        MODE_UNWATCHED对已监听的目录不做检查
+        """
+        stack = [top]
+        while stack and not self._stop_event.is_set():
+            path = stack.pop()
+            with self._lock:
+                if username not in self._homes:
+                    return
+                cached = self._dirs[username].get(path)
+                watched = path in self._watched_paths
+            if cached is not None and mode != MODE_FULL:
+                if mode == MODE_UNWATCHED and watched:
+                    stack.extend(os.path.join(path, name) for name in cached.subdirs)
+                    continue
+                try:
+                    mtime_ns = os.lstat(path).st_mtime_ns
+                except OSError:
+                    mtime_ns = None
+                if mtime_ns == cached.mtime_ns:
+                    if not watched:
+                        with self._lock:
+                            self._watch(username, path)
+                    stack.extend(os.path.join(path, name) for name in cached.subdirs)
+                    continue
+            usage = self._rescan_dir(username, path)
+            if usage is not None:
+                stack.extend(os.path.join(path, name) for name in usage.subdirs)
+
+    def _rescan_dir(self, username: str, path: str) -> Optional[DirUsage]:
+        """重新扫描单个目录（不递归），目录已不存在时移除整棵子树"""
+        try:
+            # 先取mtime再读取内容，读取期间的变化会在下次检查时发现
+            stat = os.lstat(path)
+            entries = list(os.scandir(path))
+        except (FileNotFoundError, NotADirectoryError):
+            with self._lock:
+                self._remove_tree(username, path)
+            return None
+        except PermissionError as e:
+            self.logger.debug(f"无法读取目录 {path}: {e}")
+            entries = []
+
+        size = stat.st_blocks * 512
+        files = 0
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                    continue
+                size += entry.stat(follow_symlinks=False).st_blocks * 512
+                files += 1
+            except OSError:
+                continue
+        usage = DirUsage(stat.st_mtime_ns, size, files, tuple(sorted(subdirs)))
+
+        with self._lock:
+            if username not in self._homes:
+                return None
+            old = self._dirs[username].get(path)
+            if old is not None:
+                for name in set(old.subdirs) - set(usage.subdirs):
+                    self._remove_tree(username, os.path.join(path, name))
+            self._set_dir(username, path, usage)
+            self._watch(username, path)
+            self.rescan_count += 1
+        return usage
+
+    def _set_dir(self, username: str, path: str, usage: DirUsage):
+        """更新目录缓存和用户合计（调用方持有锁）"""
+        dirs = self._dirs[username]
+        totals = self._totals[username]
+        old = dirs.get(path)
+        if old is not None:
+            totals["bytes"] -= old.bytes
+            totals["files"] -= old.files
+        else:
+            totals["dirs"] += 1
+        totals["bytes"] += usage.bytes
+        totals["files"] += usage.files
+        dirs[path] = usage
+        if old != usage:
+            self._changed = True
+
+    def _remove_tree(self, username: str, top: str):
+        """移除目录及其所有子目录的缓存（调用方持有锁）"""
+        dirs = self._dirs.get(username)
+        if dirs is None:
+            return
+        totals = self._totals[username]
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            usage = dirs.pop(path, None)
+            self._unwatch(path)
+            self._dirty.pop(path, None)
+            if usage is None:
+                continue
+            totals["bytes"] -= usage.bytes
+            totals["files"] -= usage.files
+            totals["dirs"] -= 1
+            stack.extend(os.path.join(path, name) for name in usage.subdirs)
+        self._changed = True
+
+    def _watch(self, username: str, path: str):
+        """为目录添加inotify监听，达到系统上限后不再添加（调用方持有锁）"""
+        if self._inotify is None or self.watch_limit_reached or path in self._watched_paths:
+            return
+        try:
+            wd = self._inotify.add_watch(path, WATCH_MASK)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                self.watch_limit_reached = True
+                self.logger.warning(
+                    f"inotify监听数达到上限 ({len(self._watches)} 个目录)，其余目录按mtime定期检查，"
+                    f"可调大 fs.inotify.max_user_watches"
+                )
+            return
+        self._watches[wd] = (username, path)
+        self._watched_paths[path] = wd
+
+    def _unwatch(self, path: str):
+        """移除目录监听（调用方持有锁）"""
+        wd = self._watched_paths.pop(path, None)
+        if wd is None:
+            return
+        self._watches.pop(wd, None)
+        if self._inotify is not None:
+            self._inotify.rm_watch(wd)
+
+    def _handle_event(self, event: inotify.InotifyEvent):
+        """目录内有变化时标记该目录待重新扫描"""
+        if event.mask & inotify.IN_Q_OVERFLOW:
+            # 事件丢失，无法得知哪些目录变化
+            self.overflow_count += 1
+            self._verify_pending = True
+            self.logger.warning("磁盘统计inotify事件队列溢出，将全量重新扫描")
+            return
+        with self._lock:
+            target = self._watches.get(event.wd)
+            if target is None:
+                return
+            if event.mask & inotify.IN_IGNORED:
+                # 目录已删除，由父目录的重新扫描移除缓存
+                self._watches.pop(event.wd, None)
+                self._watched_paths.pop(target[1], None)
+                return
+            username, path = target
+            self.event_count += 1
+            if path not in self._dirty:
+                self._dirty[path] = username
+                if self._first_dirty is None:
+                    self._first_dirty = time.monotonic()
+
+    def _rescan_dirty(self):
+        """重新扫描标记为脏的目录，新增的子目录整棵扫描"""
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = {}
+            self._first_dirty = None
+        for path, username in dirty.items():
+            with self._lock:
+                old = self._dirs.get(username, {}).get(path)
+            if old is None:
+                continue
+            usage = self._rescan_dir(username, path)
+            if usage is None:
+                continue
+            for name in set(usage.subdirs) - set(old.subdirs):
+                self._refresh_tree(username, os.path.join(path, name), MODE_MTIME)
+
+    def user_usage(self, username: str) -> Optional[Dict]:
+        """用户主目录占用，尚未扫描完成时返回None"""
+        with self._lock:
+            if username not in self.scanned_users:
+                return None
+            return dict(self._totals[username], username=username, home_directory=self._homes[username])
+
+    def usage(self, username: Optional[str] = None) -> List[Dict]:
+        """各用户主目录占用，按占用从大到小排列"""
+        with self._lock:
+            entries = [
+                dict(self._totals[name], username=name, home_directory=self._homes[name])
+                for name in self.scanned_users if username is None or name == username
+            ]
+        return sorted(entries, key=lambda entry: entry["bytes"], reverse=True)
+
+    def top_users(self, limit: int = 10) -> List[Dict]:
+        """占用最大的limit个用户"""
+        return self.usage()[:limit]
+
+    def top_directories(self, username: str, limit: int = 10) -> List[Dict]:
+        """用户主目录下占用（含子目录）最大的limit个目录，不含主目录本身"""
+        with self._lock:
+            home = self._homes.get(username)
+            dirs = dict(self._dirs.get(username, {}))
+        if home is None:
+            return []
+        # 从深到浅把子目录的占用累加到父目录
+        subtree = {path: [usage.bytes, usage.files] for path, usage in dirs.items()}
+        for path in sorted(subtree, key=lambda p: p.count(os.sep), reverse=True):
+            parent = os.path.dirname(path)
+            if path != home and parent in subtree:
+                subtree[parent][0] += subtree[path][0]
+                subtree[parent][1] += subtree[path][1]
+        entries = [
+            {"path": path, "relative_path": os.path.relpath(path, home), "bytes": size, "files": files}
+            for path, (size, files) in subtree.items() if path != home
+        ]
+        return sorted(entries, key=lambda entry: entry["bytes"], reverse=True)[:limit]
+
+    def filesystem_usage(self) -> Dict:
+        """用户主目录所在文件系统的容量和使用情况"""
+        path = self.manager.config.base_user_home
+        disk = psutil.disk_usage(path)
+        return {"path": path, "total": disk.total, "used": disk.used, "free": disk.free, "percent": disk.percent}
+
+    def status(self) -> Dict:
+        config = self.manager.config
+        with self._lock:
+            tracked_dirs = sum(len(dirs) for dirs in self._dirs.values())
+            return {
+                "running": self.is_running(),
+                "enabled": config.disk_usage_enabled,
+                "inotify": self._inotify is not None,
+                "watched_dirs": len(self._watches),
+                "tracked_dirs": tracked_dirs,
+                "watch_limit_reached": self.watch_limit_reached,
+                "scanned_users": len(self.scanned_users),
+                "dirty_dirs": len(self._dirty),
+                "total_bytes": sum(totals["bytes"] for totals in self._totals.values()),
+                "event_count": self.event_count,
+                "rescan_count": self.rescan_count,
+                "overflow_count": self.overflow_count,
+                "debounce": config.disk_usage_debounce,
+                "sweep_interval": config.disk_usage_sweep_interval,
+                "verify_interval": config.disk_usage_verify_interval,
+                "last_sweep_time": self.last_sweep_time,
+                "last_verify_time": self.last_verify_time,
+                "last_verify_duration": round(self.last_verify_duration, 3)
+                if self.last_verify_duration is not None else None
+            }
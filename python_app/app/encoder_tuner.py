@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 编码参数自动调优
+作者: Xander Xu
+
+定期采样主机CPU饱和度（1分钟负载/核数）和每个显示器进程树的CPU占用（编码负载），
+按显示器调整RectThreads，可选降低帧率和画质上限：
+- 主机饱和时，线程利用率低的显示器减少线程以降低争用；负载高的显示器降一档帧率/画质
+- 主机空闲时，先恢复帧率/画质，再为负载高的显示器增加线程
+条件需连续满足CONFIRM_SCANS次才调整，避免来回抖动。调整在显示器下次启动时生效，
+每次决策都记录原因和采样值。
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .models import EncoderTuneMode
+from .idle_reaper import session_usage
+
+
+# 帧率/画质档位: (帧率, DynamicQualityMax)，0档不指定，使用KasmVNC默认值
+QUALITY_LEVELS: List[Tuple[Optional[int], Optional[int]]] = [
+    (None, None),
+    (30, 8),
+    (24, 7),
+    (15, 5)
+]
+
+# 编码负载低于该核数视为空闲，不参与调优
+IDLE_CPU = 0.05
+
+# 线程利用率（编码占用核数/线程数）阈值
+LOW_UTILIZATION = 0.5
+HIGH_UTILIZATION = 0.75
+
+# 条件连续满足的扫描次数
+CONFIRM_SCANS = 2
+
+# 保留的决策记录数
+HISTORY_SIZE = 200
+
+
+class EncoderTuner:
+    """显示器编码参数自动调优"""
+
+    def __init__(self, manager, tuning_file: str = "encoder_tuning.json"):
+        self.manager = manager
+        self.logger = manager.logger
+        self.tuning_file = tuning_file
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 显示器编号 -> 生效的调优设置 {"rect_threads": int, "level": int}
+        self.overrides: Dict[int, Dict] = {}
+        # 显示器编号 -> 推荐模式下的建议设置
+        self.recommendations: Dict[int, Dict] = {}
+        # 显示器编号 -> 采样状态（进程、CPU时间、启动时的设置、连续满足次数）
+        self._samples: Dict[int, Dict] = {}
+        self.history: Deque[Dict] = deque(maxlen=HISTORY_SIZE)
+        self.scan_count = 0
+        self.last_scan_time: Optional[float] = None
+        self.last_saturation: Optional[float] = None
+        self.load()
+
+    def load(self):
+        """从文件加载调优设置"""
+        if not os.path.exists(self.tuning_file):
+            return
+        with open(self.tuning_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.overrides = {int(display_num): entry for display_num, entry in data.get("overrides", {}).items()}
+
+    def save(self):
+        """保存调优设置到文件（调用方持有锁）"""
+        data = {"overrides": {str(display_num): entry for display_num, entry in sorted(self.overrides.items())}}
+        tmp_file = f"{self.tuning_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, self.tuning_file)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动后台调优线程"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="encoder-tuner", daemon=True)
+        self._thread.start()
+        self.logger.info(
+            f"编码参数调优已启动: 模式 {self.manager.config.encoder_tune_mode.value}, "
+            f"间隔 {self.manager.config.encoder_tune_interval}s"
+        )
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join(timeout=10)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(max(self.manager.config.encoder_tune_interval, 1)):
+            if self.manager.config.encoder_tune_mode == EncoderTuneMode.OFF:
+                continue
+            try:
+                self.scan()
+            except Exception as e:
+                self.logger.error(f"编码参数调优失败: {e}")
+
+    def _base_threads(self, display_num: int) -> int:
+        """未调优时的RectThreads（全局配置或CPU/NUMA放置）"""
+        return int(self.manager.placement.launch_env(display_num)["KASMVNC_RECT_THREADS"])
+
+    def _max_threads(self, display_num: int) -> int:
+        config = self.manager.config
+        if config.encoder_max_threads:
+            return config.encoder_max_threads
+        if self.manager.placement.enabled():
+            return len(self.manager.placement.assign(display_num).cpus)
+        return os.cpu_count() or 1
+
+    def settings(self, display_num: int) -> Dict:
+        """显示器下次启动时使用的设置"""
+        override = self.overrides.get(display_num, {})
+        return {
+            "rect_threads": override.get("rect_threads", self._base_threads(display_num)),
+            "level": override.get("level", 0)
+        }
+
+    def launch_env(self, display_num: int) -> Dict[str, str]:
+        """启动脚本读取的编码环境变量，未调优的显示器不返回RectThreads（沿用放置结果）"""
+        env = {"KASMVNC_FRAME_RATE": "", "KASMVNC_QUALITY_MAX": ""}
+        override = self.overrides.get(display_num)
+        if override is None:
+            return env
+        frame_rate, quality_max = QUALITY_LEVELS[override.get("level", 0)]
+        if "rect_threads" in override:
+            env["KASMVNC_RECT_THREADS"] = str(override["rect_threads"])
+        env["KASMVNC_FRAME_RATE"] = str(frame_rate) if frame_rate else ""
+        env["KASMVNC_QUALITY_MAX"] = str(quality_max) if quality_max else ""
+        return env
+
+    @staticmethod
+    def host_saturation() -> float:
+        """主机CPU饱和度: 1分钟平均负载 / 核数"""
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+    def scan(self, apply: bool = None) -> List[Dict]:
+        """
+        采样一次并给出调优决策
+
+        apply为None时按encoder_tune_mode决定是否生效；不生效时只记录为建议
+        """
+        config = self.manager.config
+        if apply is None:
+            apply = config.encoder_tune_mode == EncoderTuneMode.APPLY
+        now = time.time()
+        saturation = self.host_saturation()
+        users = self.manager.load_users_data()
+        process_map = self.manager.get_display_process_map()
+        decisions = []
+
+        with self._lock:
+            seen = set()
+            for user in users:
+                for display in user.displays:
+                    display_num = display.display_number
+                    proc = process_map.get(display_num)
+                    if proc is None:
+                        continue
+                    seen.add(display_num)
+                    _, cpu_time, _ = session_usage(proc)
+                    sample = self._samples.get(display_num)
+                    if sample is None or sample["pid"] != proc.pid:
+                        # 新启动的进程按当时的设置运行
+                        self._samples[display_num] = {
+                            "pid": proc.pid, "cpu_time": cpu_time, "checked": now,
+                            "running": self.settings(display_num), "action": None, "streak": 0
+                        }
+                        continue
+
+                    elapsed = max(now - sample["checked"], 1e-6)
+                    cpu = max(cpu_time - sample["cpu_time"], 0.0) / elapsed
+                    sample.update(cpu_time=cpu_time, checked=now, cpu=cpu)
+                    decision = self._decide(display_num, sample, cpu, saturation)
+                    if decision is None:
+                        continue
+                    decision.update(username=user.username, display_number=display_num,
+                                    timestamp=now, applied=apply)
+                    self._record(decision, apply)
+                    decisions.append(decision)
+
+            for display_num in set(self._samples) - seen:
+                del self._samples[display_num]
+            if apply and decisions:
+                self.save()
+            self.scan_count += 1
+            self.last_scan_time = now
+            self.last_saturation = saturation
+
+        for decision in decisions:
+            if decision["applied"]:
+                self.manager.log_operation(
+                    "encoder_tune", decision["username"],
+                    f"显示器 :{decision['display_number']} {decision['reason']}，下次启动生效"
+                )
+        return decisions
+
+    def _decide(self, display_num: int, sample: Dict, cpu: float, saturation: float) -> Optional[Dict]:
+        """
+        根据采样值决定调整，条件需连续满足CONFIRM_SCANS次
+
+        按进程实际运行的设置计算利用率；与已待生效（或已建议）的设置相同时不再重复决策
+        """
+        config = self.manager.config
+        current = sample["running"]
+        threads, level = current["rect_threads"], current["level"]
+        utilization = cpu / max(threads, 1)
+
+        action, target, reason = None, dict(current), ""
+        if cpu >= IDLE_CPU and saturation >= config.encoder_tune_high_load:
+            if utilization < LOW_UTILIZATION and threads > config.encoder_min_threads:
+                action, reason = "decrease_threads", f"主机CPU饱和 ({saturation:.2f})，编码线程利用率低 ({utilization:.2f})，减少线程"
+                target["rect_threads"] = threads - 1
+            elif (config.encoder_tune_quality and utilization >= LOW_UTILIZATION
+                  and level < len(QUALITY_LEVELS) - 1):
+                action, reason = "lower_quality", f"主机CPU饱和 ({saturation:.2f})，编码负载高 ({cpu:.2f}核)，降低帧率/画质"
+                target["level"] = level + 1
+        elif saturation <= config.encoder_tune_low_load:
+            if level > 0:
+                action, reason = "raise_quality", f"主机CPU有余量 ({saturation:.2f})，恢复帧率/画质"
+                target["level"] = level - 1
+            elif (cpu >= IDLE_CPU and utilization >= HIGH_UTILIZATION
+                  and threads < self._max_threads(display_num)):
+                action, reason = "increase_threads", f"编码线程利用率高 ({utilization:.2f})，主机CPU有余量 ({saturation:.2f})，增加线程"
+                target["rect_threads"] = threads + 1
+
+        pending = self.recommendations.get(display_num) or self.settings(display_num)
+        if action is None or target == pending:
+            sample["action"], sample["streak"] = None, 0
+            return None
+        sample["streak"] = sample["streak"] + 1 if action == sample["action"] else 1
+        sample["action"] = action
+        if sample["streak"] < CONFIRM_SCANS:
+            return None
+        sample["action"], sample["streak"] = None, 0
+
+        frame_rate, quality_max = QUALITY_LEVELS[target["level"]]
+        return {
+            "action": action,
+            "reason": reason,
+            "host_saturation": round(saturation, 3),
+            "encode_cpu": round(cpu, 3),
+            "utilization": round(utilization, 3),
+            "from": dict(current),
+            "to": {**target, "frame_rate": frame_rate, "quality_max": quality_max}
+        }
+
+    def _record(self, decision: Dict, apply: bool):
+        display_num = decision["display_number"]
+        target = {"rect_threads": decision["to"]["rect_threads"], "level": decision["to"]["level"]}
+        if apply:
+            self.overrides[display_num] = target
+            self.recommendations.pop(display_num, None)
+        else:
+            self.recommendations[display_num] = target
+        self.history.append(decision)
+
+    def clear(self, display_num: int) -> bool:
+        """清除显示器的调优设置和建议，恢复全局配置"""
+        with self._lock:
+            removed = self.overrides.pop(display_num, None) is not None
+            removed = self.recommendations.pop(display_num, None) is not None or removed
+            if removed:
+                self.save()
+            return removed
+
+    def status(self) -> Dict:
+        """调优状态、各显示器当前与待生效设置及决策记录"""
+        config = self.manager.config
+        with self._lock:
+            displays = {}
+            for display_num in sorted(set(self.overrides) | set(self.recommendations) | set(self._samples)):
+                sample = self._samples.get(display_num)
+                next_start = self.settings(display_num)
+                displays[str(display_num)] = {
+                    "running": sample["running"] if sample else None,
+                    "encode_cpu": round(sample["cpu"], 3) if sample and "cpu" in sample else None,
+                    "next_start": next_start,
+                    "recommendation": self.recommendations.get(display_num),
+                    "restart_required": bool(sample and sample["running"] != next_start)
+                }
+            return {
+                "running": self.is_running(),
+                "mode": config.encoder_tune_mode.value,
+                "interval": config.encoder_tune_interval,
+                "host_saturation": round(self.last_saturation, 3) if self.last_saturation is not None else None,
+                "scan_count": self.scan_count,
+                "last_scan_time": self.last_scan_time,
+                "quality_levels": [
+                    {"level": index, "frame_rate": frame_rate, "quality_max": quality_max}
+                    for index, (frame_rate, quality_max) in enumerate(QUALITY_LEVELS)
+                ],
+                "displays": displays,
+                "history": list(self.history)
+            }
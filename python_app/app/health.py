@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 显示器健康检查
+作者: Xander Xu
+
+进程存在不代表显示器可用，卡死的服务器仍会显示为运行中。健康检查一次完成全体显示器：
+1. 读取一次 /proc/net/tcp{,6} 得到所有监听端口，并通过套接字inode确认端口由显示器进程监听
+2. 用asyncio并发向每个websocket端口发起握手（带超时），只读取响应状态行后断开
+每个显示器的状态:
+- stopped: 没有进程，端口未监听
+- not_listening: 有进程但端口未监听（启动中或已异常）
+- listening: 端口可连接但握手超时或无有效响应（服务器卡死）
+- degraded: 有HTTP响应，但延迟超过阈值或状态码异常
+- responsive: 握手正常（101，或未认证时的401/403）
+"""
+
+import os
+import ssl
+import time
+import base64
+import asyncio
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import psutil
+
+from .netstat import listening_sockets, socket_inodes, loopback_for
+
+
+# 表示服务正常的握手响应: 切换协议，或需要认证（HTTP服务正常处理了请求）
+HEALTHY_STATUS = {101, 401, 403}
+
+HEALTH_STATES = ("stopped", "not_listening", "listening", "degraded", "responsive")
+
+
+def _probe_ssl_context() -> ssl.SSLContext:
+    # 显示器使用自签名证书
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+async def probe_websocket(host: str, port: int, ssl_context: Optional[ssl.SSLContext],
+                          timeout: float) -> Tuple[Optional[int], float, Optional[str]]:
+    """
+    发起一次websocket握手，返回 (HTTP状态码, 耗时秒, 错误)
+
+    只读取响应状态行，随后断开，不进入VNC会话
+    """
+    start = time.monotonic()
+    writer = None
+
+    async def handshake():
+        nonlocal writer
+        reader, writer = await asyncio.open_connection(host, port, ssl=ssl_context)
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        host_header = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+        writer.write((
+            "GET /websockify HTTP/1.1\r\n"
+            f"Host: {host_header}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            "Sec-WebSocket-Protocol: binary\r\n"
+            "\r\n"
+        ).encode("ascii"))
+        await writer.drain()
+        return await reader.readline()
+
+    try:
+        status_line = await asyncio.wait_for(handshake(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return None, time.monotonic() - start, "握手超时"
+    except (OSError, ssl.SSLError) as e:
+        return None, time.monotonic() - start, str(e) or e.__class__.__name__
+    finally:
+        if writer is not None:
+            writer.close()
+
+    elapsed = time.monotonic() - start
+    parts = status_line.split()
+    if len(parts) < 2 or not parts[0].startswith(b"HTTP/") or not parts[1].isdigit():
+        return None, elapsed, "无效的HTTP响应" if status_line else "连接被关闭"
+    return int(parts[1]), elapsed, None
+
+
+class HealthChecker:
+    """显示器健康检查"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.logger = manager.logger
+        self._lock = threading.Lock()
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        self.last_results: List[Dict] = []
+        self.last_check_time: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.check_count = 0
+
+    def _snapshot(self, username: Optional[str] = None) -> List[Dict]:
+        """
+        收集需要检查的显示器及进程、监听状态（同步部分，在线程池中执行）
+
+        只读取一次套接字表；每个显示器进程树的套接字inode用于确认监听者
+        """
+        manager = self.manager
+        users = manager.load_users_data() + list(manager.warm_pool.accounts)
+        listeners = listening_sockets()
+        process_map = manager.get_display_process_map()
+        targets = []
+        for user in users:
+            if username is not None and user.username != username:
+                continue
+            for display in user.displays:
+                display_num = display.display_number
+                port = manager.display_backend_port(display.websocket_port)
+                proc = process_map.get(display_num)
+                entries = listeners.get(port, [])
+                owned = None
+                if proc is not None and entries:
+                    try:
+                        pids = [proc.pid] + [child.pid for child in proc.children(recursive=True)]
+                    except psutil.NoSuchProcess:
+                        pids = [proc.pid]
+                    inodes = socket_inodes(pids)
+                    # 无权限读取进程的fd时无法确认
+                    if inodes:
+                        owned = any(entry.inode in inodes for entry in entries)
+                targets.append({
+                    "username": user.username,
+                    "display_number": display_num,
+                    "port": port,
+                    "tls": user.https_enabled,
+                    "pid": proc.pid if proc is not None else None,
+                    "listening": bool(entries),
+                    "listener_owned": owned,
+                    "host": loopback_for(entries[0]) if entries else None
+                })
+        return targets
+
+    async def _check_target(self, target: Dict, semaphore: asyncio.Semaphore) -> Dict:
+        config = self.manager.config
+        result = dict(target, state=None, http_status=None, latency_ms=None, error=None)
+        host = result.pop("host")
+        if not target["listening"]:
+            result["state"] = "stopped" if target["pid"] is None else "not_listening"
+            return result
+
+        async with semaphore:
+            status, elapsed, error = await probe_websocket(
+                host, target["port"], self._ssl_context if target["tls"] else None,
+                config.health_probe_timeout
+            )
+        result.update(http_status=status, latency_ms=round(elapsed * 1000, 1), error=error)
+        if status is None:
+            result["state"] = "listening"
+        elif target["listener_owned"] is False:
+            # 端口被其他进程占用，响应并非来自显示器
+            result["state"] = "degraded"
+            result["error"] = "端口由其他进程监听"
+        elif status in HEALTHY_STATUS and elapsed <= config.health_degraded_latency:
+            result["state"] = "responsive"
+        else:
+            result["state"] = "degraded"
+            if error is None:
+                result["error"] = (f"HTTP {status}" if status not in HEALTHY_STATUS
+                                   else f"响应慢 ({result['latency_ms']} ms)")
+        return result
+
+    async def check(self, username: Optional[str] = None) -> Dict:
+        """检查全部（或指定用户的）显示器，返回各显示器状态和汇总"""
+        start = time.monotonic()
+        if self._ssl_context is None:
+            self._ssl_context = _probe_ssl_context()
+        targets = await asyncio.get_running_loop().run_in_executor(None, self._snapshot, username)
+        semaphore = asyncio.Semaphore(max(self.manager.config.health_probe_concurrency, 1))
+        results = await asyncio.gather(*(self._check_target(target, semaphore) for target in targets))
+        duration = time.monotonic() - start
+
+        summary = {state: 0 for state in HEALTH_STATES}
+        for result in results:
+            summary[result["state"]] += 1
+        with self._lock:
+            if username is None:
+                self.last_results = results
+            self.last_check_time = time.time()
+            self.last_duration = duration
+            self.check_count += 1
+
+        unhealthy = [f":{r['display_number']}({r['state']})" for r in results
+                     if r["pid"] is not None and r["state"] != "responsive"]
+        if unhealthy:
+            self.logger.warning(f"显示器健康检查发现异常: {', '.join(unhealthy)}")
+        return {
+            "displays": results,
+            "summary": summary,
+            "duration_ms": round(duration * 1000, 1),
+            "checked_time": self.last_check_time
+        }
+
+    def status(self) -> Dict:
+        """最近一次全量检查的结果"""
+        with self._lock:
+            summary = {state: 0 for state in HEALTH_STATES}
+            for result in self.last_results:
+                summary[result["state"]] += 1
+            return {
+                "check_count": self.check_count,
+                "last_check_time": self.last_check_time,
+                "last_duration_ms": round(self.last_duration * 1000, 1) if self.last_duration is not None else None,
+                "summary": summary,
+                "displays": list(self.last_results)
+            }
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 空闲会话回收
+作者: Xander Xu
+
+auto_cleanup开启时，每隔cleanup_interval秒检查一次运行中的显示器：
+没有websocket客户端连接（由连接跟踪器从套接字表统计）、且进程树CPU时间几乎没有增长（无输入和画面更新）
+的会话，空闲超过idle_timeout后优雅停止，清理锁文件，并记录释放的内存。
+首次观察到的会话（包括管理器重启后）从观察时刻开始计时，且至少观察两次才会回收，
+不会因为此前的运行时长被立即回收。
+"""
+
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import psutil
+
+
+# 进程树CPU占用低于该比例（相对单核）视为没有活动
+ACTIVE_CPU_RATIO = 0.01
+
+# 回收前至少观察的次数，首次观察无法判断CPU时间是否增长
+MIN_OBSERVATIONS = 2
+
+# 保留的回收记录数
+HISTORY_SIZE = 100
+
+
+def _process_tree(proc: psutil.Process) -> List[psutil.Process]:
+    try:
+        return [proc] + proc.children(recursive=True)
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return [proc]
+
+
+def session_usage(proc: psutil.Process, websocket_port: Optional[int] = None) -> Tuple[int, float, int]:
+    """
+    统计会话进程树的 websocket客户端数、CPU时间（秒）、常驻内存（字节）
+
+    websocket_port为None时不逐进程扫描连接，客户端数返回0（由连接跟踪器统一统计）
+    """
+    clients = 0
+    cpu_time = 0.0
+    rss = 0
+    for member in _process_tree(proc):
+        try:
+            with member.oneshot():
+                cpu = member.cpu_times()
+                cpu_time += cpu.user + cpu.system
+                rss += member.memory_info().rss
+            if websocket_port is None:
+                continue
+            for conn in member.connections(kind="tcp"):
+                if (conn.status == psutil.CONN_ESTABLISHED and conn.laddr
+                        and conn.laddr.port == websocket_port):
+                    clients += 1
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return clients, cpu_time, rss
+
+
+class IdleSessionReaper:
+    """空闲会话回收器"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.logger = manager.logger
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 显示器编号 -> 活动记录
+        self._activity: Dict[int, Dict] = {}
+        self.history: List[Dict] = []
+        self.scan_count = 0
+        self.reaped_count = 0
+        self.reclaimed_bytes = 0
+        self.last_scan_time: Optional[float] = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动后台回收线程"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="idle-session-reaper", daemon=True)
+        self._thread.start()
+        self.logger.info(
+            f"空闲会话回收已启动: 检查间隔 {self.manager.config.cleanup_interval}s, "
+            f"空闲超时 {self.manager.config.idle_timeout}s"
+        )
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join(timeout=10)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(max(self.manager.config.cleanup_interval, 1)):
+            if not self.manager.config.auto_cleanup:
+                continue
+            try:
+                self.scan()
+            except Exception as e:
+                self.logger.error(f"空闲会话检查失败: {e}")
+
+    def scan(self, dry_run: bool = False) -> List[Dict]:
+        """
+        检查一次所有运行中的显示器，回收空闲超时的会话
+
+        dry_run为True时只返回将被回收的会话，不停止
+        """
+        idle_timeout = self.manager.config.idle_timeout
+        now = time.time()
+        users = self.manager.load_users_data()
+        process_map = self.manager.get_display_process_map()
+        # 一次读取套接字表得到所有显示器的客户端连接数
+        client_counts = self.manager.connections.poll()
+        reaped = []
+
+        with self._lock:
+            seen = set()
+            candidates = []
+            for user in users:
+                for display in user.displays:
+                    proc = process_map.get(display.display_number)
+                    if proc is None:
+                        continue
+                    seen.add(display.display_number)
+                    clients = client_counts.get(display.display_number, 0)
+                    _, cpu_time, rss = session_usage(proc)
+                    activity = self._update_activity(display.display_number, user.username, proc,
+                                                     clients, cpu_time, now)
+                    idle_seconds = now - activity["last_active"]
+                    if (idle_timeout > 0 and idle_seconds >= idle_timeout
+                            and activity["observations"] >= MIN_OBSERVATIONS):
+                        candidates.append({
+                            "username": user.username,
+                            "display_number": display.display_number,
+                            "pid": proc.pid,
+                            "idle_seconds": round(idle_seconds, 1),
+                            "rss_bytes": rss
+                        })
+
+            # 已停止的显示器不再跟踪
+            for display_num in set(self._activity) - seen:
+                del self._activity[display_num]
+
+            self.scan_count += 1
+            self.last_scan_time = now
+
+        if dry_run:
+            return candidates
+
+        stopped = self.manager.stop_vnc_displays(
+            [(candidate["username"], candidate["display_number"]) for candidate in candidates]
+        )
+        for candidate in candidates:
+            if stopped[candidate["display_number"]]:
+                candidate["reaped_time"] = time.time()
+                reaped.append(candidate)
+                self._record_reaped(candidate)
+        return reaped
+
+    def _update_activity(self, display_num: int, username: str, proc: psutil.Process, clients: int,
+                         cpu_time: float, now: float) -> Dict:
+        """根据客户端连接和CPU时间增长更新最后活动时间"""
+        activity = self._activity.get(display_num)
+        if activity is None or activity["pid"] != proc.pid:
+            # 首次观察到的会话从现在开始计时，此前是否在使用无从得知
+            activity = {"pid": proc.pid, "last_active": now, "cpu_time": cpu_time,
+                        "checked": now, "observations": 0}
+            self._activity[display_num] = activity
+        else:
+            elapsed = max(now - activity["checked"], 1e-6)
+            if clients > 0 or (cpu_time - activity["cpu_time"]) / elapsed >= ACTIVE_CPU_RATIO:
+                activity["last_active"] = now
+
+        # 连接跟踪器记录的最后一次有客户端连接的时间
+        last_connected = self.manager.connections.last_active(username)
+        if last_connected is not None and last_connected > activity["last_active"]:
+            activity["last_active"] = last_connected
+        activity["observations"] += 1
+        activity["clients"] = clients
+        activity["cpu_time"] = cpu_time
+        activity["checked"] = now
+        return activity
+
+    def _record_reaped(self, candidate: Dict):
+        with self._lock:
+            self._activity.pop(candidate["display_number"], None)
+            self.reaped_count += 1
+            self.reclaimed_bytes += candidate["rss_bytes"]
+            self.history.append(candidate)
+            del self.history[:-HISTORY_SIZE]
+        self.manager.log_operation(
+            "idle_reap", candidate["username"],
+            f"显示器 :{candidate['display_number']} 空闲 {candidate['idle_seconds']:.0f}s 已停止, "
+            f"释放内存 {candidate['rss_bytes'] / 1024 / 1024:.1f} MB"
+        )
+
+    def status(self) -> Dict:
+        """回收器状态"""
+        config = self.manager.config
+        now = time.time()
+        with self._lock:
+            sessions = {
+                display_num: {
+                    "pid": activity["pid"],
+                    "clients": activity.get("clients", 0),
+                    "idle_seconds": round(now - activity["last_active"], 1)
+                }
+                for display_num, activity in self._activity.items()
+            }
+            return {
+                "running": self.is_running(),
+                "auto_cleanup": config.auto_cleanup,
+                "cleanup_interval": config.cleanup_interval,
+                "idle_timeout": config.idle_timeout,
+                "scan_count": self.scan_count,
+                "last_scan_time": self.last_scan_time,
+                "reaped_count": self.reaped_count,
+                "reclaimed_bytes": self.reclaimed_bytes,
+                "sessions": sessions,
+                "history": list(self.history)
+            }
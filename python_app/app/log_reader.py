@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 显示器日志读取
+作者: Xander Xu
+
+读取最后N行时从文件末尾按块向前查找换行，不读取整个文件；实时推送（SSE）由
+inotify通知后只读取新增部分，替代启动脚本中每个显示器常驻的 tail -f 进程。
+文件被截断（copytruncate轮转）时从头读取，被替换时重新打开。
+"""
+
+import os
+import glob
+import asyncio
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+
+from . import inotify
+from .inotify import Inotify
+from .models import LogSource
+
+
+# 向前查找换行时每次读取的字节数
+BLOCK_SIZE = 8192
+
+# 每次推送最多读取的字节数，积压较多时分批推送
+MAX_READ_BYTES = 256 * 1024
+
+# SSE保活间隔（秒）
+HEARTBEAT_INTERVAL = 15.0
+
+# 不支持inotify时的轮询间隔（秒）
+POLL_INTERVAL = 1.0
+
+_WATCH_MASK = (
+    inotify.IN_MODIFY | inotify.IN_CREATE | inotify.IN_MOVED_TO |
+    inotify.IN_DELETE | inotify.IN_ATTRIB | inotify.IN_ONLYDIR
+)
+
+
+def resolve_log_file(manager, username: str, display_num: int, source: LogSource) -> str:
+    """
+    显示器的日志文件路径
+
+    session: 管理器重定向的启动输出；server: KasmVNC写入 ~/.vnc/<主机名>:<显示器>.log
+    """
+    display = manager.find_display(username, display_num)
+    if display is None:
+        raise LookupError(f"用户 {username} 没有显示器 :{display_num}")
+    if source == LogSource.SESSION:
+        return display.log_file or manager.display_log_file(username, display_num)
+
+    user = manager.find_user(username)
+    candidates = glob.glob(os.path.join(glob.escape(user.home_directory), ".vnc", f"*:{display_num}.log"))
+    if not candidates:
+        raise FileNotFoundError(f"显示器 :{display_num} 没有KasmVNC日志")
+    return max(candidates, key=lambda path: os.stat(path).st_mtime)
+
+
+def _decode_lines(data: bytes) -> List[str]:
+    return [line.decode('utf-8', errors='replace') for line in data.split(b"\n")]
+
+
+def tail_lines(path: str, lines: int, block_size: int = BLOCK_SIZE) -> Tuple[List[str], int]:
+    """
+    读取文件最后lines行，返回 (行列表, 当前文件大小)
+
+    从末尾按块向前读取，直到找到足够的换行或到达文件开头；文件大小可作为后续推送的起点
+    """
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        if lines <= 0 or size == 0:
+            return [], size
+
+        chunks = []
+        newlines = 0
+        end = size
+        # 多找一个换行，保证第一行完整（末尾换行不分隔新行）
+        while end > 0 and newlines <= lines:
+            start = max(end - block_size, 0)
+            f.seek(start)
+            chunk = f.read(end - start)
+            chunks.append(chunk)
+            newlines += chunk.count(b"\n")
+            end = start
+
+    data = b"".join(reversed(chunks))
+    if data.endswith(b"\n"):
+        data = data[:-1]
+    return _decode_lines(data)[-lines:], size
+
+
+class LogFollower:
+    """从指定偏移开始读取日志文件新增的完整行"""
+
+    def __init__(self, path: str, offset: int = 0):
+        self.path = path
+        self.offset = offset
+        self._file = None
+        self._inode: Optional[int] = None
+        self._partial = b""
+
+    def read_new(self) -> List[str]:
+        """读取新增的完整行，文件截断时从头读取，被替换时重新打开"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+
+        if self._file is None or stat.st_ino != self._inode:
+            if self._file is not None:
+                self._file.close()
+                self.offset, self._partial = 0, b""
+            try:
+                self._file = open(self.path, 'rb')
+            except FileNotFoundError:
+                self._file = None
+                return []
+            self._inode = stat.st_ino
+
+        if stat.st_size < self.offset:
+            self.offset, self._partial = 0, b""
+        if stat.st_size == self.offset:
+            return []
+
+        self._file.seek(self.offset)
+        data = self._file.read(MAX_READ_BYTES)
+        self.offset += len(data)
+        *complete, self._partial = (self._partial + data).split(b"\n")
+        return [line.decode('utf-8', errors='replace') for line in complete]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+async def follow_log(path: str, offset: int,
+                     heartbeat: float = HEARTBEAT_INTERVAL) -> AsyncIterator[List[str]]:
+    """
+    持续产出日志新增的行，空列表表示保活
+
+    监听日志所在目录（文件尚未创建或被替换时仍能收到通知），事件到达后才读取；
+    不支持inotify时按POLL_INTERVAL轮询
+    """
+    follower = LogFollower(path, offset)
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    watcher: Optional[Inotify] = None
+    if inotify.is_available():
+        try:
+            watcher = Inotify()
+            watcher.add_watch(os.path.dirname(path) or ".", _WATCH_MASK)
+            loop.add_reader(watcher.fileno(), wake.set)
+        except OSError:
+            if watcher is not None:
+                watcher.close()
+            watcher = None
+
+    last_sent = time.monotonic()
+    try:
+        while True:
+            lines = follower.read_new()
+            if lines:
+                last_sent = time.monotonic()
+                yield lines
+                continue
+
+            timeout = max(heartbeat - (time.monotonic() - last_sent), 0)
+            if watcher is None:
+                timeout = min(timeout, POLL_INTERVAL)
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                if time.monotonic() - last_sent >= heartbeat:
+                    last_sent = time.monotonic()
+                    yield []
+                continue
+
+            # 取出事件即可，是否有新内容由文件大小判断
+            wake.clear()
+            watcher.read_events(0)
+    finally:
+        if watcher is not None:
+            loop.remove_reader(watcher.fileno())
+            watcher.close()
+        follower.close()
+
+
+def format_sse(lines: List[str]) -> bytes:
+    """日志行编码为SSE事件，每行一个事件；空列表编码为保活注释"""
+    if not lines:
+        return b": keepalive\n\n"
+    # SSE把\r视为换行
+    return "".join(f"data: {line.replace(chr(13), '')}\n\n" for line in lines).encode('utf-8')
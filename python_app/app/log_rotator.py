@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 显示器日志轮转
+作者: Xander Xu
+
+定期检查每个用户的启动输出日志（log_dir/<用户名>_display_<n>.log）和KasmVNC日志
+（~/.vnc/*.log），超过大小或距上次轮转超过时间后轮转：
+- 采用copytruncate: 复制内容到归档文件后截断原文件。kasmvncserver等写入方以追加模式
+  打开日志，截断后继续写在新的文件末尾，无需通知或重启进程
+- 归档文件名为 <日志>-<时间戳>，由独立的压缩线程gzip压缩，轮转检查不等待压缩
+- 每个日志只保留最近log_rotate_keep个归档
+复制和截断之间写入的少量内容会再追加复制一次，仍可能丢失截断瞬间写入的数据。
+"""
+
+import os
+import glob
+import gzip
+import json
+import queue
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .models import VNCUser
+
+
+# 归档文件名中的时间戳格式
+ARCHIVE_TIME_FORMAT = "%Y%m%d-%H%M%S"
+
+# 复制后追补新增内容的最大次数
+MAX_CATCHUP_COPIES = 3
+
+# 保留的轮转记录数
+HISTORY_SIZE = 100
+
+
+def archive_files(log_file: str) -> List[str]:
+    """日志的归档文件，按名称（即轮转时间）从旧到新排列"""
+    return sorted(path for path in glob.glob(f"{glob.escape(log_file)}-*")
+                  if not path.endswith(".tmp"))
+
+
+class LogRotator:
+    """显示器日志轮转器"""
+
+    def __init__(self, manager, state_file: str = "log_rotation.json"):
+        self.manager = manager
+        self.logger = manager.logger
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._compress_thread: Optional[threading.Thread] = None
+        self._compress_queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        # 正在排队或压缩的归档，避免重复入队
+        self._compressing = set()
+        # 日志路径 -> 上次轮转时间（首次发现时记为发现时间）
+        self.last_rotated: Dict[str, float] = {}
+        self.history: List[Dict] = []
+        self.scan_count = 0
+        self.rotated_count = 0
+        self.compressed_count = 0
+        self.saved_bytes = 0
+        self.last_scan_time: Optional[float] = None
+        self.load()
+
+    def load(self):
+        """从文件加载轮转时间"""
+        if not os.path.exists(self.state_file):
+            return
+        with open(self.state_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.last_rotated = {path: float(ts) for path, ts in data.get("last_rotated", {}).items()}
+
+    def save(self):
+        """保存轮转时间到文件（调用方持有锁）"""
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"last_rotated": self.last_rotated}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, self.state_file)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动轮转线程和压缩线程"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._compress_thread = threading.Thread(target=self._compress_worker, name="log-compressor", daemon=True)
+        self._compress_thread.start()
+        self._thread = threading.Thread(target=self._run, name="log-rotator", daemon=True)
+        self._thread.start()
+        config = self.manager.config
+        self.logger.info(
+            f"日志轮转已启动: 检查间隔 {config.log_rotate_interval}s, "
+            f"大小上限 {config.log_rotate_max_bytes} 字节, 时间上限 {config.log_rotate_max_age}s"
+        )
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join(timeout=10)
+        self._thread = None
+        # 压缩线程处理完已入队的归档后退出
+        self._compress_queue.put(None)
+        if self._compress_thread is not None:
+            self._compress_thread.join(timeout=30)
+            self._compress_thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(max(self.manager.config.log_rotate_interval, 1)):
+            if not self.manager.config.log_rotate_enabled:
+                continue
+            try:
+                self.rotate()
+            except Exception as e:
+                self.logger.error(f"日志轮转失败: {e}")
+
+    def _users(self) -> List[VNCUser]:
+        """需要轮转日志的用户，包括预启动池账号"""
+        return self.manager.load_users_data() + list(self.manager.warm_pool.accounts)
+
+    def user_log_files(self, user: VNCUser) -> List[str]:
+        """用户的当前日志文件: 各显示器的启动输出日志和 ~/.vnc 下的KasmVNC日志"""
+        files = [display.log_file or self.manager.display_log_file(user.username, display.display_number)
+                 for display in user.displays]
+        files += glob.glob(os.path.join(glob.escape(user.home_directory), ".vnc", "*.log"))
+        return [path for path in dict.fromkeys(files) if os.path.isfile(path)]
+
+    def rotate(self, force: bool = False) -> List[Dict]:
+        """
+        检查并轮转所有用户的日志，返回本次轮转记录
+
+        force为True时轮转所有非空日志
+        """
+        config = self.manager.config
+        now = time.time()
+        rotated = []
+        with self._lock:
+            seen = set()
+            for user in self._users():
+                for log_file in self.user_log_files(user):
+                    seen.add(log_file)
+                    last_rotated = self.last_rotated.setdefault(log_file, now)
+                    try:
+                        size = os.path.getsize(log_file)
+                    except OSError:
+                        continue
+                    if size == 0:
+                        continue
+
+                    reason = None
+                    if force:
+                        reason = "manual"
+                    elif config.log_rotate_max_bytes and size >= config.log_rotate_max_bytes:
+                        reason = "size"
+                    elif config.log_rotate_max_age and now - last_rotated >= config.log_rotate_max_age:
+                        reason = "age"
+                    if reason is None:
+                        continue
+
+                    try:
+                        archive, copied = self._copytruncate(log_file, now)
+                    except OSError as e:
+                        self.logger.warning(f"轮转日志 {log_file} 失败: {e}")
+                        continue
+                    self.last_rotated[log_file] = now
+                    self._prune(log_file)
+                    record = {
+                        "username": user.username,
+                        "log_file": log_file,
+                        "archive": archive,
+                        "bytes": copied,
+                        "reason": reason,
+                        "timestamp": now
+                    }
+                    rotated.append(record)
+                    self._record(record)
+
+            # 已删除的日志不再跟踪
+            for log_file in set(self.last_rotated) - seen:
+                del self.last_rotated[log_file]
+            self.save()
+            self.scan_count += 1
+            self.last_scan_time = now
+
+        # 包括之前未压缩完的归档（如进程退出时仍在队列中）
+        if config.log_rotate_compress:
+            for log_file in seen:
+                for archive in archive_files(log_file):
+                    if not archive.endswith(".gz"):
+                        self._enqueue_compress(archive)
+        return rotated
+
+    def _copytruncate(self, log_file: str, now: float):
+        """复制日志到归档文件后截断原文件，返回 (归档路径, 复制字节数)"""
+        archive = f"{log_file}-{time.strftime(ARCHIVE_TIME_FORMAT, time.localtime(now))}"
+        suffix = 1
+        while os.path.exists(archive) or os.path.exists(f"{archive}.gz"):
+            archive = f"{log_file}-{time.strftime(ARCHIVE_TIME_FORMAT, time.localtime(now))}.{suffix}"
+            suffix += 1
+
+        stat = os.stat(log_file)
+        with open(log_file, 'rb') as src, open(archive, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+            copied = dst.tell()
+            # 复制期间写入方追加的内容
+            for _ in range(MAX_CATCHUP_COPIES):
+                if os.path.getsize(log_file) <= copied:
+                    break
+                shutil.copyfileobj(src, dst)
+                copied = dst.tell()
+            os.truncate(log_file, 0)
+        self._chown_like(archive, stat)
+        return archive, copied
+
+    @staticmethod
+    def _chown_like(path: str, stat: os.stat_result):
+        """归档文件与原日志同属主和权限，用户可读取自己的归档"""
+        try:
+            os.chmod(path, stat.st_mode & 0o777)
+            os.chown(path, stat.st_uid, stat.st_gid)
+        except OSError:
+            pass
+
+    def _prune(self, log_file: str):
+        """只保留最近log_rotate_keep个归档"""
+        keep = max(self.manager.config.log_rotate_keep, 0)
+        archives = archive_files(log_file)
+        for archive in archives[:len(archives) - keep]:
+            if archive in self._compressing:
+                continue
+            try:
+                os.remove(archive)
+            except OSError:
+                pass
+
+    def _enqueue_compress(self, archive: str):
+        if archive in self._compressing:
+            return
+        self._compressing.add(archive)
+        self._compress_queue.put(archive)
+
+    def _compress_worker(self):
+        while True:
+            archive = self._compress_queue.get()
+            if archive is None:
+                return
+            try:
+                self._compress(archive)
+            except OSError as e:
+                self.logger.warning(f"压缩日志归档 {archive} 失败: {e}")
+            finally:
+                self._compressing.discard(archive)
+
+    def _compress(self, archive: str):
+        """gzip压缩归档，完成后删除未压缩的文件"""
+        if not os.path.exists(archive):
+            return
+        stat = os.stat(archive)
+        target = f"{archive}.gz"
+        tmp_file = f"{target}.tmp"
+        with open(archive, 'rb') as src, gzip.open(tmp_file, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        self._chown_like(tmp_file, stat)
+        os.replace(tmp_file, target)
+        os.remove(archive)
+        compressed_size = os.path.getsize(target)
+        with self._lock:
+            self.compressed_count += 1
+            self.saved_bytes += max(stat.st_size - compressed_size, 0)
+
+    def _record(self, record: Dict):
+        self.rotated_count += 1
+        self.history.append(record)
+        if len(self.history) > HISTORY_SIZE:
+            self.history = self.history[-HISTORY_SIZE:]
+        self.logger.info(
+            f"日志已轮转 ({record['reason']}): {record['log_file']} -> {record['archive']} ({record['bytes']} 字节)"
+        )
+
+    def user_usage(self, user: VNCUser) -> Dict:
+        """用户日志占用的磁盘空间: 当前日志、未压缩归档和压缩归档"""
+        usage = {"username": user.username, "log_bytes": 0, "archive_bytes": 0,
+                 "compressed_bytes": 0, "files": 0}
+        for log_file in self.user_log_files(user):
+            for path in [log_file] + archive_files(log_file):
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                if path == log_file:
+                    usage["log_bytes"] += size
+                elif path.endswith(".gz"):
+                    usage["compressed_bytes"] += size
+                else:
+                    usage["archive_bytes"] += size
+                usage["files"] += 1
+        usage["total_bytes"] = usage["log_bytes"] + usage["archive_bytes"] + usage["compressed_bytes"]
+        return usage
+
+    def usage(self, username: Optional[str] = None) -> List[Dict]:
+        """各用户日志磁盘占用，按总量从大到小排列"""
+        users = [user for user in self._users() if username is None or user.username == username]
+        return sorted((self.user_usage(user) for user in users),
+                      key=lambda entry: entry["total_bytes"], reverse=True)
+
+    def status(self) -> Dict:
+        config = self.manager.config
+        with self._lock:
+            return {
+                "running": self.is_running(),
+                "enabled": config.log_rotate_enabled,
+                "interval": config.log_rotate_interval,
+                "max_bytes": config.log_rotate_max_bytes,
+                "max_age": config.log_rotate_max_age,
+                "keep": config.log_rotate_keep,
+                "compress": config.log_rotate_compress,
+                "tracked_logs": len(self.last_rotated),
+                "scan_count": self.scan_count,
+                "rotated_count": self.rotated_count,
+                "compressed_count": self.compressed_count,
+                "compress_pending": len(self._compressing),
+                "saved_bytes": self.saved_bytes,
+                "last_scan_time": self.last_scan_time,
+                "history": list(self.history)
+            }
@@ -7,21 +7,31 @@ KasmVNC多用户管理系统 - FastAPI主应用
 
 import os
 import time
-from typing import List, Optional
+import asyncio
+import threading
+from typing import Callable, List, Optional, Union
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException, Request, Depends
-from fastapi.templating import Jinja2Templates
+from .startup_profile import startup_profile, fast_start_enabled
+startup_profile.mark("import_start")
+
+from fastapi import FastAPI, HTTPException, Request, Depends, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
 
 from .models import (
-    VNCUser, CreateUserRequest, ServiceControlRequest, DesktopSyncRequest,
+    VNCUser, CreateUserRequest, ServiceControlRequest, DesktopSyncRequest, DesktopWatchRequest,
     SystemStatus, ApiResponse, ConfigSettings, ServiceInfo, BatchOperationResult,
-    OperationLog
+    OperationLog, PoolAcquireRequest, LogSource
 )
 from .vnc_manager import VNCManager
+from .warm_pool import PoolExhausted
+from .log_reader import resolve_log_file, tail_lines, follow_log, format_sse
+from .response_cache import ResponseCache, etag_matches
+from .serializer import api_response_bytes, dumps
+from .timing import SlowRequestLog, begin_trace, end_trace, span
 
 # 应用配置
 VERSION = "1.0.0"
@@ -63,15 +73,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# 首个请求计时中间件
+@app.middleware("http")
+async def first_request_timing(request: Request, call_next):
+    """记录启动后首个请求的耗时"""
+    if startup_profile.first_request_latency is not None:
+        return await call_next(request)
+    
+    start_time = time.time()
+    response = await call_next(request)
+    startup_profile.record_first_request(request.url.path, time.time() - start_time)
+    return response
+
+
+# 请求耗时中间件
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    """记录请求各阶段耗时，返回Server-Timing响应头，慢请求连同span树写入日志"""
+    trace = begin_trace(f"{request.method} {request.url.path}")
+    try:
+        response = await call_next(request)
+    finally:
+        end_trace(trace)
+    
+    response.headers["Server-Timing"] = trace.server_timing()
+    threshold = config.slow_request_threshold
+    if threshold > 0 and trace.root.duration >= threshold:
+        slow_request_log.write(request.method, request.url.path, str(request.query_params),
+                               response.status_code, trace)
+    return response
+
+
 # 配置设置
 config = ConfigSettings()
 
-# VNC管理器实例
-vnc_manager = VNCManager(config)
+# 慢请求日志
+slow_request_log = SlowRequestLog(os.path.join(config.log_dir, "slow_requests.log"))
+
+# VNC管理器实例，快速启动模式下首次使用时才构建
+vnc_manager: Optional[VNCManager] = None
+_manager_lock = threading.Lock()
+
+# 只读接口响应缓存
+response_cache = ResponseCache()
 
-# 模板和静态文件
+# 模板和静态文件（模板在首次渲染页面时加载）
 current_dir = Path(__file__).parent.parent
-templates = Jinja2Templates(directory=str(current_dir / "templates"))
+_templates = None
 app.mount("/static", StaticFiles(directory=str(current_dir / "static")), name="static")
 
 # 全局变量
@@ -81,9 +130,30 @@ app_start_time = time.time()
 # 依赖注入
 def get_vnc_manager() -> VNCManager:
     """获取VNC管理器实例"""
+    global vnc_manager
+    if vnc_manager is None:
+        with _manager_lock:
+            if vnc_manager is None:
+                startup_profile.mark("manager_start")
+                vnc_manager = VNCManager(config)
+                startup_profile.mark("manager_ready")
     return vnc_manager
 
 
+def get_templates():
+    """获取模板引擎"""
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory=str(current_dir / "templates"))
+    return _templates
+
+
+# 非快速启动模式下导入时即构建管理器（保持原有行为）
+if not fast_start_enabled():
+    get_vnc_manager()
+
+
 def get_config() -> ConfigSettings:
     """获取配置设置"""
     return config
@@ -100,6 +170,33 @@ def error_response(message="操作失败", data=None):
     return ApiResponse(success=False, message=message, data=data)
 
 
+def cached_response(request: Request, ttl: float,
+                    build: Callable[[], Union[ApiResponse, bytes]]) -> Response:
+    """
+    带缓存的只读接口响应
+    
+    以请求路径和参数为键，状态版本号变化或超过ttl时重新生成；
+    build可返回ApiResponse或已编码的响应体；
+    支持If-None-Match，内容未变化时返回304。
+    """
+    key = request.url.path + "?" + str(request.query_params)
+    version = get_vnc_manager().state_version
+    entry = response_cache.get(key, version, ttl)
+    if entry is None:
+        with span("build"):
+            body = build()
+        if not isinstance(body, bytes):
+            with span("serialize"):
+                body = dumps(jsonable_encoder(body))
+        entry = response_cache.put(key, version, body)
+    
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        response_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
 # ============================================================================
 # Web 页面路由
 # ============================================================================
@@ -107,7 +204,7 @@ def error_response(message="操作失败", data=None):
 @app.get("/", response_class=HTMLResponse, summary="主页")
 async def home_page(request: Request):
     """主页"""
-    return templates.TemplateResponse("index.html", {
+    return get_templates().TemplateResponse("index.html", {
         "request": request,
         "title": TITLE,
         "version": VERSION
@@ -117,7 +214,7 @@ async def home_page(request: Request):
 @app.get("/users", response_class=HTMLResponse, summary="用户管理页面")
 async def users_page(request: Request):
     """用户管理页面"""
-    return templates.TemplateResponse("users.html", {
+    return get_templates().TemplateResponse("users.html", {
         "request": request,
         "title": "用户管理"
     })
@@ -126,7 +223,7 @@ async def users_page(request: Request):
 @app.get("/services", response_class=HTMLResponse, summary="服务管理页面")
 async def services_page(request: Request):
     """服务管理页面"""
-    return templates.TemplateResponse("services.html", {
+    return get_templates().TemplateResponse("services.html", {
         "request": request,
         "title": "服务管理"
     })
@@ -135,7 +232,7 @@ async def services_page(request: Request):
 @app.get("/monitor", response_class=HTMLResponse, summary="系统监控页面")
 async def monitor_page(request: Request):
     """系统监控页面"""
-    return templates.TemplateResponse("monitor.html", {
+    return get_templates().TemplateResponse("monitor.html", {
         "request": request,
         "title": "系统监控"
     })
@@ -144,7 +241,7 @@ async def monitor_page(request: Request):
 @app.get("/settings", response_class=HTMLResponse, summary="系统设置页面")
 async def settings_page(request: Request):
     """系统设置页面"""
-    return templates.TemplateResponse("settings.html", {
+    return get_templates().TemplateResponse("settings.html", {
         "request": request,
         "title": "系统设置"
     })
@@ -179,27 +276,57 @@ async def create_users(
 
 
 @app.get("/api/users", response_model=ApiResponse, summary="获取用户列表")
-async def get_users(manager: VNCManager = Depends(get_vnc_manager)):
-    """获取所有用户列表"""
-    try:
-        users = manager.load_users_data()
+async def get_users(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    status: Optional[str] = None,
+    https_enabled: Optional[bool] = None,
+    prefix: Optional[str] = None,
+    fields: Optional[str] = None,
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """
+    获取用户列表，支持ETag条件请求
+    
+    - **cursor**: 分页游标（上一页返回的next_cursor）
+    - **limit**: 每页数量 (1-1000)，不指定返回全部
+    - **status**: 按状态过滤 (running, stopped)
+    - **https_enabled**: 按HTTPS状态过滤
+    - **prefix**: 按用户名前缀过滤
+    - **fields**: 返回字段，逗号分隔，如 username,https_enabled；未请求displays时不查询进程状态
+    """
+    def build():
+        field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+        try:
+            result = manager.query_users(
+                cursor=cursor, limit=limit, status=status,
+                https_enabled=https_enabled, prefix=prefix, fields=field_list
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # 更新用户状态
-        for user in users:
-            for display in user.displays:
-                proc = manager.get_process_by_display(display.display_number)
-                if proc:
-                    display.status = "running"
-                    display.pid = proc.pid
-                    user.last_active = time.time()
-                else:
-                    display.status = "stopped"
-                    display.pid = None
+        page = result["users"]
+        if field_list is None:
+            users_json = manager.encode_users(page)
+        else:
+            with span("serialize"):
+                include = set(field_list)
+                users_json = dumps([user.model_dump(mode="json", include=include) for user in page])
         
-        return success_response(
-            data={"users": [user.model_dump() for user in users]},
-            message=f"获取到 {len(users)} 个用户"
+        return api_response_bytes(
+            {
+                "users": users_json,
+                "total": dumps(result["total"]),
+                "next_cursor": dumps(result["next_cursor"])
+            },
+            message=f"获取到 {len(page)}/{result['total']} 个用户"
         )
+    
+    try:
+        return cached_response(request, manager.config.response_cache_ttl, build)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -207,10 +334,11 @@ async def get_users(manager: VNCManager = Depends(get_vnc_manager)):
 @app.get("/api/users/{username}", response_model=ApiResponse, summary="获取用户详情")
 async def get_user_detail(
     username: str,
+    request: Request,
     manager: VNCManager = Depends(get_vnc_manager)
 ):
-    """获取指定用户的详细信息"""
-    try:
+    """获取指定用户的详细信息，支持ETag条件请求"""
+    def build():
         users = manager.load_users_data()
         user = next((u for u in users if u.username == username), None)
         
@@ -218,20 +346,15 @@ async def get_user_detail(
             raise HTTPException(status_code=404, detail=f"用户 {username} 不存在")
         
         # 更新用户状态
-        for display in user.displays:
-            proc = manager.get_process_by_display(display.display_number)
-            if proc:
-                display.status = "running"
-                display.pid = proc.pid
-                user.last_active = time.time()
-            else:
-                display.status = "stopped"
-                display.pid = None
+        manager.update_users_status([user])
         
         return success_response(
             data={"user": user.model_dump()},
             message=f"获取用户 {username} 信息成功"
         )
+    
+    try:
+        return cached_response(request, manager.config.response_cache_ttl, build)
     except HTTPException:
         raise
     except Exception as e:
@@ -253,12 +376,23 @@ async def delete_user(
             raise HTTPException(status_code=404, detail=f"用户 {username} 不存在")
         
         # 停止所有显示器
-        for display in user.displays:
-            manager.stop_vnc_display(username, display.display_number)
+        await asyncio.get_running_loop().run_in_executor(
+            None, manager.stop_vnc_displays, [(username, display.display_number) for display in user.displays]
+        )
         
         # 从用户列表中移除
         users = [u for u in users if u.username != username]
         manager.save_users_data(users)
+        manager.sync_manifests.remove_target(username)
+        manager.sync_manifests.save()
+        manager.cgroups.remove_user_cgroup(username)
+        for display in user.displays:
+            manager.placement.release(display.display_number)
+            manager.encoder_tuner.clear(display.display_number)
+        await asyncio.get_running_loop().run_in_executor(None, manager.warm_pool.release_user, username)
+        manager.connections.remove_user(username)
+        manager.throughput.remove_user(username)
+        manager.disk_usage.remove_user(username)
         
         return success_response(message=f"用户 {username} 删除成功")
     except HTTPException:
@@ -302,26 +436,34 @@ async def control_service(
         if not displays_to_operate:
             raise HTTPException(status_code=400, detail="未找到要操作的显示器")
         
+        if request.action not in ["start", "stop", "restart"]:
+            raise HTTPException(status_code=400, detail=f"不支持的操作: {request.action}")
+        
+        # 停止和重启时所有显示器一起停止
+        stopped = {}
+        if request.action in ["stop", "restart"]:
+            stopped = await asyncio.get_running_loop().run_in_executor(
+                None, manager.stop_vnc_displays,
+                [(request.username, display.display_number) for display in displays_to_operate]
+            )
+        
         results = []
         for display in displays_to_operate:
             display_num = display.display_number
-            success = False
             
-            if request.action == "start":
-                success = manager.start_vnc_display(request.username, display_num)
-            elif request.action == "stop":
-                success = manager.stop_vnc_display(request.username, display_num)
-            elif request.action == "restart":
-                manager.stop_vnc_display(request.username, display_num)
-                time.sleep(2)
-                success = manager.start_vnc_display(request.username, display_num)
+            if request.action == "stop":
+                success = stopped[display_num]
             else:
-                raise HTTPException(status_code=400, detail=f"不支持的操作: {request.action}")
+                # 启动可能在准入队列中等待，不阻塞事件循环
+                success = await asyncio.get_running_loop().run_in_executor(
+                    None, manager.start_vnc_display, request.username, display_num
+                )
             
             results.append({
                 "display": display_num,
                 "action": request.action,
-                "success": success
+                "success": success,
+                "error": None if success else manager.display_errors.get(display_num)
             })
         
         success_count = sum(1 for r in results if r["success"])
@@ -341,6 +483,7 @@ async def control_service(
 async def batch_control_services(
     action: str,
     usernames: Optional[List[str]] = None,
+    timeout: Optional[float] = Query(None, ge=0, description="停止时统一等待的时间（秒），不指定则使用配置"),
     manager: VNCManager = Depends(get_vnc_manager)
 ):
     """
@@ -348,6 +491,7 @@ async def batch_control_services(
     
     - **action**: 操作类型 (start, stop, restart)
     - **usernames**: 用户名列表（可选，不指定则操作所有用户）
+    - **timeout**: 停止时所有显示器同时发送SIGTERM后统一等待的时间，超时后只强制停止未退出的进程
     """
     try:
         if action not in ["start", "stop", "restart"]:
@@ -362,6 +506,15 @@ async def batch_control_services(
         if not users:
             raise HTTPException(status_code=400, detail="未找到要操作的用户")
         
+        # 停止和重启时整批显示器一起停止，总耗时受单个超时约束
+        stopped = {}
+        if action in ["stop", "restart"]:
+            stopped = await asyncio.get_running_loop().run_in_executor(
+                None, manager.stop_vnc_displays,
+                [(user.username, display.display_number) for user in users for display in user.displays],
+                timeout
+            )
+        
         results = []
         total_displays = 0
         success_displays = 0
@@ -372,23 +525,21 @@ async def batch_control_services(
             for display in user.displays:
                 total_displays += 1
                 display_num = display.display_number
-                success = False
                 
-                if action == "start":
-                    success = manager.start_vnc_display(user.username, display_num)
-                elif action == "stop":
-                    success = manager.stop_vnc_display(user.username, display_num)
-                elif action == "restart":
-                    manager.stop_vnc_display(user.username, display_num)
-                    time.sleep(1)
-                    success = manager.start_vnc_display(user.username, display_num)
+                if action == "stop":
+                    success = stopped[display_num]
+                else:
+                    success = await asyncio.get_running_loop().run_in_executor(
+                        None, manager.start_vnc_display, user.username, display_num
+                    )
                 
                 if success:
                     success_displays += 1
                 
                 user_results.append({
                     "display": display_num,
-                    "success": success
+                    "success": success,
+                    "error": None if success else manager.display_errors.get(display_num)
                 })
             
             results.append({
@@ -412,27 +563,31 @@ async def batch_control_services(
 # ============================================================================
 
 @app.get("/api/status", response_model=ApiResponse, summary="获取系统状态")
-async def get_system_status(manager: VNCManager = Depends(get_vnc_manager)):
-    """获取系统状态信息"""
-    try:
+async def get_system_status(request: Request, manager: VNCManager = Depends(get_vnc_manager)):
+    """获取系统状态信息，资源指标短时缓存"""
+    def build():
         status = manager.get_system_status()
         return success_response(
             data={"status": status.model_dump()},
             message="获取系统状态成功"
         )
+    
+    try:
+        return cached_response(request, manager.config.volatile_cache_ttl, build)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/info", response_model=ApiResponse, summary="获取服务信息")
 async def get_service_info(
+    request: Request,
     manager: VNCManager = Depends(get_vnc_manager),
     config: ConfigSettings = Depends(get_config)
 ):
     """获取服务基本信息"""
-    try:
-        # 检查依赖
-        deps_ok, missing_deps = manager.check_dependencies()
+    def build():
+        # 检查依赖（使用缓存结果）
+        deps_ok, missing_deps = manager.check_dependencies(use_cache=True)
         
         # 统计信息
         users = manager.load_users_data()
@@ -448,7 +603,10 @@ async def get_service_info(
                 "total_users": len(users),
                 "dependencies_ok": deps_ok,
                 "missing_dependencies": missing_deps,
-                "recent_operations": len(logs)
+                "recent_operations": len(logs),
+                "response_cache": response_cache.stats(),
+                "slow_requests": slow_request_log.count,
+                "user_snapshots": manager.user_snapshots.stats()
             }
         )
         
@@ -456,6 +614,9 @@ async def get_service_info(
             data={"info": service_info.model_dump()},
             message="获取服务信息成功"
         )
+    
+    try:
+        return cached_response(request, manager.config.response_cache_ttl, build)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -476,6 +637,603 @@ async def get_operation_logs(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/startup", response_model=ApiResponse, summary="获取启动耗时报告")
+async def get_startup_report():
+    """获取启动耗时报告：打包解压、解释器、模块导入、应用构建及首个请求耗时"""
+    return success_response(
+        data={"startup": startup_profile.report()},
+        message="获取启动耗时报告成功"
+    )
+
+
+@app.get("/api/slow-requests", response_model=ApiResponse, summary="获取慢请求日志")
+async def get_slow_requests(limit: int = Query(50, ge=1, le=1000)):
+    """获取最近的慢请求及其各阶段耗时，阈值由 slow_request_threshold 配置"""
+    try:
+        records = slow_request_log.recent(limit=limit)
+        return success_response(
+            data={
+                "threshold": config.slow_request_threshold,
+                "requests": records
+            },
+            message=f"获取到 {len(records)} 条慢请求"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/commands", response_model=ApiResponse, summary="获取外部命令执行统计")
+async def get_command_stats(
+    limit: int = Query(50, ge=0, le=500),
+    name: Optional[str] = None,
+    failed_only: bool = False,
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """
+    获取外部命令（useradd、openssl、su等）的耗时统计和最近执行记录
+    
+    - **limit**: 返回的最近记录数
+    - **name**: 按命令名称过滤，如 openssl、su:kasmvncpasswd
+    - **failed_only**: 只返回失败的记录
+    """
+    try:
+        stats = manager.commands.stats()
+        return success_response(
+            data={
+                "stats": stats,
+                "recent": manager.commands.recent(limit=limit, name=name, failed_only=failed_only)
+            },
+            message=f"获取到 {len(stats)} 个命令的统计"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/cleanup/idle", response_model=ApiResponse, summary="获取空闲会话回收状态")
+async def get_idle_reaper_status(manager: VNCManager = Depends(get_vnc_manager)):
+    """获取空闲会话回收状态：各会话的客户端数、空闲时长及回收记录"""
+    try:
+        return success_response(
+            data={"reaper": manager.idle_reaper.status()},
+            message="获取空闲会话回收状态成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/cleanup/idle/run", response_model=ApiResponse, summary="立即检查空闲会话")
+async def run_idle_reaper(
+    dry_run: bool = False,
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """
+    立即检查一次空闲会话
+    
+    - **dry_run**: 为true时只返回将被回收的会话，不停止
+    """
+    try:
+        sessions = await asyncio.get_running_loop().run_in_executor(None, manager.idle_reaper.scan, dry_run)
+        return success_response(
+            data={"sessions": sessions, "dry_run": dry_run},
+            message=f"{'将回收' if dry_run else '已回收'} {len(sessions)} 个空闲会话"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/activation", response_model=ApiResponse, summary="获取按需启动状态")
+async def get_activation_status(manager: VNCManager = Depends(get_vnc_manager)):
+    """获取按需启动状态：各显示器的监听端口、后端端口、连接数和启动耗时"""
+    try:
+        return success_response(
+            data={"activation": manager.activator.status()},
+            message="获取按需启动状态成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/activation/start", response_model=ApiResponse, summary="开启按需启动")
+async def start_activation(manager: VNCManager = Depends(get_vnc_manager)):
+    """
+    开启按需启动：在各显示器的websocket端口监听，首个连接时启动显示器
+    
+    以普通模式运行在公开端口上的显示器需先停止，否则其端口无法监听
+    """
+    try:
+        manager.config.activation_enabled = True
+        manager.activator.start()
+        return success_response(
+            data={"activation": manager.activator.status()},
+            message="按需启动已开启"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/activation/stop", response_model=ApiResponse, summary="关闭按需启动")
+async def stop_activation(manager: VNCManager = Depends(get_vnc_manager)):
+    """关闭按需启动，已启动的显示器继续运行在内部端口"""
+    try:
+        manager.activator.stop()
+        manager.config.activation_enabled = False
+        return success_response(message="按需启动已关闭")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/proxy", response_model=ApiResponse, summary="获取反向代理状态")
+async def get_proxy_status(manager: VNCManager = Depends(get_vnc_manager)):
+    """获取反向代理状态：TLS握手及会话恢复次数、各路由连接数、连接池命中"""
+    try:
+        return success_response(
+            data={"proxy": manager.session_proxy.status()},
+            message="获取反向代理状态成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/proxy/start", response_model=ApiResponse, summary="启动反向代理")
+async def start_proxy(manager: VNCManager = Depends(get_vnc_manager)):
+    """启动统一入口反向代理，通过 /session/<用户名>/<显示器>/ 访问各显示器"""
+    try:
+        manager.config.proxy_enabled = True
+        manager.session_proxy.start()
+        return success_response(
+            data={"proxy": manager.session_proxy.status()},
+            message="反向代理已启动"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/proxy/stop", response_model=ApiResponse, summary="停止反向代理")
+async def stop_proxy(manager: VNCManager = Depends(get_vnc_manager)):
+    """停止反向代理"""
+    try:
+        manager.session_proxy.stop()
+        manager.config.proxy_enabled = False
+        return success_response(message="反向代理已停止")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/admission", response_model=ApiResponse, summary="获取启动准入状态")
+async def get_admission_status(manager: VNCManager = Depends(get_vnc_manager)):
+    """获取启动准入状态：单个显示器的学习开销、预留资源、下一次启动的预估余量及决策记录"""
+    try:
+        manager.admission.observe()
+        return success_response(
+            data={"admission": manager.admission.status()},
+            message="获取启动准入状态成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/cgroups", response_model=ApiResponse, summary="获取用户cgroup资源使用")
+async def get_cgroup_usage(
+    username: Optional[str] = None,
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """
+    获取各用户cgroup的限制和使用量（CPU时间、内存、OOM事件、IO字节数）
+    
+    - **username**: 只返回指定用户
+    """
+    try:
+        usernames = [username] if username else [u.username for u in manager.load_users_data()]
+        return success_response(
+            data={"cgroups": manager.cgroups.status(usernames)},
+            message="获取cgroup资源使用成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/placement", response_model=ApiResponse, summary="获取显示器CPU/NUMA放置")
+async def get_placement(manager: VNCManager = Depends(get_vnc_manager)):
+    """获取NUMA拓扑、每个CPU上的显示器数及各显示器分配的节点、CPU和RectThreads"""
+    try:
+        return success_response(
+            data={"placement": manager.placement.status()},
+            message="获取放置信息成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/placement/rebalance", response_model=ApiResponse, summary="重新均衡显示器放置")
+async def rebalance_placement(manager: VNCManager = Depends(get_vnc_manager)):
+    """重新读取拓扑并为全部显示器重新分配节点和CPU，显示器下次启动时生效"""
+    try:
+        display_nums = [display.display_number for user in manager.load_users_data()
+                        for display in user.displays]
+        placements = manager.placement.rebalance(display_nums)
+        return success_response(
+            data={"placements": {str(num): placement.to_dict() for num, placement in placements.items()}},
+            message=f"已重新分配 {len(placements)} 个显示器的放置，下次启动时生效"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/encoder-tuning", response_model=ApiResponse, summary="获取编码参数调优状态")
+async def get_encoder_tuning(manager: VNCManager = Depends(get_vnc_manager)):
+    """获取主机CPU饱和度、各显示器运行中与下次启动的编码设置、调优建议及决策记录"""
+    try:
+        return success_response(
+            data={"tuning": manager.encoder_tuner.status()},
+            message="获取编码参数调优状态成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/encoder-tuning/run", response_model=ApiResponse, summary="立即执行一次编码参数调优")
+async def run_encoder_tuning(
+    apply: Optional[bool] = None,
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """
+    立即采样一次并给出调优决策，调整需连续两次采样满足条件
+    
+    - **apply**: 是否使调整在下次启动时生效，不指定时按encoder_tune_mode
+    """
+    try:
+        decisions = manager.encoder_tuner.scan(apply=apply)
+        return success_response(
+            data={"decisions": decisions},
+            message=f"编码参数调优完成，{len(decisions)} 项调整"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.delete("/api/encoder-tuning/{display_number}", response_model=ApiResponse, summary="清除显示器的编码调优设置")
+async def clear_encoder_tuning(
+    display_number: int,
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """清除显示器的调优设置和建议，下次启动时恢复全局配置"""
+    try:
+        if not manager.encoder_tuner.clear(display_number):
+            raise HTTPException(status_code=404, detail=f"显示器 :{display_number} 没有调优设置")
+        return success_response(message=f"显示器 :{display_number} 的调优设置已清除，下次启动时生效")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/pool", response_model=ApiResponse, summary="获取预启动显示器池状态")
+async def get_warm_pool(manager: VNCManager = Depends(get_vnc_manager)):
+    """获取池大小、空闲/已分配显示器、命中次数和分配耗时"""
+    try:
+        return success_response(
+            data={"pool": manager.warm_pool.status()},
+            message="获取预启动显示器池状态成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/pool/acquire", response_model=ApiResponse, summary="分配预启动显示器")
+async def acquire_pool_display(
+    request: PoolAcquireRequest,
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """
+    为用户分配一个已启动的空闲显示器，返回VNC账号、新密码和反向代理路径
+    
+    没有空闲显示器时返回503，可改用普通方式启动用户自己的显示器
+    """
+    try:
+        if not any(user.username == request.username for user in manager.load_users_data()):
+            raise HTTPException(status_code=404, detail=f"用户 {request.username} 不存在")
+        assignment = await asyncio.get_running_loop().run_in_executor(
+            None, manager.warm_pool.acquire, request.username
+        )
+        return success_response(
+            data={"assignment": assignment},
+            message=f"已为用户 {request.username} 分配显示器 :{assignment['display_number']}"
+        )
+    except PoolExhausted as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/pool/release/{display_number}", response_model=ApiResponse, summary="释放预启动显示器")
+async def release_pool_display(
+    display_number: int,
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """停止已分配的池显示器并清空池账号主目录，后台随后重新启动备用"""
+    try:
+        if not await asyncio.get_running_loop().run_in_executor(None, manager.warm_pool.release, display_number):
+            raise HTTPException(status_code=404, detail=f"显示器 :{display_number} 未分配")
+        return success_response(message=f"显示器 :{display_number} 已释放")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/supervisor", response_model=ApiResponse, summary="获取显示器进程监管状态")
+async def get_supervisor_status(manager: VNCManager = Depends(get_vnc_manager)):
+    """获取监管器启动的显示器进程: PID、运行时长、重启次数、退出码及下次重启时间"""
+    try:
+        return success_response(
+            data={"supervisor": manager.supervisor.status()},
+            message="获取进程监管状态成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/connections", response_model=ApiResponse, summary="获取客户端连接")
+async def get_connections(
+    refresh: bool = Query(False, description="立即重新采样，不等待下一次定期采样"),
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """各显示器当前的客户端连接数、进行中会话的时长及最近结束的会话"""
+    try:
+        if refresh:
+            await asyncio.get_running_loop().run_in_executor(None, manager.connections.poll)
+        return success_response(
+            data={"connections": manager.connections.status()},
+            message="获取客户端连接成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/throughput", response_model=ApiResponse, summary="获取网络吞吐")
+async def get_throughput(
+    username: Optional[str] = Query(None, description="只返回指定用户"),
+    display_number: Optional[int] = Query(None, description="只返回指定显示器"),
+    history: int = Query(0, ge=0, description="每个显示器附带的最近速率样本数"),
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """
+    各显示器和各用户的当前发送、接收速率（字节/秒）及累计传输量
+    
+    速率样本为 [时间戳, 发送速率, 接收速率]，发送指服务器发往客户端
+    """
+    try:
+        if username is not None and manager.find_user(username) is None:
+            raise HTTPException(status_code=404, detail=f"用户 {username} 不存在")
+        collector = manager.throughput
+        return success_response(
+            data={
+                "throughput": collector.status(),
+                "displays": collector.displays_throughput(username, display_number, history),
+                "users": collector.users_throughput(username)
+            },
+            message="获取网络吞吐成功"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/disk-usage", response_model=ApiResponse, summary="获取用户主目录磁盘占用")
+async def get_disk_usage(
+    username: Optional[str] = Query(None, description="只返回指定用户"),
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """各用户主目录占用（增量维护，不执行du），以及用户主目录所在文件系统的使用情况"""
+    try:
+        if username is not None and manager.find_user(username) is None:
+            raise HTTPException(status_code=404, detail=f"用户 {username} 不存在")
+        return success_response(
+            data={
+                "disk_usage": manager.disk_usage.status(),
+                "filesystem": manager.disk_usage.filesystem_usage(),
+                "users": manager.disk_usage.usage(username)
+            },
+            message="获取磁盘占用成功"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/disk-usage/top", response_model=ApiResponse, summary="获取磁盘占用排行")
+async def get_disk_usage_top(
+    limit: int = Query(10, ge=1, le=1000, description="返回条数"),
+    username: Optional[str] = Query(None, description="指定时返回该用户占用最大的目录，否则返回占用最大的用户"),
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """占用最大的N个用户，或指定用户主目录下占用（含子目录）最大的N个目录"""
+    try:
+        if username is None:
+            return success_response(
+                data={"users": manager.disk_usage.top_users(limit)},
+                message="获取磁盘占用排行成功"
+            )
+        if manager.find_user(username) is None:
+            raise HTTPException(status_code=404, detail=f"用户 {username} 不存在")
+        return success_response(
+            data={
+                "user": manager.disk_usage.user_usage(username),
+                "directories": manager.disk_usage.top_directories(username, limit)
+            },
+            message="获取磁盘占用排行成功"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/statistics/users", response_model=ApiResponse, summary="获取用户使用统计")
+async def get_user_statistics(
+    username: Optional[str] = Query(None, description="只返回指定用户"),
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """每个用户的会话数、累计活跃时长（含进行中的会话）、最后登录时间、累计传输字节数和错误数"""
+    try:
+        statistics = manager.get_user_statistics(username)
+        if username is not None and not statistics:
+            raise HTTPException(status_code=404, detail=f"用户 {username} 不存在")
+        return success_response(
+            data={"statistics": [entry.model_dump() for entry in statistics]},
+            message="获取用户统计成功"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/health", response_model=ApiResponse, summary="检查显示器健康状态")
+async def check_display_health(
+    username: Optional[str] = Query(None, description="只检查指定用户"),
+    cached: bool = Query(False, description="返回最近一次全量检查结果，不重新检查"),
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """
+    一次检查全部显示器: 读取一次套接字表确认监听，并发发起websocket握手
+    
+    状态: stopped, not_listening, listening（握手无响应）, degraded, responsive
+    """
+    try:
+        if cached:
+            return success_response(
+                data={"health": manager.health.status()},
+                message="获取健康检查结果成功"
+            )
+        health = await manager.health.check(username)
+        return success_response(
+            data={"health": health},
+            message=f"健康检查完成，正常 {health['summary']['responsive']}/{len(health['displays'])}，"
+                    f"耗时 {health['duration_ms']} ms"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ============================================================================
+# API 路由 - 显示器日志
+# ============================================================================
+
+def _display_log_file(manager: VNCManager, username: str, display_number: int, source: LogSource) -> str:
+    """解析显示器日志路径，用户或日志不存在时返回404"""
+    try:
+        log_file = resolve_log_file(manager, username, display_number, source)
+    except (LookupError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not os.path.exists(log_file):
+        raise HTTPException(status_code=404, detail=f"日志文件不存在: {log_file}")
+    return log_file
+
+
+@app.get("/api/users/{username}/displays/{display_number}/logs", response_model=ApiResponse,
+         summary="获取显示器日志")
+async def get_display_logs(
+    username: str,
+    display_number: int,
+    lines: int = Query(100, ge=1, le=10000, description="返回最后的行数"),
+    source: LogSource = Query(LogSource.SESSION, description="session: 启动输出; server: KasmVNC日志"),
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """从文件末尾向前读取最后N行，不读取整个文件"""
+    try:
+        log_file = _display_log_file(manager, username, display_number, source)
+        log_lines, size = tail_lines(log_file, lines)
+        return success_response(
+            data={"log_file": log_file, "size": size, "lines": log_lines},
+            message=f"获取日志成功，共 {len(log_lines)} 行"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/users/{username}/displays/{display_number}/logs/stream", summary="实时推送显示器日志")
+async def stream_display_logs(
+    username: str,
+    display_number: int,
+    lines: int = Query(0, ge=0, le=10000, description="开始推送前先返回最后的行数"),
+    source: LogSource = Query(LogSource.SESSION, description="session: 启动输出; server: KasmVNC日志"),
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """
+    以SSE推送日志新增的行（每行一个事件）
+    
+    由inotify通知文件变化后读取新增部分，不为每个连接启动 tail 进程；
+    日志被截断轮转时从头继续推送
+    """
+    try:
+        log_file = _display_log_file(manager, username, display_number, source)
+        backlog, offset = tail_lines(log_file, lines)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        if backlog:
+            yield format_sse(backlog)
+        async for new_lines in follow_log(log_file, offset):
+            yield format_sse(new_lines)
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/log-rotation", response_model=ApiResponse, summary="获取日志轮转状态")
+async def get_log_rotation(manager: VNCManager = Depends(get_vnc_manager)):
+    """获取日志轮转配置、统计和最近的轮转记录"""
+    try:
+        return success_response(
+            data={"log_rotation": manager.log_rotator.status()},
+            message="获取日志轮转状态成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/log-rotation/run", response_model=ApiResponse, summary="立即检查并轮转日志")
+async def run_log_rotation(
+    force: bool = Query(False, description="轮转所有非空日志，不检查大小和时间"),
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """立即检查一次，压缩在后台进行"""
+    try:
+        rotated = await asyncio.get_running_loop().run_in_executor(None, manager.log_rotator.rotate, force)
+        return success_response(
+            data={"rotated": rotated},
+            message=f"轮转了 {len(rotated)} 个日志"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/log-rotation/usage", response_model=ApiResponse, summary="获取用户日志磁盘占用")
+async def get_log_usage(
+    username: Optional[str] = Query(None, description="只统计指定用户"),
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """各用户当前日志、未压缩归档和压缩归档占用的字节数，按总量从大到小排列"""
+    try:
+        usage = manager.log_rotator.usage(username)
+        return success_response(
+            data={"usage": usage, "total_bytes": sum(entry["total_bytes"] for entry in usage)},
+            message="获取日志磁盘占用成功"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # ============================================================================
 # API 路由 - 桌面同步
 # ============================================================================
@@ -493,8 +1251,23 @@ async def sync_desktop(
     - **sync_desktop**: 是否同步桌面文件
     - **sync_icons**: 是否同步应用图标
     - **sync_autostart**: 是否同步自启动应用
+    - **dry_run**: 模拟运行，返回每个目标用户需要新建、更新的文件，源中已删除的文件（实际同步不删除）及预估耗时
     """
     try:
+        if request.dry_run:
+            plan = manager.plan_desktop_sync(
+                source_user=request.source_user,
+                target_users=request.target_users,
+                sync_desktop=request.sync_desktop,
+                sync_icons=request.sync_icons,
+                sync_autostart=request.sync_autostart
+            )
+            return success_response(
+                data={"plan": plan},
+                message=f"同步计划: {plan['total_files']} 个文件, {plan['total_bytes']} 字节, "
+                        f"预计耗时 {plan['estimated_seconds']} 秒"
+            )
+        
         results = manager.sync_desktop(
             source_user=request.source_user,
             target_users=request.target_users,
@@ -514,6 +1287,57 @@ async def sync_desktop(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/desktop/watch/start", response_model=ApiResponse, summary="启动桌面持续同步")
+async def start_desktop_watch(
+    request: DesktopWatchRequest,
+    manager: VNCManager = Depends(get_vnc_manager)
+):
+    """
+    监听源用户桌面目录，变更经防抖合并后增量推送到目标用户
+    
+    - **source_user**: 源用户名
+    - **target_users**: 目标用户列表（空列表表示所有用户）
+    - **debounce**: 防抖时间（秒）
+    """
+    try:
+        manager.desktop_watcher.start(
+            source_user=request.source_user,
+            target_users=request.target_users,
+            sync_desktop=request.sync_desktop,
+            sync_icons=request.sync_icons,
+            sync_autostart=request.sync_autostart,
+            debounce=request.debounce
+        )
+        return success_response(
+            data={"watch": manager.desktop_watcher.status()},
+            message="桌面持续同步已启动"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/desktop/watch/stop", response_model=ApiResponse, summary="停止桌面持续同步")
+async def stop_desktop_watch(manager: VNCManager = Depends(get_vnc_manager)):
+    """停止桌面持续同步"""
+    try:
+        manager.desktop_watcher.stop()
+        return success_response(
+            data={"watch": manager.desktop_watcher.status()},
+            message="桌面持续同步已停止"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/desktop/watch", response_model=ApiResponse, summary="获取桌面持续同步状态")
+async def get_desktop_watch(manager: VNCManager = Depends(get_vnc_manager)):
+    """获取桌面持续同步状态"""
+    return success_response(
+        data={"watch": manager.desktop_watcher.status()},
+        message="获取桌面持续同步状态成功"
+    )
+
+
 # ============================================================================
 # API 路由 - 配置管理
 # ============================================================================
@@ -529,12 +1353,29 @@ async def get_config_settings(config: ConfigSettings = Depends(get_config)):
 
 @app.put("/api/config", response_model=ApiResponse, summary="更新配置")
 async def update_config_settings(new_config: ConfigSettings):
-    """更新配置设置"""
+    """
+    更新配置设置
+    
+    各后台组件每次使用时读取管理器的配置，更新后立即生效；按需启动和反向代理随开关启停
+    """
     try:
         # 这里可以实现配置持久化逻辑
         # 现在只是更新内存中的配置
         global config
         config = new_config
+        manager = get_vnc_manager()
+        manager.config = new_config
+        
+        if new_config.activation_enabled and not manager.activator.is_running():
+            manager.activator.start()
+        elif not new_config.activation_enabled and manager.activator.is_running():
+            manager.activator.stop()
+        if new_config.proxy_enabled and not manager.session_proxy.is_running():
+            manager.session_proxy.start()
+        elif not new_config.proxy_enabled and manager.session_proxy.is_running():
+            manager.session_proxy.stop()
+        
+        manager.bump_state_version()
         
         return success_response(
             data={"config": config.model_dump()},
@@ -570,6 +1411,45 @@ async def general_exception_handler(request: Request, exc: Exception):
 # 启动事件
 # ============================================================================
 
+def _check_dependencies_on_startup():
+    """启动时检查依赖"""
+    deps_ok, missing_deps = get_vnc_manager().check_dependencies()
+    if not deps_ok:
+        print(f"⚠️  警告: 缺少依赖 {missing_deps}")
+    else:
+        print("✅ 所有依赖检查通过")
+    
+    # 显示器进程监管: 回收退出的进程并按退避重启
+    get_vnc_manager().supervisor.start()
+    
+    # 空闲会话回收，auto_cleanup关闭时线程仍运行但不回收，便于运行中开启
+    get_vnc_manager().idle_reaper.start()
+    
+    # 编码参数调优，模式为off时线程仍运行但不采样，便于运行中开启
+    get_vnc_manager().encoder_tuner.start()
+    
+    # 预启动显示器池，池大小为0时线程仍运行并停止多余的空闲显示器
+    get_vnc_manager().warm_pool.start()
+    
+    # 显示器日志轮转，log_rotate_enabled关闭时线程仍运行但不轮转
+    get_vnc_manager().log_rotator.start()
+    
+    # 客户端连接跟踪: 会话统计和真实的最后活跃时间
+    get_vnc_manager().connections.start()
+    
+    # 显示器网络吞吐统计
+    get_vnc_manager().throughput.start()
+    
+    # 用户主目录磁盘占用统计，disk_usage_enabled关闭时线程仍运行但不扫描
+    get_vnc_manager().disk_usage.start()
+    
+    if get_vnc_manager().config.activation_enabled:
+        get_vnc_manager().activator.start()
+    
+    if get_vnc_manager().config.proxy_enabled:
+        get_vnc_manager().session_proxy.start()
+
+
 @app.on_event("startup")
 async def startup_event():
     """应用启动事件"""
@@ -577,18 +1457,36 @@ async def startup_event():
     print(f"📝 API文档: http://localhost:8000/api/docs")
     print(f"🌐 Web界面: http://localhost:8000")
     
-    # 检查依赖
-    deps_ok, missing_deps = vnc_manager.check_dependencies()
-    if not deps_ok:
-        print(f"⚠️  警告: 缺少依赖 {missing_deps}")
+    if fast_start_enabled():
+        # 快速启动: 立即开始接受请求，管理器构建和依赖检查在后台完成
+        asyncio.get_running_loop().run_in_executor(None, _check_dependencies_on_startup)
     else:
-        print("✅ 所有依赖检查通过")
+        _check_dependencies_on_startup()
+    
+    startup_profile.mark("app_ready")
+    report = startup_profile.report()
+    print(f"⏱️  启动耗时: {report['total_to_ready_ms']} ms {report['phases_ms']}")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭事件"""
     print(f"🛑 {TITLE} 正在关闭...")
+    if vnc_manager is not None:
+        vnc_manager.desktop_watcher.stop()
+        vnc_manager.idle_reaper.stop()
+        vnc_manager.encoder_tuner.stop()
+        vnc_manager.warm_pool.stop()
+        vnc_manager.log_rotator.stop()
+        vnc_manager.connections.stop()
+        vnc_manager.throughput.stop()
+        vnc_manager.disk_usage.stop()
+        vnc_manager.supervisor.stop()
+        vnc_manager.activator.stop()
+        vnc_manager.session_proxy.stop()
+
+
+startup_profile.mark("import_done")
 
 
 if __name__ == "__main__":
@@ -19,6 +19,19 @@ class ServiceStatus(str, Enum):
     UNKNOWN = "unknown"
 
 
+class EncoderTuneMode(str, Enum):
+    """编码参数调优模式"""
+    OFF = "off"
+    RECOMMEND = "recommend"
+    APPLY = "apply"
+
+
+class LogSource(str, Enum):
+    """显示器日志来源"""
+    SESSION = "session"
+    SERVER = "server"
+
+
 class VNCDisplay(BaseModel):
     """VNC显示器信息"""
     display_number: int = Field(..., description="显示器编号")
@@ -64,6 +77,17 @@ class DesktopSyncRequest(BaseModel):
     sync_desktop: bool = Field(True, description="同步桌面文件")
     sync_icons: bool = Field(True, description="同步应用图标")
     sync_autostart: bool = Field(True, description="同步自启动应用")
+    dry_run: bool = Field(False, description="模拟运行，只返回同步计划和预估耗时")
+
+
+class DesktopWatchRequest(DesktopSyncRequest):
+    """桌面持续同步请求"""
+    debounce: Optional[float] = Field(None, gt=0, description="防抖时间（秒），不指定则使用配置")
+
+
+class PoolAcquireRequest(BaseModel):
+    """预启动显示器分配请求"""
+    username: str = Field(..., description="使用显示器的用户名")
 
 
 class SystemStatus(BaseModel):
@@ -99,6 +123,7 @@ class OperationLog(BaseModel):
 class ConfigSettings(BaseModel):
     """配置设置"""
     base_user_home: str = Field("/home/share/user", description="用户主目录基路径")
+    source_home_base: str = Field("/home", description="桌面同步源用户主目录基路径")
     cert_dir: str = Field("certs", description="证书目录")
     log_dir: str = Field("logs", description="日志目录")
     max_users: int = Field(50, description="最大用户数量")
@@ -107,6 +132,77 @@ class ConfigSettings(BaseModel):
     enable_audio: bool = Field(True, description="启用音频支持")
     auto_cleanup: bool = Field(True, description="自动清理")
     cleanup_interval: int = Field(3600, description="清理间隔（秒）")
+    activation_enabled: bool = Field(False, description="按需启动: 管理器监听websocket端口，首个连接时才启动显示器")
+    activation_port_offset: int = Field(10000, description="按需启动时显示器实际监听端口相对websocket端口的偏移")
+    activation_timeout: float = Field(30.0, description="按需启动等待显示器就绪的超时时间（秒）")
+    proxy_enabled: bool = Field(False, description="启用统一入口反向代理 /session/<用户名>/<显示器>/")
+    proxy_port: int = Field(6900, description="反向代理监听端口")
+    proxy_https: bool = Field(True, description="反向代理终止TLS")
+    proxy_cert_file: Optional[str] = Field(None, description="反向代理证书，不指定时自动生成自签名证书")
+    proxy_key_file: Optional[str] = Field(None, description="反向代理证书私钥")
+    proxy_max_connections_per_route: int = Field(4, description="每个显示器的最大并发websocket连接数")
+    proxy_pool_size: int = Field(1, description="每个显示器预建的后端连接数")
+    admission_enabled: bool = Field(True, description="启动显示器前检查内存和CPU余量")
+    admission_memory_reserve: float = Field(0.1, description="启动后需保留的可用内存比例")
+    admission_cpu_limit: float = Field(0.9, description="启动后CPU占用上限（相对总核数的比例）")
+    admission_queue_timeout: float = Field(30.0, description="余量不足时排队等待的最长时间（秒），0表示直接拒绝")
+    admission_default_rss_mb: float = Field(512.0, description="尚未学习到实测值时单个显示器的预估内存（MB）")
+    admission_default_cpu: float = Field(0.5, description="尚未学习到实测值时单个显示器的预估CPU（核）")
+    cgroup_enabled: bool = Field(False, description="每个用户的会话放入独立的cgroup v2（需要root和统一层级）")
+    cgroup_base: str = Field("kasmvnc", description="用户cgroup的父目录（相对/sys/fs/cgroup）")
+    cgroup_cpu_weight: int = Field(100, description="cpu.weight (1-10000)")
+    cgroup_memory_max: str = Field("max", description="memory.max，如 4G 或 max")
+    cgroup_memory_high: str = Field("max", description="memory.high，超过后回收内存并限速")
+    cgroup_io_weight: int = Field(100, description="io.weight (1-10000)")
+    cgroup_user_limits: Dict[str, Dict[str, str]] = Field(
+        default_factory=dict, description="单用户覆盖，如 {\"user1\": {\"memory.max\": \"8G\"}}"
+    )
+    placement_enabled: bool = Field(False, description="为每个显示器分配NUMA节点和CPU集合，RectThreads取分配的CPU数")
+    placement_cores_per_display: int = Field(0, description="每个显示器分配的CPU数，0表示取vnc_threads")
+    encoder_tune_mode: EncoderTuneMode = Field(EncoderTuneMode.RECOMMEND, description="编码参数调优: off 关闭, recommend 只给出建议, apply 下次启动时生效")
+    encoder_tune_interval: float = Field(60.0, description="编码参数调优采样间隔（秒）")
+    encoder_tune_high_load: float = Field(0.85, description="主机CPU饱和阈值（1分钟负载/核数），超过时减少线程或降低画质")
+    encoder_tune_low_load: float = Field(0.5, description="主机CPU空闲阈值，低于时恢复画质或增加线程")
+    encoder_tune_quality: bool = Field(False, description="主机饱和时允许降低帧率和画质上限")
+    encoder_min_threads: int = Field(1, description="调优时RectThreads下限")
+    encoder_max_threads: int = Field(0, description="调优时RectThreads上限，0表示分配的CPU数（未开启放置时为总核数）")
+    warm_pool_size: int = Field(0, description="预启动的空闲显示器数，0表示关闭")
+    warm_pool_max_accounts: int = Field(20, description="池账号数上限（含已分配的）")
+    warm_pool_prefix: str = Field("pool", description="池账号用户名前缀")
+    warm_pool_base_display: int = Field(3000, description="池显示器编号基数，池账号n使用 基数+n")
+    warm_pool_base_websocket_port: int = Field(7000, description="池显示器websocket端口基数")
+    warm_pool_https: bool = Field(False, description="池显示器启用HTTPS")
+    warm_pool_refill_interval: float = Field(10.0, description="检查和补充空闲显示器的间隔（秒）")
+    warm_pool_min_available_memory: float = Field(0.2, description="可用内存比例低于该值时逐个停止空闲显示器")
+    supervisor_enabled: bool = Field(True, description="由管理器直接启动并监管 kasmvncserver -fg，关闭时经su执行启动脚本")
+    supervisor_ready_timeout: float = Field(3.0, description="启动后等待websocket端口就绪的最长时间（秒）")
+    supervisor_stop_timeout: float = Field(10.0, description="停止时等待进程退出的时间（秒），超时后强制停止")
+    supervisor_backoff_initial: float = Field(1.0, description="异常退出后首次重启的等待时间（秒），之后每次翻倍")
+    supervisor_backoff_max: float = Field(60.0, description="重启等待时间上限（秒）")
+    supervisor_stable_seconds: float = Field(60.0, description="运行超过该时间后退出视为新的一次失败，退避清零")
+    supervisor_max_restarts: int = Field(5, description="连续异常退出超过该次数后不再重启，0表示不限")
+    log_rotate_enabled: bool = Field(True, description="按大小和时间轮转显示器日志（copytruncate，兼容追加写入）")
+    log_rotate_interval: float = Field(300.0, description="日志轮转检查间隔（秒）")
+    log_rotate_max_bytes: int = Field(50 * 1024 * 1024, description="日志超过该大小（字节）后轮转，0表示不按大小")
+    log_rotate_max_age: float = Field(86400.0, description="距上次轮转超过该时间（秒）后轮转，0表示不按时间")
+    log_rotate_keep: int = Field(5, description="每个日志保留的归档数")
+    log_rotate_compress: bool = Field(True, description="后台gzip压缩归档")
+    connection_poll_interval: float = Field(10.0, description="客户端连接采样间隔（秒），决定会话起止和最后活跃时间的精度")
+    throughput_sample_interval: float = Field(5.0, description="网络吞吐采样间隔（秒）")
+    throughput_history_size: int = Field(720, description="每个显示器保留的速率样本数（环形缓冲区大小）")
+    disk_usage_enabled: bool = Field(True, description="统计各用户主目录磁盘占用")
+    disk_usage_debounce: float = Field(5.0, description="目录变化后等待该时间（秒）再重新扫描，合并连续写入")
+    disk_usage_sweep_interval: float = Field(600.0, description="未被inotify监听的目录按mtime检查的间隔（秒），0表示不检查")
+    disk_usage_verify_interval: float = Field(86400.0, description="全量重新扫描间隔（秒），修正事件丢失造成的偏差，0表示不扫描")
+    health_probe_timeout: float = Field(2.0, description="健康检查websocket握手超时（秒）")
+    health_degraded_latency: float = Field(0.5, description="握手耗时超过该值（秒）视为降级")
+    health_probe_concurrency: int = Field(256, description="健康检查并发握手数")
+    idle_timeout: float = Field(7200.0, description="会话无客户端且无活动超过该时间后自动停止（秒），0表示不回收")
+    desktop_watch_debounce: float = Field(2.0, description="桌面持续同步防抖时间（秒）")
+    response_cache_ttl: float = Field(5.0, description="只读接口响应缓存时间（秒）")
+    volatile_cache_ttl: float = Field(2.0, description="系统资源等易变指标的缓存时间（秒）")
+    dependency_check_ttl: float = Field(60.0, description="依赖检查结果缓存时间（秒）")
+    slow_request_threshold: float = Field(1.0, description="慢请求日志阈值（秒），0表示不记录")
 
 
 class ServiceInfo(BaseModel):
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - TCP套接字表
+作者: Xander Xu
+
+直接解析 /proc/net/tcp 和 /proc/net/tcp6，一次读取即可得到全部监听端口和连接，
+不需要逐个进程调用 psutil.connections()。进程的套接字通过 /proc/<pid>/fd 的
+socket:[inode] 链接与表项对应。
+"""
+
+import os
+import socket
+import struct
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+
+# /proc/net/tcp 的连接状态 (见 include/net/tcp_states.h)
+TCP_ESTABLISHED = 0x01
+TCP_LISTEN = 0x0A
+
+TCP_TABLES = ("/proc/net/tcp", "/proc/net/tcp6")
+
+
+class TcpEntry(NamedTuple):
+    """TCP套接字表项"""
+    local_ip: str
+    local_port: int
+    remote_ip: str
+    remote_port: int
+    state: int
+    uid: int
+    inode: int
+
+
+def _parse_address(field: str):
+    """解析 十六进制地址:端口，地址按32位字以主机字节序存放"""
+    address, port = field.split(":")
+    raw = bytes.fromhex(address)
+    words = struct.unpack(f"={len(raw) // 4}I", raw)
+    packed = struct.pack(f">{len(words)}I", *words)
+    family = socket.AF_INET if len(packed) == 4 else socket.AF_INET6
+    return socket.inet_ntop(family, packed), int(port, 16)
+
+
+def read_tcp_table(paths: Iterable[str] = TCP_TABLES, states: Optional[Set[int]] = None) -> List[TcpEntry]:
+    """读取TCP套接字表，states指定时只返回这些状态的表项"""
+    entries = []
+    for path in paths:
+        try:
+            with open(path, 'r') as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 10:
+                continue
+            state = int(fields[3], 16)
+            if states is not None and state not in states:
+                continue
+            local_ip, local_port = _parse_address(fields[1])
+            remote_ip, remote_port = _parse_address(fields[2])
+            entries.append(TcpEntry(local_ip, local_port, remote_ip, remote_port,
+                                    state, int(fields[7]), int(fields[9])))
+    return entries
+
+
+def listening_sockets(paths: Iterable[str] = TCP_TABLES) -> Dict[int, List[TcpEntry]]:
+    """监听端口 -> 监听该端口的表项（IPv4和IPv6可能各有一个）"""
+    listeners: Dict[int, List[TcpEntry]] = {}
+    for entry in read_tcp_table(paths, {TCP_LISTEN}):
+        listeners.setdefault(entry.local_port, []).append(entry)
+    return listeners
+
+
+def socket_inodes(pids: Iterable[int]) -> Set[int]:
+    """进程打开的套接字inode，无权限读取的进程跳过"""
+    inodes = set()
+    for pid in pids:
+        fd_dir = f"/proc/{pid}/fd"
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target.startswith("socket:["):
+                inodes.add(int(target[8:-1]))
+    return inodes
+
+
+def loopback_for(entry: TcpEntry) -> str:
+    """连接监听套接字使用的本机地址"""
+    if entry.local_ip == "0.0.0.0":
+        return "127.0.0.1"
+    if entry.local_ip == "::":
+        return "::1"
+    return entry.local_ip
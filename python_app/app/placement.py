@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - CPU亲和性与NUMA放置
+作者: Xander Xu
+
+从 /sys/devices/system/node 读取NUMA拓扑，为每个显示器分配一个NUMA节点及
+该节点内的一组CPU：先选平均负载最低的节点，再在节点内选被占用最少的CPU，
+使显示器在各节点、各核之间均衡分布。RectThreads取分配到的CPU数。
+放置结果保存到文件，生成启动脚本和启动显示器时使用同一分配。
+"""
+
+import os
+import re
+import json
+import threading
+from typing import Dict, List, Optional
+
+import psutil
+
+
+NODE_ROOT = "/sys/devices/system/node"
+
+
+def parse_cpulist(text: str) -> List[int]:
+    """解析 "0-3,8,10-11" 格式的CPU列表"""
+    cpus = set()
+    for part in (text or "").strip().split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def format_cpulist(cpus: List[int]) -> str:
+    """把CPU编号列表格式化为 "0-3,8" 形式"""
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+def read_topology(node_root: str = NODE_ROOT) -> Dict[int, List[int]]:
+    """
+    读取NUMA节点 -> CPU列表，只保留当前进程允许使用的CPU
+
+    无NUMA信息（如容器内未挂载sysfs）时视为单节点
+    """
+    allowed = set(os.sched_getaffinity(0))
+    topology = {}
+    try:
+        entries = os.listdir(node_root)
+    except OSError:
+        entries = []
+    for entry in entries:
+        match = re.fullmatch(r"node(\d+)", entry)
+        if not match:
+            continue
+        try:
+            with open(os.path.join(node_root, entry, "cpulist"), 'r') as f:
+                cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in allowed]
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            topology[int(match.group(1))] = cpus
+    if not topology:
+        topology = {0: sorted(allowed)}
+    return dict(sorted(topology.items()))
+
+
+class Placement:
+    """显示器的放置: NUMA节点及CPU集合"""
+
+    def __init__(self, node: int, cpus: List[int]):
+        self.node = node
+        self.cpus = sorted(cpus)
+
+    @property
+    def rect_threads(self) -> int:
+        return max(len(self.cpus), 1)
+
+    @property
+    def cpulist(self) -> str:
+        return format_cpulist(self.cpus)
+
+    def to_dict(self) -> Dict:
+        return {
+            "node": self.node,
+            "cpus": self.cpulist,
+            "rect_threads": self.rect_threads
+        }
+
+
+class PlacementEngine:
+    """显示器CPU/NUMA放置"""
+
+    def __init__(self, manager, placement_file: str = "placements.json",
+                 node_root: str = NODE_ROOT):
+        self.manager = manager
+        self.placement_file = placement_file
+        self.node_root = node_root
+        self._lock = threading.Lock()
+        self._topology: Optional[Dict[int, List[int]]] = None
+        # 显示器编号 -> 放置
+        self.placements: Dict[int, Placement] = {}
+        self.load()
+
+    def load(self):
+        """从文件加载放置结果"""
+        if not os.path.exists(self.placement_file):
+            return
+        with open(self.placement_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.placements = {
+            int(display_num): Placement(entry["node"], parse_cpulist(entry["cpus"]))
+            for display_num, entry in data.get("placements", {}).items()
+        }
+
+    def save(self):
+        """保存放置结果到文件（调用方持有锁）"""
+        data = {
+            "placements": {
+                str(display_num): {"node": placement.node, "cpus": placement.cpulist}
+                for display_num, placement in sorted(self.placements.items())
+            }
+        }
+        tmp_file = f"{self.placement_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, self.placement_file)
+
+    @property
+    def topology(self) -> Dict[int, List[int]]:
+        if self._topology is None:
+            self._topology = read_topology(self.node_root)
+        return self._topology
+
+    def enabled(self) -> bool:
+        return self.manager.config.placement_enabled
+
+    def cores_per_display(self) -> int:
+        """每个显示器分配的CPU数，未配置时取vnc_threads，不超过最大节点的CPU数"""
+        config = self.manager.config
+        cores = config.placement_cores_per_display or config.vnc_threads
+        largest = max(len(cpus) for cpus in self.topology.values())
+        return max(1, min(cores, largest))
+
+    def _cpu_load(self, exclude: int = None) -> Dict[int, int]:
+        """每个CPU被多少个显示器使用"""
+        load = {cpu: 0 for cpus in self.topology.values() for cpu in cpus}
+        for display_num, placement in self.placements.items():
+            if display_num == exclude:
+                continue
+            for cpu in placement.cpus:
+                if cpu in load:
+                    load[cpu] += 1
+        return load
+
+    def _is_valid(self, placement: Placement) -> bool:
+        """放置是否仍符合当前拓扑和每显示器CPU数"""
+        cpus = self.topology.get(placement.node)
+        return (cpus is not None
+                and set(placement.cpus) <= set(cpus)
+                and len(placement.cpus) == min(self.cores_per_display(), len(cpus)))
+
+    def _choose(self, display_num: int) -> Placement:
+        load = self._cpu_load(exclude=display_num)
+        cores = self.cores_per_display()
+
+        def node_cost(node):
+            cpus = self.topology[node]
+            # 节点放不下完整的CPU集合时排在后面
+            return (len(cpus) < cores, sum(load[cpu] for cpu in cpus) / len(cpus), node)
+
+        node = min(self.topology, key=node_cost)
+        cpus = sorted(self.topology[node], key=lambda cpu: (load[cpu], cpu))[:cores]
+        return Placement(node, cpus)
+
+    def assign(self, display_num: int) -> Placement:
+        """获取显示器的放置，没有或已不符合当前拓扑时重新分配"""
+        with self._lock:
+            placement = self.placements.get(display_num)
+            if placement is None or not self._is_valid(placement):
+                placement = self._choose(display_num)
+                self.placements[display_num] = placement
+                self.save()
+            return placement
+
+    def release(self, display_num: int):
+        """释放显示器的放置（删除用户时）"""
+        with self._lock:
+            if self.placements.pop(display_num, None) is not None:
+                self.save()
+
+    def rebalance(self, display_nums: List[int]) -> Dict[int, Placement]:
+        """按显示器编号顺序重新分配全部放置，下次启动时生效"""
+        with self._lock:
+            self._topology = None
+            self.placements = {}
+            for display_num in sorted(display_nums):
+                self.placements[display_num] = self._choose(display_num)
+            self.save()
+            return dict(self.placements)
+
+    def launch_env(self, display_num: int) -> Dict[str, str]:
+        """启动脚本读取的放置环境变量，未开启放置时CPU和节点为空（不绑定）"""
+        if not self.enabled():
+            return {
+                "KASMVNC_RECT_THREADS": str(self.manager.config.vnc_threads),
+                "KASMVNC_CPUSET": "",
+                "KASMVNC_NUMA_NODE": ""
+            }
+        placement = self.assign(display_num)
+        return {
+            "KASMVNC_RECT_THREADS": str(placement.rect_threads),
+            "KASMVNC_CPUSET": placement.cpulist,
+            "KASMVNC_NUMA_NODE": str(placement.node)
+        }
+
+    def apply_affinity(self, display_num: int, proc: psutil.Process) -> int:
+        """设置显示器进程及其子进程的CPU亲和性，返回设置成功的进程数，未开启放置时不做处理"""
+        if not self.enabled():
+            return 0
+        cpus = set(self.assign(display_num).cpus)
+        try:
+            members = [proc] + proc.children(recursive=True)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            members = [proc]
+
+        applied = 0
+        for member in members:
+            try:
+                os.sched_setaffinity(member.pid, cpus)
+                applied += 1
+            except OSError:
+                continue
+        return applied
+
+    def status(self) -> Dict:
+        """拓扑、每个CPU的显示器数和各显示器的放置"""
+        with self._lock:
+            load = self._cpu_load()
+            return {
+                "enabled": self.enabled(),
+                "topology": {str(node): format_cpulist(cpus) for node, cpus in self.topology.items()},
+                "cores_per_display": self.cores_per_display(),
+                "cpu_load": {str(cpu): count for cpu, count in load.items()},
+                "placements": {
+                    str(display_num): placement.to_dict()
+                    for display_num, placement in sorted(self.placements.items())
+                }
+            }
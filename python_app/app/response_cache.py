@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 响应缓存
+作者: Xander Xu
+
+按状态版本号缓存已序列化的响应，并基于内容（不含响应时间戳）生成ETag，支持条件请求。
+缓存过期后重新生成的响应只要数据未变，ETag不变，条件请求仍返回304。
+"""
+
+import time
+import hashlib
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+
+class CacheEntry(NamedTuple):
+    """缓存条目"""
+    version: int
+    created: float
+    body: bytes
+    etag: str
+
+
+# 响应体末尾的时间戳字段（ApiResponse的最后一个字段），每次生成都不同，不参与ETag
+TIMESTAMP_FIELD = b',"timestamp":'
+
+
+def etag_payload(body: bytes) -> bytes:
+    """响应体去掉末尾时间戳后的部分，数据未变化时重新生成的响应体也相同"""
+    index = body.rfind(TIMESTAMP_FIELD)
+    return body[:index] if index >= 0 else body
+
+
+def make_etag(body: bytes) -> str:
+    """根据响应内容（不含时间戳）生成强ETag"""
+    return '"' + hashlib.blake2b(etag_payload(body), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判断If-None-Match请求头是否匹配ETag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # 弱比较: 忽略W/前缀
+    return "*" in candidates or any(
+        (tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates
+    )
+
+
+class ResponseCache:
+    """响应缓存"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: Dict[str, CacheEntry] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key: str, version: int, ttl: float) -> Optional[CacheEntry]:
+        """获取缓存，状态版本变化或超过TTL时失效"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.version == version and time.time() - entry.created < ttl:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, key: str, version: int, body: bytes) -> CacheEntry:
+        """写入缓存"""
+        entry = CacheEntry(version, time.time(), body, make_etag(body))
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                # 淘汰最早写入的条目
+                oldest = min(self._entries, key=lambda k: self._entries[k].created)
+                del self._entries[oldest]
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self, keys: List[str] = None):
+        """清除缓存"""
+        with self._lock:
+            if keys is None:
+                self._entries.clear()
+            else:
+                for key in keys:
+                    self._entries.pop(key, None)
+
+    def stats(self) -> Dict:
+        """缓存统计"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified
+            }
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 快速序列化
+作者: Xander Xu
+
+缓存每个用户预先编码好的JSON片段，只在用户数据变化时重新编码；
+列表响应直接拼接字节，跳过model_dump和响应模型校验。
+安装了orjson时使用orjson编码，否则退回标准库json。
+"""
+
+import json
+import time
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from .models import VNCUser, ServiceStatus
+
+
+# 每次请求都可能变化的字段，单独编码后拼接
+USER_DYNAMIC_FIELDS = {"displays", "last_active"}
+DISPLAY_DYNAMIC_FIELDS = {"status", "pid"}
+
+
+def dumps(obj) -> bytes:
+    """编码为紧凑的UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def api_response_bytes(data_fields: Dict[str, bytes], message: str,
+                       success: bool = True, timestamp: float = None) -> bytes:
+    """
+    拼接与ApiResponse结构一致的响应体
+
+    data_fields为 字段名 -> 已编码的JSON值
+    """
+    data = b','.join(dumps(name) + b':' + value for name, value in data_fields.items())
+    return b''.join([
+        b'{"success":', b'true' if success else b'false',
+        b',"message":', dumps(message),
+        b',"data":{', data, b'}',
+        b',"timestamp":', dumps(timestamp if timestamp is not None else time.time()),
+        b'}'
+    ])
+
+
+class UserSnapshotCache:
+    """用户JSON快照缓存"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 用户名 -> (数据版本, 静态字段片段, 各显示器静态字段片段)
+        self._entries: Dict[str, Tuple[int, bytes, List[bytes]]] = {}
+        self.encoded_count = 0
+
+    def _static_parts(self, user: VNCUser, revision: int) -> Tuple[bytes, List[bytes]]:
+        """获取用户静态部分的编码，版本变化时重新编码"""
+        entry = self._entries.get(user.username)
+        if entry is not None and entry[0] == revision:
+            return entry[1], entry[2]
+
+        user_body = dumps(user.model_dump(mode='json', exclude=USER_DYNAMIC_FIELDS))[1:-1]
+        display_bodies = [
+            dumps(display.model_dump(mode='json', exclude=DISPLAY_DYNAMIC_FIELDS))[1:-1]
+            for display in user.displays
+        ]
+        with self._lock:
+            self._entries[user.username] = (revision, user_body, display_bodies)
+            self.encoded_count += 1
+        return user_body, display_bodies
+
+    def encode_user(self, user: VNCUser, revision: int) -> bytes:
+        """编码单个用户，静态部分取自快照，状态字段即时拼接"""
+        user_body, display_bodies = self._static_parts(user, revision)
+        if len(display_bodies) != len(user.displays):
+            # 显示器数量与快照不一致，说明数据版本未正确递增，直接重新编码
+            return dumps(user.model_dump(mode='json'))
+
+        displays = b','.join(
+            b'{' + body + b',"status":' + dumps(ServiceStatus(display.status).value) +
+            b',"pid":' + dumps(display.pid) + b'}'
+            for body, display in zip(display_bodies, user.displays)
+        )
+        return (b'{' + user_body + b',"displays":[' + displays +
+                b'],"last_active":' + dumps(user.last_active) + b'}')
+
+    def encode_users(self, users: Iterable[VNCUser], revisions: Dict[str, int]) -> bytes:
+        """编码用户列表"""
+        return b'[' + b','.join(
+            self.encode_user(user, revisions.get(user.username, 0)) for user in users
+        ) + b']'
+
+    def retain(self, usernames: Iterable[str]):
+        """只保留指定用户的快照"""
+        keep = set(usernames)
+        with self._lock:
+            for username in list(self._entries):
+                if username not in keep:
+                    del self._entries[username]
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "encoded_count": self.encoded_count,
+            "encoder": "orjson" if orjson is not None else "json"
+        }
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 启动耗时统计
+作者: Xander Xu
+
+记录进程启动、模块导入、应用构建、首个请求等阶段的时间点，
+生成启动耗时报告。本模块只依赖标准库，以便尽早导入。
+"""
+
+import os
+import sys
+import time
+from typing import Dict, Optional
+
+# 快速启动模式: 延迟构建VNC管理器，依赖检查放到后台
+FAST_START_ENV = "KASMVNC_FAST_START"
+
+
+def fast_start_enabled() -> bool:
+    return os.environ.get(FAST_START_ENV, "").lower() in ("1", "true", "yes")
+
+
+def _proc_start_time(pid: int) -> Optional[float]:
+    """从/proc读取进程启动时间（Unix时间戳）"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            fields = f.read().rsplit(b")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/stat", "rb") as f:
+            for line in f:
+                if line.startswith(b"btime"):
+                    boot_time = int(line.split()[1])
+                    break
+            else:
+                return None
+        return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _bundle_start_time() -> Optional[float]:
+    """
+    单文件打包时由引导进程解压后再启动本进程，返回引导进程的启动时间；
+    非打包运行返回None
+    """
+    if "NUITKA_ONEFILE_PARENT" in os.environ:
+        return _proc_start_time(int(os.environ["NUITKA_ONEFILE_PARENT"]))
+    if getattr(sys, "frozen", False) and hasattr(sys, "_MEIPASS"):
+        # PyInstaller单文件模式: 引导进程即父进程
+        parent_start = _proc_start_time(os.getppid())
+        if parent_start is not None and os.path.basename(sys._MEIPASS).startswith("_MEI"):
+            return parent_start
+    return None
+
+
+class StartupProfile:
+    """启动阶段计时"""
+
+    def __init__(self):
+        self.marks: Dict[str, float] = {}
+        self.first_request_latency: Optional[float] = None
+        self.first_request_path: Optional[str] = None
+
+    def mark(self, name: str, timestamp: float = None):
+        """记录阶段时间点，同名只记录第一次"""
+        self.marks.setdefault(name, timestamp if timestamp is not None else time.time())
+
+    def record_first_request(self, path: str, latency: float):
+        """记录首个请求的耗时"""
+        if self.first_request_latency is None:
+            self.first_request_latency = latency
+            self.first_request_path = path
+            self.mark("first_request_done")
+
+    def _duration(self, start: str, end: str) -> Optional[float]:
+        if start in self.marks and end in self.marks:
+            return round((self.marks[end] - self.marks[start]) * 1000, 2)
+        return None
+
+    def report(self) -> Dict:
+        """生成启动耗时报告（毫秒）"""
+        process_start = _proc_start_time(os.getpid())
+        bundle_start = _bundle_start_time()
+        if process_start is not None:
+            self.mark("process_start", process_start)
+        if bundle_start is not None:
+            self.mark("bundle_start", bundle_start)
+
+        return {
+            "fast_start": fast_start_enabled(),
+            "phases_ms": {
+                "bundle_unpack": self._duration("bundle_start", "process_start"),
+                "interpreter": self._duration("process_start", "import_start"),
+                "import": self._duration("import_start", "import_done"),
+                "app_construction": self._duration("import_done", "app_ready"),
+                "manager_construction": self._duration("manager_start", "manager_ready"),
+                "until_first_request": self._duration("app_ready", "first_request_done")
+            },
+            "first_request": {
+                "path": self.first_request_path,
+                "latency_ms": round(self.first_request_latency * 1000, 2)
+                if self.first_request_latency is not None else None
+            },
+            "total_to_ready_ms": self._duration(
+                "bundle_start" if "bundle_start" in self.marks else "process_start", "app_ready"
+            ),
+            "marks": dict(self.marks)
+        }
+
+
+startup_profile = StartupProfile()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 显示器进程监管
+作者: Xander Xu
+
+由管理器直接fork并exec前台运行的 kasmvncserver -fg（不再经由 su、nohup 和启动脚本），
+用户和组的切换交给 subprocess.Popen 的 user/group/extra_groups 参数在C层完成；管理器是多线程进程，
+不在 preexec_fn 中执行Python代码。加入用户cgroup和设置CPU亲和性由父进程在启动后对子进程完成，
+kasmvncserver 此时尚未派生 Xvnc，之后派生的进程继承cgroup和亲和性。
+监管器持有自己启动的进程句柄，查询状态和停止时无需搜索进程表；进程意外退出后
+按指数退避重启，稳定运行一段时间后退避清零，连续失败超过上限则放弃并记录原因。
+"""
+
+import os
+import pwd
+import time
+import signal
+import socket
+import threading
+import subprocess
+from typing import Dict, Optional
+
+import psutil
+
+
+# 监管线程检查进程状态的间隔（秒）
+POLL_INTERVAL = 1.0
+
+# 等待websocket端口就绪时的检查间隔（秒）
+READY_POLL_INTERVAL = 0.2
+
+
+def user_credentials(username: str) -> Dict:
+    """
+    以用户身份启动子进程的 subprocess.Popen 参数（user、group、extra_groups）
+
+    管理器不是root时无法切换用户，返回空字典
+    """
+    if os.geteuid() != 0:
+        return {}
+    try:
+        entry = pwd.getpwnam(username)
+    except KeyError:
+        raise Exception(f"系统用户 {username} 不存在")
+    return {
+        "user": entry.pw_uid,
+        "group": entry.pw_gid,
+        "extra_groups": os.getgrouplist(username, entry.pw_gid)
+    }
+
+
+def user_environment(username: str, home_dir: str) -> Dict[str, str]:
+    """用户会话的基本环境变量（相当于 su - 的登录环境）"""
+    shell = "/bin/bash"
+    try:
+        entry = pwd.getpwnam(username)
+        home_dir, shell = entry.pw_dir or home_dir, entry.pw_shell or shell
+    except KeyError:
+        pass
+    env = {
+        "HOME": home_dir,
+        "USER": username,
+        "LOGNAME": username,
+        "SHELL": shell,
+        "PATH": os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin")
+    }
+    for name in ("LANG", "LC_ALL", "TZ"):
+        if name in os.environ:
+            env[name] = os.environ[name]
+    return env
+
+
+class SupervisedSession:
+    """监管的显示器进程"""
+
+    def __init__(self, username: str, display_number: int, backend_port: int):
+        self.username = username
+        self.display_number = display_number
+        self.backend_port = backend_port
+        self.popen: Optional[subprocess.Popen] = None
+        # 当前进程的退出是否已处理
+        self.reaped = False
+        # running: 应保持运行；stopped: 已主动停止；failed: 重启次数超限
+        self.desired = "running"
+        self.started_time: Optional[float] = None
+        self.restarts = 0
+        self.consecutive_failures = 0
+        self.last_exit_code: Optional[int] = None
+        self.last_exit_time: Optional[float] = None
+        self.next_restart_time: Optional[float] = None
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.popen.pid if self.popen is not None else None
+
+    def alive(self) -> bool:
+        return self.popen is not None and self.popen.poll() is None
+
+    def status(self) -> Dict:
+        now = time.time()
+        return {
+            "username": self.username,
+            "display_number": self.display_number,
+            "pid": self.pid if self.alive() else None,
+            "state": "running" if self.alive() else ("restarting" if self.next_restart_time else self.desired),
+            "uptime": round(now - self.started_time, 1) if self.alive() and self.started_time else None,
+            "restarts": self.restarts,
+            "consecutive_failures": self.consecutive_failures,
+            "last_exit_code": self.last_exit_code,
+            "last_exit_time": self.last_exit_time,
+            "next_restart_in": round(max(self.next_restart_time - now, 0), 1) if self.next_restart_time else None
+        }
+
+
+class DisplaySupervisor:
+    """显示器进程监管器"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.logger = manager.logger
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 显示器编号 -> 监管的进程
+        self.sessions: Dict[int, SupervisedSession] = {}
+
+    def enabled(self) -> bool:
+        return self.manager.config.supervisor_enabled
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动监管线程"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="display-supervisor", daemon=True)
+        self._thread.start()
+        self.logger.info("显示器进程监管已启动")
+
+    def stop(self):
+        """停止监管线程，已启动的显示器继续运行"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join(timeout=10)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(POLL_INTERVAL):
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.error(f"显示器进程检查失败: {e}")
+
+    def _spawn(self, session: SupervisedSession):
+        """fork并exec kasmvncserver -fg（调用方持有锁）"""
+        manager = self.manager
+        user = manager.find_user(session.username)
+        display = manager.find_display(session.username, session.display_number)
+        if user is None or display is None:
+            raise Exception(f"用户 {session.username} 没有显示器 :{session.display_number}")
+
+        argv = manager.build_vnc_command(user, display, foreground=True)
+        cgroup_ready = False
+        try:
+            cgroup_ready = manager.cgroups.ensure_user_cgroup(session.username) is not None
+        except OSError as e:
+            self.logger.warning(f"准备用户 {session.username} 的cgroup失败，不做资源隔离: {e}")
+
+        manager.cleanup_display_locks([session.display_number])
+        with open(manager.display_log_file(session.username, session.display_number), 'ab') as log:
+            session.popen = subprocess.Popen(
+                argv,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                cwd=user.home_directory if os.path.isdir(user.home_directory) else "/",
+                env=user_environment(session.username, user.home_directory),
+                start_new_session=True,
+                **user_credentials(session.username)
+            )
+        self._place(session, cgroup_ready)
+        session.started_time = time.time()
+        session.next_restart_time = None
+        session.reaped = False
+        self.logger.info(f"显示器 :{session.display_number} 已启动 (PID: {session.popen.pid}): {' '.join(argv)}")
+
+    def _place(self, session: SupervisedSession, cgroup_ready: bool):
+        """把刚启动的进程（及已派生的子进程）迁入用户cgroup并设置CPU亲和性"""
+        try:
+            proc = psutil.Process(session.popen.pid)
+        except psutil.NoSuchProcess:
+            # 进程已退出，由 _wait_ready 或监管线程处理
+            return
+        if cgroup_ready:
+            self.manager.cgroups.attach_process_tree(session.username, proc)
+        self.manager.placement.apply_affinity(session.display_number, proc)
+
+    def launch(self, username: str, display_num: int) -> SupervisedSession:
+        """启动并监管显示器，等待websocket端口就绪"""
+        display = self.manager.find_display(username, display_num)
+        if display is None:
+            raise Exception(f"用户 {username} 没有显示器 :{display_num}")
+        with self._lock:
+            session = self.sessions.get(display_num)
+            if session is not None and session.alive():
+                return session
+            session = SupervisedSession(username, display_num,
+                                        self.manager.display_backend_port(display.websocket_port))
+            self._spawn(session)
+            self.sessions[display_num] = session
+
+        try:
+            self._wait_ready(session)
+        except Exception:
+            # 启动失败交由调用方处理，不进入重启
+            with self._lock:
+                session.desired = "stopped"
+                session.reaped = True
+            raise
+        return session
+
+    def _wait_ready(self, session: SupervisedSession):
+        """
+        等待websocket端口可连接，进程提前退出时报错
+
+        超时后进程仍在运行视为启动成功（部分桌面启动较慢）
+        """
+        deadline = time.time() + self.manager.config.supervisor_ready_timeout
+        while time.time() < deadline:
+            exit_code = session.popen.poll()
+            if exit_code is not None:
+                raise Exception(f"kasmvncserver 启动后退出，退出码 {exit_code}")
+            try:
+                with socket.create_connection(("127.0.0.1", session.backend_port), timeout=READY_POLL_INTERVAL):
+                    return
+            except OSError:
+                time.sleep(READY_POLL_INTERVAL)
+        if session.popen.poll() is not None:
+            raise Exception(f"kasmvncserver 启动后退出，退出码 {session.popen.returncode}")
+        self.logger.warning(f"显示器 :{session.display_number} 端口 {session.backend_port} 未就绪，进程仍在运行")
+
+    def request_stop(self, display_num: int) -> Optional[subprocess.Popen]:
+        """
+        标记显示器不再重启并向进程组发送SIGTERM，不等待退出
+
+        返回仍需等待的子进程；不是监管的显示器或进程已退出时返回None
+        """
+        with self._lock:
+            session = self.sessions.get(display_num)
+            if session is None:
+                return None
+            session.desired = "stopped"
+            session.next_restart_time = None
+            popen = session.popen
+        if popen is None or popen.poll() is not None:
+            return None
+        # 子进程是独立会话的组长，连同Xvnc和桌面进程一起停止
+        self._signal_group(popen, signal.SIGTERM)
+        return popen
+
+    def kill(self, popen: subprocess.Popen):
+        """强制停止进程组"""
+        self._signal_group(popen, signal.SIGKILL)
+
+    @staticmethod
+    def _signal_group(popen: subprocess.Popen, sig: int):
+        try:
+            os.killpg(popen.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def owns(self, display_num: int) -> bool:
+        """显示器是否由监管器启动且应保持运行"""
+        with self._lock:
+            session = self.sessions.get(display_num)
+            return session is not None and session.desired == "running"
+
+    def process_map(self) -> Dict[int, psutil.Process]:
+        """监管器持有的运行中显示器进程，无需扫描进程表"""
+        processes = {}
+        with self._lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            if not session.alive():
+                continue
+            try:
+                processes[session.display_number] = psutil.Process(session.pid)
+            except psutil.NoSuchProcess:
+                continue
+        return processes
+
+    def check(self):
+        """回收退出的进程，按退避时间重启应保持运行的显示器"""
+        now = time.time()
+        restarted = []
+        with self._lock:
+            for session in list(self.sessions.values()):
+                if session.popen is not None and not session.reaped and session.popen.poll() is not None:
+                    session.reaped = True
+                    self._on_exit(session, session.popen.returncode, now)
+                if (session.desired == "running" and session.next_restart_time is not None
+                        and now >= session.next_restart_time):
+                    try:
+                        self._spawn(session)
+                        session.restarts += 1
+                        restarted.append(session)
+                    except Exception as e:
+                        self._on_exit(session, None, now, str(e))
+
+        if restarted:
+            self.manager.bump_state_version()
+        for session in restarted:
+            self.manager.log_operation(
+                "supervisor_restart", session.username,
+                f"显示器 :{session.display_number} 第 {session.restarts} 次重启 (PID: {session.pid})"
+            )
+
+    def _on_exit(self, session: SupervisedSession, exit_code: Optional[int], now: float, error: str = None):
+        """记录进程退出，应保持运行时安排退避重启（调用方持有锁）"""
+        config = self.manager.config
+        session.last_exit_code = exit_code
+        session.last_exit_time = now
+        if session.desired != "running":
+            return
+
+        if session.started_time and now - session.started_time >= config.supervisor_stable_seconds:
+            session.consecutive_failures = 0
+        session.consecutive_failures += 1
+        reason = error or f"退出码 {exit_code}"
+        if config.supervisor_max_restarts and session.consecutive_failures > config.supervisor_max_restarts:
+            session.desired = "failed"
+            session.next_restart_time = None
+            message = f"连续 {session.consecutive_failures} 次异常退出，停止重启 ({reason})"
+            self.manager.display_errors[session.display_number] = message
+            self.manager.log_operation("supervisor_restart", session.username,
+                                       error_message=f"显示器 :{session.display_number} {message}",
+                                       success=False)
+            return
+
+        delay = min(config.supervisor_backoff_initial * 2 ** (session.consecutive_failures - 1),
+                    config.supervisor_backoff_max)
+        session.next_restart_time = now + delay
+        self.logger.warning(
+            f"显示器 :{session.display_number} 异常退出 ({reason})，{delay:.0f}s 后重启"
+        )
+        self.manager.bump_state_version()
+
+    def status(self) -> Dict:
+        with self._lock:
+            sessions = {str(num): session.status() for num, session in sorted(self.sessions.items())}
+        return {
+            "enabled": self.enabled(),
+            "running": self.is_running(),
+            "sessions": sessions
+        }
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 桌面同步清单
+作者: Xander Xu
+
+按(源用户, 目标用户)记录最近一次同步后的文件清单（相对路径 -> 源文件大小、修改时间），
+用于计算同步计划和预估耗时，无需扫描目标用户主目录。清单只用于报告，实际同步不据此删除文件。
+"""
+
+import os
+import json
+import threading
+from typing import Dict, List, Tuple
+
+# 相对路径 -> (大小, 修改时间)
+Manifest = Dict[str, Tuple[int, float]]
+
+# 默认同步速率，首次同步前用于预估
+DEFAULT_BYTES_PER_SECOND = 50 * 1024 * 1024
+DEFAULT_SECONDS_PER_FILE = 0.002
+# 平均文件大小超过该值时按带宽学习，否则按单文件开销学习
+LARGE_FILE_THRESHOLD = 64 * 1024
+EWMA_ALPHA = 0.3
+
+
+def in_roots(rel_path: str, roots: List[str]) -> bool:
+    """路径是否位于指定同步目录下"""
+    return any(rel_path.startswith(root + "/") for root in roots)
+
+
+def diff_manifests(source: Manifest, target: Manifest) -> Dict[str, List[str]]:
+    """比较源清单与上次同步的清单，返回新建、更新、未变的路径，以及源中已删除的路径"""
+    create, update, unchanged = [], [], []
+    for rel_path, (size, mtime) in source.items():
+        synced = target.get(rel_path)
+        if synced is None:
+            create.append(rel_path)
+        elif synced[0] != size or synced[1] != mtime:
+            update.append(rel_path)
+        else:
+            unchanged.append(rel_path)
+    delete = [rel_path for rel_path in target if rel_path not in source]
+    return {
+        "create": sorted(create),
+        "update": sorted(update),
+        "delete": sorted(delete),
+        "unchanged": unchanged
+    }
+
+
+class SyncManifestStore:
+    """同步清单存储"""
+
+    def __init__(self, manifest_file: str):
+        self.manifest_file = manifest_file
+        self._lock = threading.Lock()
+        # 源用户 -> 目标用户 -> 清单
+        self.sources: Dict[str, Dict[str, Manifest]] = {}
+        self.bytes_per_second = DEFAULT_BYTES_PER_SECOND
+        self.seconds_per_file = DEFAULT_SECONDS_PER_FILE
+        self.load()
+
+    def load(self):
+        """从文件加载清单"""
+        if not os.path.exists(self.manifest_file):
+            return
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # 旧格式只按目标用户记录，不知道源用户，直接丢弃
+        self.sources = {
+            source_user: {
+                username: {path: tuple(entry) for path, entry in files.items()}
+                for username, files in targets.items()
+            }
+            for source_user, targets in data.get("sources", {}).items()
+        }
+        self.bytes_per_second = data.get("bytes_per_second", DEFAULT_BYTES_PER_SECOND)
+        self.seconds_per_file = data.get("seconds_per_file", DEFAULT_SECONDS_PER_FILE)
+
+    def save(self):
+        """保存清单到文件"""
+        with self._lock:
+            data = {
+                "sources": self.sources,
+                "bytes_per_second": self.bytes_per_second,
+                "seconds_per_file": self.seconds_per_file
+            }
+            tmp_file = f"{self.manifest_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_file, self.manifest_file)
+
+    def get_target(self, source_user: str, username: str, roots: List[str] = None) -> Manifest:
+        """获取从源用户同步到目标用户的清单，可只取指定同步目录"""
+        manifest = self.sources.get(source_user, {}).get(username, {})
+        if roots is None:
+            return dict(manifest)
+        return {path: entry for path, entry in manifest.items() if in_roots(path, roots)}
+
+    def has_target(self, source_user: str, username: str) -> bool:
+        return username in self.sources.get(source_user, {})
+
+    def replace_target(self, source_user: str, username: str, source: Manifest, roots: List[str]):
+        """全量同步后替换指定同步目录下的清单"""
+        with self._lock:
+            targets = self.sources.setdefault(source_user, {})
+            manifest = {
+                path: entry for path, entry in targets.get(username, {}).items()
+                if not in_roots(path, roots)
+            }
+            manifest.update(source)
+            targets[username] = manifest
+
+    def update_paths(self, source_user: str, username: str, entries: Manifest, removed: List[str]):
+        """增量同步后更新部分路径"""
+        with self._lock:
+            manifest = self.sources.setdefault(source_user, {}).setdefault(username, {})
+            manifest.update(entries)
+            for path in removed:
+                manifest.pop(path, None)
+
+    def remove_target(self, username: str):
+        """删除用户作为目标或源的全部清单"""
+        with self._lock:
+            self.sources.pop(username, None)
+            for targets in self.sources.values():
+                targets.pop(username, None)
+
+    def estimate_seconds(self, total_bytes: int, file_count: int) -> float:
+        """预估同步耗时"""
+        return file_count * self.seconds_per_file + total_bytes / self.bytes_per_second
+
+    def record_throughput(self, total_bytes: int, file_count: int, seconds: float):
+        """根据实际同步耗时修正预估参数"""
+        if file_count <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            if total_bytes / file_count >= LARGE_FILE_THRESHOLD:
+                data_seconds = max(seconds - file_count * self.seconds_per_file, seconds * 0.1)
+                observed = total_bytes / data_seconds
+                self.bytes_per_second += EWMA_ALPHA * (observed - self.bytes_per_second)
+            else:
+                file_seconds = max(seconds - total_bytes / self.bytes_per_second, 0.0)
+                observed = file_seconds / file_count
+                self.seconds_per_file += EWMA_ALPHA * (observed - self.seconds_per_file)
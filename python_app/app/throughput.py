@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 显示器网络吞吐统计
+作者: Xander Xu
+
+定期执行一次 ss -tin（套接字诊断 sock_diag），只查询显示器实际监听端口上已建立的
+连接，读取每个连接内核累计的 bytes_acked（发送给客户端并已确认）和 bytes_received：
+- 与上次采样的差值即本周期的传输量，按显示器汇总为发送、接收速率
+- 每个显示器的速率保存在定长环形缓冲区中，按用户累计的总量持久化到文件
+连接在两次采样之间关闭时，其最后一个周期的传输量无法统计；服务启动前已建立的连接
+只统计启动后的传输量。
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from .models import VNCUser
+
+
+# 累计总量写入文件的最小间隔（秒），停止时总会保存
+SAVE_INTERVAL = 60.0
+
+_BYTES_ACKED = re.compile(r"\bbytes_acked:(\d+)")
+_BYTES_RECEIVED = re.compile(r"\bbytes_received:(\d+)")
+
+
+def _address_port(field: str) -> int:
+    """ss输出的 地址:端口（IPv6地址带方括号）中的端口"""
+    port = field.rsplit(":", 1)[-1]
+    return int(port) if port.isdigit() else 0
+
+
+def parse_ss_output(output: str) -> Dict[Tuple[str, str], Tuple[int, int, int]]:
+    """
+    解析 ss -tinH state established 的输出
+
+    返回 (本地地址, 对端地址) -> (本地端口, 已确认发送字节, 接收字节)；每个连接一行
+    套接字信息，下一行（以空白开头）为TCP详细信息
+    """
+    sockets = {}
+    current = None
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            fields = line.split()
+            # Recv-Q Send-Q 本地地址 对端地址（指定state时不输出状态列）
+            current = (fields[-2], fields[-1]) if len(fields) >= 4 else None
+            continue
+        if current is None:
+            continue
+        acked = _BYTES_ACKED.search(line)
+        received = _BYTES_RECEIVED.search(line)
+        sockets[current] = (
+            _address_port(current[0]),
+            int(acked.group(1)) if acked else 0,
+            int(received.group(1)) if received else 0
+        )
+        current = None
+    return sockets
+
+
+class RateRing:
+    """定长环形缓冲区，每个样本为 (时间戳, 发送速率, 接收速率)，存放在连续的double数组中"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(capacity, 1)
+        self._data = array('d', bytes(8 * 3 * self.capacity))
+        self._next = 0
+        self.count = 0
+
+    def append(self, timestamp: float, sent_rate: float, received_rate: float):
+        offset = self._next * 3
+        self._data[offset:offset + 3] = array('d', (timestamp, sent_rate, received_rate))
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def samples(self, limit: Optional[int] = None) -> List[Tuple[float, float, float]]:
+        """从旧到新的样本，limit指定时只返回最近的limit个"""
+        count = self.count if limit is None else min(limit, self.count)
+        start = (self._next - count) % self.capacity
+        result = []
+        for index in range(count):
+            offset = (start + index) % self.capacity * 3
+            result.append(tuple(self._data[offset:offset + 3]))
+        return result
+
+
+class ThroughputCollector:
+    """显示器网络吞吐采集器"""
+
+    def __init__(self, manager, stats_file: str = "throughput_stats.json"):
+        self.manager = manager
+        self.logger = manager.logger
+        self.stats_file = stats_file
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # (本地地址, 对端地址) -> (已确认发送字节, 接收字节)，上次采样的连接计数
+        self._sockets: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        # 显示器编号 -> {"username", "connections", "sent_rate", "received_rate",
+        #                "bytes_sent", "bytes_received", "ring"}
+        self.displays: Dict[int, Dict] = {}
+        # 用户名 -> 累计 {"bytes_sent", "bytes_received"}
+        self.users: Dict[str, Dict] = {}
+        self.sample_count = 0
+        self.last_sample_time: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._last_save = 0.0
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """从文件加载用户累计传输量"""
+        if not os.path.exists(self.stats_file):
+            return
+        with open(self.stats_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.users = data.get("users", {})
+
+    def save(self):
+        """保存用户累计传输量到文件（调用方持有锁）"""
+        tmp_file = f"{self.stats_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"users": self.users}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, self.stats_file)
+        self._last_save = time.monotonic()
+        self._dirty = False
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动后台采样线程"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="throughput-collector", daemon=True)
+        self._thread.start()
+        self.logger.info(f"网络吞吐统计已启动: 采样间隔 {self.manager.config.throughput_sample_interval}s")
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join(timeout=10)
+        self._thread = None
+        with self._lock:
+            if self._dirty:
+                self.save()
+
+    def _run(self):
+        while not self._stop_event.wait(max(self.manager.config.throughput_sample_interval, 1)):
+            try:
+                self.sample()
+            except Exception as e:
+                self.logger.error(f"网络吞吐采样失败: {e}")
+
+    def _display_ports(self) -> Dict[int, Tuple[int, str]]:
+        """显示器实际监听的端口 -> (显示器编号, 用户名)，包括预启动池账号"""
+        manager = self.manager
+        users: List[VNCUser] = manager.load_users_data() + list(manager.warm_pool.accounts)
+        return {
+            manager.display_backend_port(display.websocket_port): (display.display_number, user.username)
+            for user in users for display in user.displays
+        }
+
+    def _query(self, ports) -> Dict[Tuple[str, str], Tuple[int, int, int]]:
+        """用一次ss查询这些本地端口上已建立的连接"""
+        if not ports:
+            return {}
+        port_filter = " or ".join(f"sport = :{port}" for port in sorted(ports))
+        result = self.manager.commands.run(
+            ["ss", "-tinH", "state", "established", f"( {port_filter} )"], timeout=10
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f"ss 退出码 {result.returncode}")
+        return parse_ss_output(result.stdout)
+
+    def sample(self) -> Dict[int, Dict]:
+        """采样一次，更新各显示器速率和各用户累计传输量，返回 显示器编号 -> 本次速率"""
+        display_ports = self._display_ports()
+        try:
+            sockets = self._query(display_ports)
+        except (OSError, RuntimeError) as e:
+            self.last_error = str(e)
+            raise
+        self.last_error = None
+        now = time.time()
+        history_size = self.manager.config.throughput_history_size
+
+        with self._lock:
+            interval = now - self.last_sample_time if self.last_sample_time else None
+            # 首次采样只建立基准，不把连接建立以来的全部传输量算作一个周期
+            first_sample = self.last_sample_time is None
+            deltas = {display_num: [0, 0, 0] for display_num, _ in display_ports.values()}
+            current = {}
+            for key, (port, sent, received) in sockets.items():
+                target = display_ports.get(port)
+                if target is None:
+                    continue
+                current[key] = (sent, received)
+                delta = deltas[target[0]]
+                delta[2] += 1
+                previous = self._sockets.get(key)
+                if previous is None:
+                    if first_sample:
+                        continue
+                    previous = (0, 0)
+                # 计数变小说明是复用了同一地址端口的新连接
+                delta[0] += sent - previous[0] if sent >= previous[0] else sent
+                delta[1] += received - previous[1] if received >= previous[1] else received
+            self._sockets = current
+
+            rates = {}
+            for port, (display_num, username) in display_ports.items():
+                sent, received, connections = deltas[display_num]
+                state = self.displays.get(display_num)
+                if state is None or state["username"] != username:
+                    state = {
+                        "username": username, "connections": 0,
+                        "sent_rate": 0.0, "received_rate": 0.0,
+                        "bytes_sent": 0, "bytes_received": 0,
+                        "ring": RateRing(history_size)
+                    }
+                    self.displays[display_num] = state
+
+                sent_rate = sent / interval if interval else 0.0
+                received_rate = received / interval if interval else 0.0
+                state.update(connections=connections, sent_rate=sent_rate, received_rate=received_rate)
+                state["bytes_sent"] += sent
+                state["bytes_received"] += received
+                state["ring"].append(now, sent_rate, received_rate)
+                rates[display_num] = {"sent_rate": sent_rate, "received_rate": received_rate}
+
+                if sent or received:
+                    totals = self.users.setdefault(username, {"bytes_sent": 0, "bytes_received": 0})
+                    totals["bytes_sent"] += sent
+                    totals["bytes_received"] += received
+                    self._dirty = True
+
+            # 已删除的显示器
+            for display_num in set(self.displays) - set(deltas):
+                del self.displays[display_num]
+
+            if self._dirty and time.monotonic() - self._last_save >= SAVE_INTERVAL:
+                self.save()
+            self.sample_count += 1
+            self.last_sample_time = now
+        return rates
+
+    def data_transferred(self, username: str) -> int:
+        """用户累计传输的字节数（发送和接收合计）"""
+        with self._lock:
+            totals = self.users.get(username)
+            return totals["bytes_sent"] + totals["bytes_received"] if totals else 0
+
+    def remove_user(self, username: str):
+        """删除用户的累计传输量"""
+        with self._lock:
+            if self.users.pop(username, None) is not None:
+                self.save()
+
+    def _display_entry(self, display_num: int, state: Dict, history: int) -> Dict:
+        entry = {
+            "display_number": display_num,
+            "username": state["username"],
+            "connections": state["connections"],
+            "sent_rate": round(state["sent_rate"], 1),
+            "received_rate": round(state["received_rate"], 1),
+            "bytes_sent": state["bytes_sent"],
+            "bytes_received": state["bytes_received"]
+        }
+        if history:
+            entry["history"] = [[ts, round(sent, 1), round(received, 1)]
+                                for ts, sent, received in state["ring"].samples(history)]
+        return entry
+
+    def displays_throughput(self, username: Optional[str] = None, display_num: Optional[int] = None,
+                            history: int = 0) -> List[Dict]:
+        """各显示器当前速率（字节/秒）和统计以来的传输量，history为附带的最近样本数"""
+        with self._lock:
+            return [
+                self._display_entry(num, state, history)
+                for num, state in sorted(self.displays.items())
+                if (username is None or state["username"] == username)
+                and (display_num is None or num == display_num)
+            ]
+
+    def users_throughput(self, username: Optional[str] = None) -> List[Dict]:
+        """各用户当前速率（所有显示器合计）和累计传输量，按当前总速率从大到小排列"""
+        with self._lock:
+            entries: Dict[str, Dict] = {}
+            names = set(self.users) | {state["username"] for state in self.displays.values()}
+            for name in names:
+                if username is not None and name != username:
+                    continue
+                totals = self.users.get(name, {"bytes_sent": 0, "bytes_received": 0})
+                entries[name] = {
+                    "username": name, "connections": 0,
+                    "sent_rate": 0.0, "received_rate": 0.0,
+                    "bytes_sent": totals["bytes_sent"], "bytes_received": totals["bytes_received"]
+                }
+            for state in self.displays.values():
+                entry = entries.get(state["username"])
+                if entry is None:
+                    continue
+                entry["connections"] += state["connections"]
+                entry["sent_rate"] += state["sent_rate"]
+                entry["received_rate"] += state["received_rate"]
+        for entry in entries.values():
+            entry["sent_rate"] = round(entry["sent_rate"], 1)
+            entry["received_rate"] = round(entry["received_rate"], 1)
+        return sorted(entries.values(), key=lambda entry: entry["sent_rate"] + entry["received_rate"],
+                      reverse=True)
+
+    def status(self) -> Dict:
+        config = self.manager.config
+        with self._lock:
+            return {
+                "running": self.is_running(),
+                "sample_interval": config.throughput_sample_interval,
+                "history_size": config.throughput_history_size,
+                "sample_count": self.sample_count,
+                "last_sample_time": self.last_sample_time,
+                "last_error": self.last_error,
+                "tracked_sockets": len(self._sockets),
+                "total_sent_rate": round(sum(state["sent_rate"] for state in self.displays.values()), 1),
+                "total_received_rate": round(sum(state["received_rate"] for state in self.displays.values()), 1)
+            }
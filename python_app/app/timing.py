@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 请求耗时分析
+作者: Xander Xu
+
+每个请求建立一棵计时span树，VNCManager的方法通过 timed 装饰器或 span 上下文
+记录各阶段耗时。请求结束后汇总为 Server-Timing 响应头，超过阈值的请求连同
+span树写入慢请求日志。没有进行中的请求时（后台线程、脚本调用）计时为空操作。
+"""
+
+import os
+import json
+import time
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+
+class Span:
+    """计时区间"""
+
+    __slots__ = ("name", "start", "end", "children")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+
+    @property
+    def duration(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+    def to_dict(self) -> Dict:
+        result = {"name": self.name, "duration_ms": round(self.duration * 1000, 3)}
+        if self.children:
+            result["children"] = [child.to_dict() for child in self.children]
+        return result
+
+
+class RequestTrace:
+    """单个请求的span树"""
+
+    def __init__(self, name: str):
+        self.root = Span(name)
+        self._stack = [self.root]
+
+    def push(self, name: str) -> Span:
+        span = Span(name)
+        self._stack[-1].children.append(span)
+        self._stack.append(span)
+        return span
+
+    def pop(self, span: Span):
+        span.end = time.perf_counter()
+        # 异常跳出时可能有未正常结束的子span
+        while self._stack and self._stack[-1] is not span:
+            self._stack.pop()
+        if len(self._stack) > 1:
+            self._stack.pop()
+
+    def finish(self):
+        self.root.end = time.perf_counter()
+
+    def totals(self) -> Dict[str, float]:
+        """按span名称汇总耗时（秒），同名span累加"""
+        totals: Dict[str, float] = {}
+        pending = list(self.root.children)
+        while pending:
+            span = pending.pop()
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration
+            pending.extend(span.children)
+        return totals
+
+    def server_timing(self) -> str:
+        """生成Server-Timing响应头"""
+        metrics = [
+            f"{name};dur={duration * 1000:.3f}"
+            for name, duration in sorted(self.totals().items(), key=lambda item: -item[1])
+        ]
+        metrics.append(f"total;dur={self.root.duration * 1000:.3f}")
+        return ", ".join(metrics)
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def begin_trace(name: str) -> RequestTrace:
+    """开始记录当前请求"""
+    trace = RequestTrace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+def end_trace(trace: RequestTrace):
+    trace.finish()
+    _current_trace.set(None)
+
+
+@contextmanager
+def span(name: str):
+    """记录一个阶段，当前没有请求在记录时不做任何事"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    current = trace.push(name)
+    try:
+        yield
+    finally:
+        trace.pop(current)
+
+
+def timed(name: str):
+    """方法计时装饰器"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            current = trace.push(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace.pop(current)
+        return wrapper
+    return decorator
+
+
+class SlowRequestLog:
+    """慢请求日志，每行一条JSON记录"""
+
+    def __init__(self, log_file: str):
+        self.log_file = log_file
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, method: str, path: str, query: str, status_code: int, trace: RequestTrace):
+        record = {
+            "timestamp": time.time(),
+            "method": method,
+            "path": path,
+            "query": query,
+            "status_code": status_code,
+            "duration_ms": round(trace.root.duration * 1000, 3),
+            "spans": trace.root.to_dict().get("children", [])
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.log_file) or ".", exist_ok=True)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.count += 1
+
+    def recent(self, limit: int = 50) -> List[Dict]:
+        """读取最近的慢请求记录"""
+        if not os.path.exists(self.log_file):
+            return []
+        with self._lock:
+            with open(self.log_file, 'r', encoding='utf-8') as f:
+                lines = deque(f, maxlen=limit)
+        records = []
+        for line in reversed(lines):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
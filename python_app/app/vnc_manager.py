@@ -6,6 +6,7 @@ KasmVNC多用户管理系统 - VNC管理器
 """
 
 import os
+import base64
 import subprocess
 import psutil
 import time
@@ -13,14 +14,47 @@ import json
 import shutil
 import tempfile
 import signal
+import threading
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 import logging
 
 from .models import (
     VNCUser, VNCDisplay, ServiceStatus, CreateUserRequest,
-    ConfigSettings, SystemStatus, OperationLog
+    ConfigSettings, SystemStatus, OperationLog, UserStatistics
 )
+from .desktop_watcher import DesktopSyncWatcher
+from .idle_reaper import IdleSessionReaper
+from .activation import SocketActivator
+from .ws_proxy import SessionProxy
+from .admission import AdmissionController
+from .cgroups import CgroupManager
+from .placement import PlacementEngine
+from .encoder_tuner import EncoderTuner
+from .warm_pool import WarmPool
+from .log_rotator import LogRotator
+from .health import HealthChecker
+from .connection_tracker import ConnectionTracker
+from .throughput import ThroughputCollector
+from .disk_usage import DiskUsageTracker
+from .supervisor import DisplaySupervisor, user_credentials, user_environment
+from .sync_manifest import Manifest, SyncManifestStore, diff_manifests
+from .serializer import UserSnapshotCache, dumps
+from .timing import span, timed
+from .command_runner import CommandRunner
+
+
+# 桌面同步涉及的目录（相对用户主目录）
+DESKTOP_DIRS = ["Desktop", "桌面"]
+ICONS_DIR = ".local/share/icons"
+AUTOSTART_DIR = ".config/autostart"
+DESKTOP_FILE_EXTENSIONS = ('.desktop', '.sh', '.png', '.jpg', '.jpeg', '.svg', '.ico')
+
+# 旧版启动脚本末尾常驻的日志跟踪命令
+TAIL_LOG_LINE = "\n# 显示日志\ntail -f ~/.vnc/*:${DISPLAY_NUM}.log\n"
+
+# 强制停止后等待进程退出的时间（秒）
+STOP_KILL_TIMEOUT = 5.0
 
 
 class VNCManager:
@@ -29,12 +63,52 @@ class VNCManager:
     def __init__(self, config: ConfigSettings):
         self.config = config
         self.users_data_file = "users_data.json"
+        self.sync_manifest_file = "sync_manifests.json"
+        self.placement_file = "placements.json"
+        self.encoder_tuning_file = "encoder_tuning.json"
+        self.warm_pool_file = "warm_pool.json"
+        self.log_rotation_file = "log_rotation.json"
+        self.connection_stats_file = "connection_stats.json"
+        self.throughput_stats_file = "throughput_stats.json"
+        self.disk_usage_file = "disk_usage.json"
         self.operation_logs: List[OperationLog] = []
+        # 状态版本号，用户数据或服务状态变化时递增，用于响应缓存失效
+        self.state_version = 0
+        self._state_lock = threading.Lock()
+        self._users_cache: Optional[Tuple[Tuple[int, int], List[VNCUser]]] = None
+        self._deps_cache: Optional[Tuple[float, bool, List[str]]] = None
+        # 每个用户的数据版本及内容指纹，用于预编码快照失效
+        self.user_revisions: Dict[str, int] = {}
+        self._user_fingerprints: Dict[str, bytes] = {}
+        self.user_snapshots = UserSnapshotCache()
         self.setup_logging()
+        # 外部命令统一经由此执行并统计耗时
+        self.commands = CommandRunner(self.logger)
         self.ensure_directories()
+        self.sync_manifests = SyncManifestStore(self.sync_manifest_file)
+        self.desktop_watcher = DesktopSyncWatcher(self)
+        self.idle_reaper = IdleSessionReaper(self)
+        self.activator = SocketActivator(self)
+        self.session_proxy = SessionProxy(self)
+        self.admission = AdmissionController(self)
+        self.cgroups = CgroupManager(self)
+        self.placement = PlacementEngine(self, self.placement_file)
+        self.encoder_tuner = EncoderTuner(self, self.encoder_tuning_file)
+        self.warm_pool = WarmPool(self, self.warm_pool_file)
+        self.supervisor = DisplaySupervisor(self)
+        self.log_rotator = LogRotator(self, self.log_rotation_file)
+        self.health = HealthChecker(self)
+        self.connections = ConnectionTracker(self, self.connection_stats_file)
+        self.throughput = ThroughputCollector(self, self.throughput_stats_file)
+        self.disk_usage = DiskUsageTracker(self, self.disk_usage_file)
+        # 显示器编号 -> 最近一次启动失败的原因
+        self.display_errors: Dict[int, str] = {}
+        # 初始化CPU采样基准，之后可非阻塞获取CPU使用率
+        psutil.cpu_percent(interval=None)
     
     def setup_logging(self):
         """设置日志"""
+        os.makedirs(self.config.log_dir, exist_ok=True)
         log_file = os.path.join(self.config.log_dir, "vnc_manager.log")
         logging.basicConfig(
             level=logging.INFO,
@@ -80,31 +154,83 @@ class VNCManager:
         else:
             self.logger.error(f"{operation} 失败: {error_message}")
     
+    def bump_state_version(self):
+        """递增状态版本号"""
+        with self._state_lock:
+            self.state_version += 1
+    
+    @timed("save_users")
     def save_users_data(self, users: List[VNCUser]):
         """保存用户数据到文件"""
         try:
             users_data = [user.model_dump() for user in users]
             with open(self.users_data_file, 'w', encoding='utf-8') as f:
                 json.dump(users_data, f, ensure_ascii=False, indent=2)
+            self._users_cache = None
+            self._track_user_revisions(users_data)
+            self.bump_state_version()
             self.logger.info(f"用户数据已保存到 {self.users_data_file}")
         except Exception as e:
             self.logger.error(f"保存用户数据失败: {e}")
     
+    @timed("load_users")
     def load_users_data(self) -> List[VNCUser]:
-        """从文件加载用户数据"""
+        """从文件加载用户数据，文件未变化时返回缓存的副本"""
         try:
             if os.path.exists(self.users_data_file):
-                with open(self.users_data_file, 'r', encoding='utf-8') as f:
-                    users_data = json.load(f)
-                users = [VNCUser(**user_data) for user_data in users_data]
+                stat = os.stat(self.users_data_file)
+                file_key = (stat.st_mtime_ns, stat.st_size)
+                cached = self._users_cache
+                if cached and cached[0] == file_key:
+                    return [self._copy_user(user) for user in cached[1]]
+                
+                with span("users_parse"):
+                    with open(self.users_data_file, 'r', encoding='utf-8') as f:
+                        users_data = json.load(f)
+                    users = [VNCUser(**user_data) for user_data in users_data]
+                self._track_user_revisions(users_data)
+                if cached:
+                    # 文件被外部修改
+                    self.bump_state_version()
+                self._users_cache = (file_key, users)
                 self.logger.info(f"已加载 {len(users)} 个用户数据")
-                return users
+                return [self._copy_user(user) for user in users]
         except Exception as e:
             self.logger.error(f"加载用户数据失败: {e}")
         return []
     
-    def check_dependencies(self) -> Tuple[bool, List[str]]:
-        """检查系统依赖"""
+    @staticmethod
+    def _copy_user(user: VNCUser) -> VNCUser:
+        """复制缓存中的用户，显示器列表是唯一可变的嵌套字段，比深拷贝快得多"""
+        return user.model_copy(update={"displays": [d.model_copy() for d in user.displays]})
+    
+    def _track_user_revisions(self, users_data: List[Dict]):
+        """比较每个用户的内容指纹，变化的用户递增数据版本"""
+        fingerprints = {}
+        for user_data in users_data:
+            username = user_data["username"]
+            fingerprint = dumps(user_data)
+            fingerprints[username] = fingerprint
+            if self._user_fingerprints.get(username) != fingerprint:
+                self.user_revisions[username] = self.user_revisions.get(username, 0) + 1
+        
+        for username in set(self.user_revisions) - set(fingerprints):
+            del self.user_revisions[username]
+        self._user_fingerprints = fingerprints
+        self.user_snapshots.retain(fingerprints)
+    
+    @timed("encode_users")
+    def encode_users(self, users: List[VNCUser]) -> bytes:
+        """使用预编码快照将用户列表编码为JSON"""
+        return self.user_snapshots.encode_users(users, self.user_revisions)
+    
+    @timed("dependency_check")
+    def check_dependencies(self, use_cache: bool = False) -> Tuple[bool, List[str]]:
+        """检查系统依赖，use_cache为True时在有效期内直接返回上次结果"""
+        cached = self._deps_cache
+        if use_cache and cached and time.time() - cached[0] < self.config.dependency_check_ttl:
+            return cached[1], list(cached[2])
+        
         dependencies = ["kasmvncserver", "kasmvncpasswd", "openssl", "pulseaudio"]
         missing = []
         
@@ -117,6 +243,7 @@ class VNCManager:
         else:
             self.log_operation("dependency_check", details="依赖检查通过", success=True)
         
+        self._deps_cache = (time.time(), len(missing) == 0, missing)
         return len(missing) == 0, missing
     
     def generate_ssl_certificate(self, username: str) -> Tuple[str, str]:
@@ -138,7 +265,7 @@ class VNCManager:
                 "-subj", f"/C=CN/ST=Beijing/L=Beijing/O=KasmVNC/OU=IT/CN={username}.kasmvnc.local"
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            result = self.commands.run(cmd)
             
             if result.returncode == 0:
                 # 设置文件权限
@@ -161,7 +288,7 @@ class VNCManager:
         try:
             # 检查用户是否已存在
             try:
-                subprocess.run(["id", username], check=True, capture_output=True)
+                self.commands.run(["id", username], check=True)
                 self.logger.info(f"用户 {username} 已存在")
                 return True
             except subprocess.CalledProcessError:
@@ -172,7 +299,7 @@ class VNCManager:
             
             # 创建用户
             cmd = ["useradd", "-m", "-d", home_dir, "-s", "/bin/bash", username]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            result = self.commands.run(cmd)
             
             if result.returncode != 0:
                 raise Exception(f"创建用户失败: {result.stderr}")
@@ -180,7 +307,7 @@ class VNCManager:
             # 设置密码
             cmd = ["chpasswd"]
             password_input = f"{username}:{password}"
-            result = subprocess.run(cmd, input=password_input, text=True, capture_output=True)
+            result = self.commands.run(cmd, input=password_input)
             
             if result.returncode != 0:
                 raise Exception(f"设置密码失败: {result.stderr}")
@@ -202,24 +329,24 @@ class VNCManager:
             self.log_operation("create_user", username, error_message=str(e), success=False)
             return False
     
-    def setup_vnc_password(self, username: str, password: str, home_dir: str) -> bool:
-        """设置VNC密码"""
+    def setup_vnc_password(self, username: str, password: str, home_dir: str,
+                           force: bool = False) -> bool:
+        """设置VNC密码，force为True时覆盖已有密码"""
         try:
             vnc_dir = os.path.join(home_dir, ".vnc")
             passwd_file = os.path.join(vnc_dir, "passwd")
             
-            if os.path.exists(passwd_file):
+            if os.path.exists(passwd_file) and not force:
                 self.logger.info(f"用户 {username} 的VNC密码已存在")
                 return True
             
-            # 设置VNC密码
-            cmd = ["kasmvncpasswd", "-u", username, "-o", "-w", "-r"]
-            password_input = f"{password}\\n{password}\\n"
+            # 设置VNC密码，密码经标准输入传递，不出现在命令行中
+            password_input = f"{password}\n{password}\n"
             
             # 以用户身份执行
-            result = subprocess.run(
-                ["su", "-", username, "-c", f"echo -e '{password_input}' | kasmvncpasswd -u {username} -o -w -r"],
-                capture_output=True, text=True, shell=True
+            result = self.commands.run(
+                ["su", "-", username, "-c", f"kasmvncpasswd -u {username} -o -w -r"],
+                input=password_input, secrets=[password]
             )
             
             if result.returncode != 0:
@@ -245,6 +372,9 @@ class VNCManager:
         if cert_file and key_file:
             cert_opts = f"-cert {cert_file} -key {key_file}"
         
+        # CPU/NUMA放置和编码调优作为脚本默认值，启动时管理器通过环境变量传入最新设置
+        launch_env = self.display_launch_env(display_num)
+        
         # 生成启动脚本内容
         script_content = f"""#!/bin/bash
 # KasmVNC启动脚本 - 用户: {username}, 显示器: :{display_num}
@@ -252,28 +382,53 @@ class VNCManager:
 
 USER={username}
 DISPLAY_NUM={display_num}
-WEBSOCKET_PORT={websocket_port}
-VNC_THREADS={self.config.vnc_threads}
+# 按需启动模式下由管理器指定内部端口和监听地址
+WEBSOCKET_PORT=${{KASMVNC_WEBSOCKET_PORT:-{websocket_port}}}
+INTERFACE=${{KASMVNC_INTERFACE:-0.0.0.0}}
+# 由管理器按CPU/NUMA放置指定，变量为空表示不绑定
+VNC_THREADS=${{KASMVNC_RECT_THREADS:-{launch_env['KASMVNC_RECT_THREADS']}}}
+CPUSET=${{KASMVNC_CPUSET-{launch_env['KASMVNC_CPUSET']}}}
+NUMA_NODE=${{KASMVNC_NUMA_NODE-{launch_env['KASMVNC_NUMA_NODE']}}}
+# 由编码参数调优指定，变量为空表示使用KasmVNC默认值
+FRAME_RATE=${{KASMVNC_FRAME_RATE-{launch_env['KASMVNC_FRAME_RATE']}}}
+QUALITY_MAX=${{KASMVNC_QUALITY_MAX-{launch_env['KASMVNC_QUALITY_MAX']}}}
+
+ENCODER_OPTS=""
+if [ -n "${{FRAME_RATE}}" ]; then
+    ENCODER_OPTS="${{ENCODER_OPTS}} -FrameRate ${{FRAME_RATE}}"
+fi
+if [ -n "${{QUALITY_MAX}}" ]; then
+    ENCODER_OPTS="${{ENCODER_OPTS}} -DynamicQualityMax ${{QUALITY_MAX}}"
+fi
+
+LAUNCHER=""
+if [ -n "${{NUMA_NODE}}" ] && command -v numactl >/dev/null 2>&1; then
+    if [ -n "${{CPUSET}}" ]; then
+        LAUNCHER="numactl --physcpubind=${{CPUSET}} --membind=${{NUMA_NODE}}"
+    else
+        LAUNCHER="numactl --cpunodebind=${{NUMA_NODE}} --membind=${{NUMA_NODE}}"
+    fi
+elif [ -n "${{CPUSET}}" ] && command -v taskset >/dev/null 2>&1; then
+    LAUNCHER="taskset -c ${{CPUSET}}"
+fi
 
 # 清理旧的显示器锁文件
 rm -rf /tmp/.X${{DISPLAY_NUM}}-lock /tmp/.X11-unix/X${{DISPLAY_NUM}}
 
 # 启动KasmVNC服务器
-kasmvncserver :${{DISPLAY_NUM}} \\
+${{LAUNCHER}} kasmvncserver :${{DISPLAY_NUM}} \\
     -select-de xfce \\
-    -interface 0.0.0.0 \\
+    -interface ${{INTERFACE}} \\
     -websocketPort ${{WEBSOCKET_PORT}} \\
     -geometry {self.config.default_resolution} \\
     -RectThreads ${{VNC_THREADS}} \\
+    ${{ENCODER_OPTS}} \\
     {cert_opts}
 
 # 启动音频服务
 if [ "{self.config.enable_audio}" = "True" ]; then
     pulseaudio --start --daemonize
 fi
-
-# 显示日志
-tail -f ~/.vnc/*:${{DISPLAY_NUM}}.log
 """
         
         try:
@@ -334,6 +489,7 @@ fi
                              error_message=str(e), success=False)
             raise
     
+    @timed("create_users")
     def create_users(self, request: CreateUserRequest) -> List[VNCUser]:
         """批量创建用户"""
         users = []
@@ -378,7 +534,8 @@ fi
                     display = VNCDisplay(
                         display_number=display_num,
                         websocket_port=websocket_port,
-                        status=ServiceStatus.STOPPED
+                        status=ServiceStatus.STOPPED,
+                        log_file=self.display_log_file(username, display_num)
                     )
                     displays.append(display)
                 
@@ -414,7 +571,10 @@ fi
         return users
     
     def get_process_by_display(self, display_num: int) -> Optional[psutil.Process]:
-        """根据显示器编号获取进程"""
+        """根据显示器编号获取进程，监管器启动的显示器直接使用其进程句柄"""
+        supervised = self.supervisor.process_map().get(display_num)
+        if supervised is not None:
+            return supervised
         try:
             for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
                 try:
@@ -428,6 +588,118 @@ fi
             pass
         return None
     
+    @timed("process_scan")
+    def get_display_process_map(self) -> Dict[int, psutil.Process]:
+        """扫描一次进程表，返回 显示器编号 -> 进程 的映射，监管器启动的显示器优先使用其进程句柄"""
+        processes = self.supervisor.process_map()
+        try:
+            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+                try:
+                    if proc.info['name'] == 'kasmvncserver':
+                        for arg in proc.info['cmdline'] or []:
+                            if arg.startswith(':') and arg[1:].isdigit():
+                                processes.setdefault(int(arg[1:]), proc)
+                                break
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+        except Exception:
+            pass
+        return processes
+    
+    @timed("status_merge")
+    def update_users_status(self, users: List[VNCUser],
+                            process_map: Dict[int, psutil.Process] = None):
+        """根据进程表更新用户显示器状态，最后活跃时间取自客户端连接跟踪"""
+        if process_map is None:
+            process_map = self.get_display_process_map()
+        
+        for user in users:
+            user.last_active = self.connections.last_active(user.username) or user.last_active
+            for display in user.displays:
+                proc = process_map.get(display.display_number)
+                if proc:
+                    display.status = ServiceStatus.RUNNING
+                    display.pid = proc.pid
+                else:
+                    display.status = ServiceStatus.STOPPED
+                    display.pid = None
+    
+    @timed("query_users")
+    def query_users(self, cursor: Optional[str] = None, limit: Optional[int] = None,
+                    status: Optional[str] = None, https_enabled: Optional[bool] = None,
+                    prefix: Optional[str] = None, fields: Optional[List[str]] = None) -> Dict:
+        """
+        分页查询用户
+        
+        - cursor: 上一页返回的游标
+        - limit: 每页数量，不指定返回全部
+        - status: running（有运行中的显示器）或 stopped
+        - https_enabled / prefix: 按HTTPS状态、用户名前缀过滤
+        - fields: 返回的字段，不指定返回全部；未请求状态相关字段时不扫描进程表
+        
+        返回的users为当前页的VNCUser对象，由调用方按fields投影或快速编码
+        """
+        if fields is not None:
+            unknown = set(fields) - set(VNCUser.model_fields)
+            if unknown:
+                raise ValueError(f"未知字段: {sorted(unknown)}")
+        if status is not None and status not in (ServiceStatus.RUNNING, ServiceStatus.STOPPED):
+            raise ValueError(f"不支持的状态过滤: {status}")
+        
+        users = self.load_users_data()
+        
+        # 先按廉价条件过滤
+        if prefix:
+            users = [u for u in users if u.username.startswith(prefix)]
+        if https_enabled is not None:
+            users = [u for u in users if u.https_enabled == https_enabled]
+        
+        # 只有需要时才扫描进程表
+        need_status = status is not None or fields is None or bool(
+            {"displays", "last_active"} & set(fields)
+        )
+        if need_status:
+            self.update_users_status(users)
+        if status is not None:
+            running = status == ServiceStatus.RUNNING
+            users = [
+                u for u in users
+                if any(d.status == ServiceStatus.RUNNING for d in u.displays) == running
+            ]
+        
+        total = len(users)
+        start = self._decode_user_cursor(cursor, users) if cursor else 0
+        end = total if limit is None else min(start + limit, total)
+        page = users[start:end]
+        next_cursor = self._encode_user_cursor(end, page[-1].username) if end < total and page else None
+        
+        return {
+            "users": page,
+            "total": total,
+            "next_cursor": next_cursor
+        }
+    
+    @staticmethod
+    def _encode_user_cursor(index: int, username: str) -> str:
+        """生成分页游标（下一页起始位置和上一页最后一个用户名）"""
+        raw = json.dumps({"i": index, "u": username}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+    
+    @staticmethod
+    def _decode_user_cursor(cursor: str, users: List[VNCUser]) -> int:
+        """解析分页游标，优先按用户名定位，用户已被删除时退回到位置"""
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            index, username = int(data["i"]), data["u"]
+        except Exception:
+            raise ValueError("无效的分页游标")
+        
+        for i, user in enumerate(users):
+            if user.username == username:
+                return i + 1
+        return min(max(index, 0), len(users))
+    
+    @timed("start_display")
     def start_vnc_display(self, username: str, display_num: int) -> bool:
         """启动VNC显示器"""
         try:
@@ -443,12 +715,58 @@ fi
             if not os.path.exists(script_file):
                 raise Exception(f"启动脚本不存在: {script_file}")
             
-            # 创建日志目录
-            log_file = os.path.join(self.config.log_dir, f"{username}_display_{display_num}.log")
+            log_file = self.display_log_file(username, display_num)
+            
+            # 准入控制: 资源余量不足时排队，超时仍不足则拒绝
+            decision = self.admission.acquire(username, display_num)
+            if not decision.admitted:
+                raise Exception(f"准入拒绝: {decision.reason}")
+            
+            # 由监管器直接启动 kasmvncserver -fg 并持有进程句柄
+            if self.supervisor.enabled():
+                session = self.supervisor.launch(username, display_num)
+                if self.config.enable_audio:
+                    self._start_audio(username)
+                self.display_errors.pop(display_num, None)
+                self.bump_state_version()
+                self.log_operation("start_vnc_display", username,
+                                 f"显示器 :{display_num} 启动成功 (PID: {session.pid})")
+                return True
+            
+            with open(script_file, 'r', encoding='utf-8') as f:
+                script_content = f.read()
+            
+            # 旧版脚本末尾的 tail -f 会为每个显示器常驻一个进程，启动前去掉，日志通过日志接口查看
+            if TAIL_LOG_LINE in script_content:
+                script_content = script_content.replace(TAIL_LOG_LINE, "")
+                with open(script_file, 'w', encoding='utf-8') as f:
+                    f.write(script_content)
+            
+            # 按需启动模式下显示器监听内部端口，公开端口由管理器转发
+            env_prefix = ""
+            if self.config.activation_enabled:
+                if "KASMVNC_WEBSOCKET_PORT" not in script_content:
+                    raise Exception(f"启动脚本不支持按需启动，请重新创建用户生成脚本: {script_file}")
+                display = self.find_display(username, display_num)
+                if display is None:
+                    raise Exception(f"用户 {username} 没有显示器 :{display_num}")
+                env_prefix = (f"KASMVNC_WEBSOCKET_PORT={self.display_backend_port(display.websocket_port)} "
+                              f"KASMVNC_INTERFACE=127.0.0.1 ")
+            
+            # CPU/NUMA放置和编码调优: 脚本据此设置RectThreads、帧率、画质和绑定，亲和性由管理器在启动后设置
+            env_prefix += "".join(f"{name}={value} " for name, value in
+                                  self.display_launch_env(display_num).items())
+            
+            # 用户cgroup先建好，启动后把进程树迁入
+            cgroup_ready = False
+            try:
+                cgroup_ready = self.cgroups.ensure_user_cgroup(username) is not None
+            except OSError as e:
+                self.logger.warning(f"准备用户 {username} 的cgroup失败，不做资源隔离: {e}")
             
             # 以用户身份启动VNC服务
-            cmd = ["su", "-", username, "-c", f"nohup bash '{script_file}' > '{log_file}' 2>&1 &"]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            cmd = ["su", "-", username, "-c", f"{env_prefix}nohup bash '{script_file}' >> '{log_file}' 2>&1 &"]
+            result = self.commands.run(cmd, name="su:start_display")
             
             if result.returncode != 0:
                 raise Exception(f"启动失败: {result.stderr}")
@@ -459,6 +777,12 @@ fi
             # 验证启动状态
             proc = self.get_process_by_display(display_num)
             if proc:
+                # su 已退出，由管理器把进程树迁入用户cgroup并设置亲和性
+                if cgroup_ready:
+                    self.cgroups.attach_process_tree(username, proc)
+                self.placement.apply_affinity(display_num, proc)
+                self.display_errors.pop(display_num, None)
+                self.bump_state_version()
                 self.log_operation("start_vnc_display", username, 
                                  f"显示器 :{display_num} 启动成功 (PID: {proc.pid})")
                 return True
@@ -466,51 +790,208 @@ fi
                 raise Exception("启动后未发现进程")
                 
         except Exception as e:
+            self.admission.release(display_num)
+            self.display_errors[display_num] = str(e)
             self.log_operation("start_vnc_display", username, 
                              error_message=str(e), success=False)
             return False
     
-    def stop_vnc_display(self, username: str, display_num: int) -> bool:
-        """停止VNC显示器"""
+    def display_log_file(self, username: str, display_num: int) -> str:
+        """显示器启动输出的日志文件"""
+        return os.path.abspath(os.path.join(self.config.log_dir, f"{username}_display_{display_num}.log"))
+    
+    def display_launch_env(self, display_num: int) -> Dict[str, str]:
+        """启动脚本读取的环境变量: CPU/NUMA放置，编码调优的设置优先"""
+        env = self.placement.launch_env(display_num)
+        env.update(self.encoder_tuner.launch_env(display_num))
+        return env
+    
+    def _start_audio(self, username: str):
+        """以用户身份启动音频服务"""
+        user = self.find_user(username)
         try:
-            proc = self.get_process_by_display(display_num)
-            if not proc:
-                self.logger.info(f"显示器 :{display_num} 未在运行")
-                return True
-            
-            # 尝试优雅停止
-            proc.terminate()
-            
-            # 等待进程停止
-            try:
-                proc.wait(timeout=10)
-            except psutil.TimeoutExpired:
-                # 强制停止
-                self.logger.warning(f"优雅停止超时，强制停止进程 {proc.pid}")
-                proc.kill()
-                proc.wait(timeout=5)
-            
-            # 清理锁文件
-            lock_files = [
-                f"/tmp/.X{display_num}-lock",
-                f"/tmp/.X11-unix/X{display_num}"
-            ]
-            for lock_file in lock_files:
+            result = self.commands.run(
+                ["pulseaudio", "--start", "--daemonize"],
+                env=user_environment(username, user.home_directory),
+                **user_credentials(username)
+            )
+            if result.returncode != 0:
+                self.logger.warning(f"用户 {username} 的音频服务启动失败: {result.stderr}")
+        except (OSError, KeyError) as e:
+            self.logger.warning(f"用户 {username} 的音频服务启动失败: {e}")
+    
+    def find_user(self, username: str) -> Optional[VNCUser]:
+        """查找用户，包括预启动池账号"""
+        for user in self.load_users_data():
+            if user.username == username:
+                return user
+        return self.warm_pool.find_account(username)
+    
+    def find_display(self, username: str, display_num: int) -> Optional[VNCDisplay]:
+        """查找用户的显示器配置"""
+        user = self.find_user(username)
+        if user is None:
+            return None
+        return next((display for display in user.displays if display.display_number == display_num), None)
+    
+    def build_vnc_command(self, user: VNCUser, display: VNCDisplay, foreground: bool = False) -> List[str]:
+        """
+        kasmvncserver 命令行，参数与启动脚本一致
+        
+        包括按需启动的监听地址和端口、CPU/NUMA放置（有numactl时绑定内存节点）及编码调优设置
+        """
+        env = self.display_launch_env(display.display_number)
+        if self.config.activation_enabled:
+            interface, port = "127.0.0.1", self.display_backend_port(display.websocket_port)
+        else:
+            interface, port = "0.0.0.0", display.websocket_port
+        
+        argv = ["kasmvncserver", f":{display.display_number}"]
+        if foreground:
+            argv.append("-fg")
+        argv += [
+            "-select-de", "xfce",
+            "-interface", interface,
+            "-websocketPort", str(port),
+            "-geometry", self.config.default_resolution,
+            "-RectThreads", env["KASMVNC_RECT_THREADS"]
+        ]
+        if env["KASMVNC_FRAME_RATE"]:
+            argv += ["-FrameRate", env["KASMVNC_FRAME_RATE"]]
+        if env["KASMVNC_QUALITY_MAX"]:
+            argv += ["-DynamicQualityMax", env["KASMVNC_QUALITY_MAX"]]
+        if user.cert_file and user.key_file:
+            argv += ["-cert", user.cert_file, "-key", user.key_file]
+        if env["KASMVNC_NUMA_NODE"] and shutil.which("numactl"):
+            # CPU集为空（如编码调优覆盖）时按节点绑定，numactl不接受空的 --physcpubind
+            if env["KASMVNC_CPUSET"]:
+                cpu_bind = f"--physcpubind={env['KASMVNC_CPUSET']}"
+            else:
+                cpu_bind = f"--cpunodebind={env['KASMVNC_NUMA_NODE']}"
+            argv = ["numactl", cpu_bind, f"--membind={env['KASMVNC_NUMA_NODE']}"] + argv
+        return argv
+    
+    @staticmethod
+    def cleanup_display_locks(display_nums: List[int]):
+        """清理显示器的X锁文件和套接字"""
+        for display_num in display_nums:
+            for lock_file in (f"/tmp/.X{display_num}-lock", f"/tmp/.X11-unix/X{display_num}"):
                 try:
-                    if os.path.exists(lock_file):
+                    if os.path.lexists(lock_file):
                         os.remove(lock_file)
                 except OSError:
                     pass
-            
-            self.log_operation("stop_vnc_display", username, 
-                             f"显示器 :{display_num} 停止成功")
-            return True
-            
-        except Exception as e:
-            self.log_operation("stop_vnc_display", username, 
-                             error_message=str(e), success=False)
-            return False
     
+    def display_backend_port(self, websocket_port: int) -> int:
+        """显示器实际监听的端口，按需启动模式下为偏移后的内部端口"""
+        if self.config.activation_enabled:
+            return websocket_port + self.config.activation_port_offset
+        return websocket_port
+    
+    @timed("stop_display")
+    def stop_vnc_display(self, username: str, display_num: int) -> bool:
+        """停止VNC显示器"""
+        return self.stop_vnc_displays([(username, display_num)])[display_num]
+    
+    @timed("stop_displays")
+    def stop_vnc_displays(self, targets: List[Tuple[str, int]], timeout: float = None) -> Dict[int, bool]:
+        """
+        批量停止VNC显示器
+        
+        先向所有目标同时发送SIGTERM，再统一等待（最长timeout，默认supervisor_stop_timeout），
+        只对超时未退出的进程发送SIGKILL，最后一次性清理锁文件。总耗时不随显示器数量增长。
+        返回 显示器编号 -> 是否停止成功
+        """
+        timeout = self.config.supervisor_stop_timeout if timeout is None else timeout
+        results: Dict[int, bool] = {}
+        errors: Dict[int, str] = {}
+        # 监管器启动的显示器: 停止整个进程组并取消重启
+        popens: Dict[int, subprocess.Popen] = {}
+        procs: Dict[int, psutil.Process] = {}
+        process_map = None
+        
+        for username, display_num in targets:
+            try:
+                if self.supervisor.owns(display_num):
+                    popen = self.supervisor.request_stop(display_num)
+                    if popen is not None:
+                        popens[display_num] = popen
+                    continue
+                if process_map is None:
+                    process_map = self.get_display_process_map()
+                proc = process_map.get(display_num)
+                if proc is None:
+                    self.logger.info(f"显示器 :{display_num} 未在运行")
+                    results[display_num] = True
+                    continue
+                proc.terminate()
+                procs[display_num] = proc
+            except psutil.NoSuchProcess:
+                pass
+            except Exception as e:
+                errors[display_num] = str(e)
+        
+        # 统一等待，超时后只强制停止仍在运行的进程
+        popens, procs = self._wait_stopped(popens, procs, timeout)
+        if popens or procs:
+            self.logger.warning(
+                f"优雅停止超时，强制停止显示器: {', '.join(f':{n}' for n in sorted([*popens, *procs]))}"
+            )
+            for popen in popens.values():
+                self.supervisor.kill(popen)
+            for proc in procs.values():
+                try:
+                    proc.kill()
+                except psutil.NoSuchProcess:
+                    pass
+            popens, procs = self._wait_stopped(popens, procs, STOP_KILL_TIMEOUT)
+        for display_num in [*popens, *procs]:
+            errors.setdefault(display_num, "进程强制停止后仍在运行")
+        
+        stopped = [display_num for _, display_num in targets
+                   if display_num not in errors and display_num not in results]
+        self.cleanup_display_locks(stopped)
+        if stopped:
+            self.bump_state_version()
+        
+        for username, display_num in targets:
+            if display_num in results:
+                continue
+            if display_num in errors:
+                results[display_num] = False
+                self.log_operation("stop_vnc_display", username,
+                                 error_message=errors[display_num], success=False)
+            else:
+                results[display_num] = True
+                self.log_operation("stop_vnc_display", username,
+                                 f"显示器 :{display_num} 停止成功")
+        return results
+    
+    @staticmethod
+    def _wait_stopped(popens: Dict[int, subprocess.Popen], procs: Dict[int, psutil.Process],
+                      timeout: float) -> Tuple[Dict[int, subprocess.Popen], Dict[int, psutil.Process]]:
+        """
+        等待一组进程退出，返回超时后仍在运行的进程
+        
+        psutil进程用 wait_procs 集中等待；监管器的子进程通过 Popen.poll 回收，以保留退出码
+        """
+        deadline = time.monotonic() + timeout
+        interval = 0.01
+        while True:
+            popens = {n: p for n, p in popens.items() if p.poll() is None}
+            if procs:
+                # 只剩psutil进程时直接阻塞等待到截止时间
+                wait_timeout = 0 if popens else max(deadline - time.monotonic(), 0)
+                _, alive = psutil.wait_procs(list(procs.values()), timeout=wait_timeout)
+                alive_pids = {proc.pid for proc in alive}
+                procs = {n: p for n, p in procs.items() if p.pid in alive_pids}
+            remaining = deadline - time.monotonic()
+            if not (popens or procs) or remaining <= 0:
+                return popens, procs
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, 0.1)
+    
+    @timed("system_status")
     def get_system_status(self) -> SystemStatus:
         """获取系统状态"""
         try:
@@ -521,23 +1002,27 @@ fi
             active_users = 0
             total_displays = 0
             running_displays = 0
+            process_map = self.get_display_process_map()
             
             for user in users:
                 total_displays += len(user.displays)
-                user_has_running = False
+                user_connected = False
                 
                 for display in user.displays:
-                    if self.get_process_by_display(display.display_number):
+                    if display.display_number in process_map:
                         running_displays += 1
-                        user_has_running = True
+                        # 活跃指有客户端连接，而不只是显示器在运行
+                        if self.connections.clients(display.display_number):
+                            user_connected = True
                 
-                if user_has_running:
+                if user_connected:
                     active_users += 1
             
             # 系统资源信息
-            cpu_usage = psutil.cpu_percent(interval=1)
-            memory = psutil.virtual_memory()
-            disk = psutil.disk_usage('/')
+            with span("resource_metrics"):
+                cpu_usage = psutil.cpu_percent(interval=None)
+                memory = psutil.virtual_memory()
+                disk = psutil.disk_usage('/')
             
             return SystemStatus(
                 total_users=total_users,
@@ -563,10 +1048,11 @@ fi
                 uptime=0.0
             )
     
+    @timed("sync_desktop")
     def sync_desktop(self, source_user: str, target_users: List[str], 
                     sync_desktop: bool = True, sync_icons: bool = True, 
                     sync_autostart: bool = True) -> Dict[str, bool]:
-        """同步桌面配置"""
+        """同步桌面配置，复制源用户同步目录中的全部文件，不删除目标用户的文件"""
         results = {}
         
         try:
@@ -575,7 +1061,9 @@ fi
                 users = self.load_users_data()
                 target_users = [user.username for user in users]
             
-            source_home = f"/home/{source_user}"
+            source_home = self.get_source_home(source_user)
+            roots = self.desktop_sync_roots(sync_desktop, sync_icons, sync_autostart)
+            source_manifest = self.build_source_manifest(source_home, roots)
             
             for target_username in target_users:
                 if target_username == source_user:
@@ -583,91 +1071,262 @@ fi
                 
                 try:
                     target_home = os.path.join(self.config.base_user_home, target_username)
+                    start_time = time.time()
                     
-                    # 同步桌面文件
-                    if sync_desktop:
-                        self._sync_desktop_files(source_home, target_home, target_username)
-                    
-                    # 同步图标
-                    if sync_icons:
-                        self._sync_icons(source_home, target_home, target_username)
+                    # 每个文件都复制，目标用户改动过的文件也恢复为源文件
+                    for rel_path in source_manifest:
+                        self._sync_single_path(source_home, target_home, target_username, rel_path)
                     
-                    # 同步自启动
-                    if sync_autostart:
-                        self._sync_autostart(source_home, target_home, target_username)
+                    self.sync_manifests.replace_target(source_user, target_username, source_manifest, roots)
+                    self.sync_manifests.record_throughput(
+                        sum(entry[0] for entry in source_manifest.values()),
+                        len(source_manifest), time.time() - start_time
+                    )
                     
                     results[target_username] = True
                     self.log_operation("sync_desktop", target_username, 
-                                     f"桌面同步成功 (源: {source_user})")
+                                     f"桌面同步成功 (源: {source_user}, 复制 {len(source_manifest)} 个文件)")
                     
                 except Exception as e:
                     results[target_username] = False
                     self.log_operation("sync_desktop", target_username, 
                                      error_message=str(e), success=False)
             
+            self.sync_manifests.save()
+            
         except Exception as e:
             self.log_operation("sync_desktop", details=f"桌面同步失败: {e}", success=False)
         
         return results
     
-    def _sync_desktop_files(self, source_home: str, target_home: str, target_username: str):
-        """同步桌面文件"""
-        desktop_dirs = ["Desktop", "桌面"]
+    @timed("sync_plan")
+    def plan_desktop_sync(self, source_user: str, target_users: List[str],
+                          sync_desktop: bool = True, sync_icons: bool = True,
+                          sync_autostart: bool = True) -> Dict:
+        """
+        生成同步计划（模拟运行），只读取源目录和已缓存的同步清单，不访问目标用户主目录
+        
+        create/update 为相对上次从该源用户同步的变化，delete 为源中已删除的文件（实际同步不删除，只报告）；
+        实际同步复制全部源文件，字节数和预估耗时按全部源文件计算
+        """
+        if not target_users:
+            users = self.load_users_data()
+            target_users = [user.username for user in users]
+        
+        source_home = self.get_source_home(source_user)
+        roots = self.desktop_sync_roots(sync_desktop, sync_icons, sync_autostart)
+        source_manifest = self.build_source_manifest(source_home, roots)
+        
+        targets = {}
+        total_bytes = 0
+        total_files = 0
+        for target_username in target_users:
+            if target_username == source_user:
+                continue
+            
+            target_manifest = self.sync_manifests.get_target(source_user, target_username, roots)
+            plan = diff_manifests(source_manifest, target_manifest)
+            create = [{"path": p, "bytes": source_manifest[p][0]} for p in plan["create"]]
+            update = [{"path": p, "bytes": source_manifest[p][0]} for p in plan["update"]]
+            delete = [{"path": p, "bytes": target_manifest[p][0]} for p in plan["delete"]]
+            
+            copy_bytes = sum(entry[0] for entry in source_manifest.values())
+            file_count = len(source_manifest)
+            total_bytes += copy_bytes
+            total_files += file_count
+            
+            targets[target_username] = {
+                "has_manifest": self.sync_manifests.has_target(source_user, target_username),
+                "create": create,
+                "update": update,
+                "delete": delete,
+                "unchanged_count": len(plan["unchanged"]),
+                "bytes": copy_bytes,
+                "estimated_seconds": round(self.sync_manifests.estimate_seconds(copy_bytes, file_count), 3)
+            }
+        
+        return {
+            "source_user": source_user,
+            "source_files": len(source_manifest),
+            "targets": targets,
+            "total_bytes": total_bytes,
+            "total_files": total_files,
+            "estimated_seconds": round(self.sync_manifests.estimate_seconds(total_bytes, total_files), 3)
+        }
+    
+    @timed("source_scan")
+    def build_source_manifest(self, source_home: str, roots: List[str]) -> Manifest:
+        """扫描源用户同步目录，生成清单"""
+        manifest = {}
+        for root in roots:
+            manifest.update(self._scan_sync_path(source_home, root))
+        return manifest
+    
+    def _scan_sync_path(self, source_home: str, rel_path: str) -> Manifest:
+        """扫描源路径（文件或目录）下需要同步的文件"""
+        manifest = {}
+        source_path = os.path.join(source_home, rel_path)
+        
+        if os.path.isdir(source_path) and not os.path.islink(source_path):
+            for root, dirs, files in os.walk(source_path):
+                for file in files:
+                    file_path = os.path.join(root, file)
+                    manifest.update(self._scan_sync_path(source_home, os.path.relpath(file_path, source_home)))
+        elif os.path.isfile(source_path):
+            category = self.classify_sync_path(rel_path)
+            if category and self._is_synced_file(category, rel_path):
+                stat = os.stat(source_path)
+                manifest[rel_path] = (stat.st_size, stat.st_mtime)
+        return manifest
+    
+    @timed("sync_paths")
+    def sync_desktop_paths(self, source_user: str, rel_paths: List[str],
+                           target_users: List[str] = None) -> Dict[str, bool]:
+        """增量同步指定路径（相对源用户主目录），源路径不存在时删除目标中的对应文件"""
+        results = {}
+        
+        if not target_users:
+            users = self.load_users_data()
+            target_users = [user.username for user in users]
+        
+        source_home = self.get_source_home(source_user)
+        rel_paths = [p for p in dict.fromkeys(rel_paths) if self.classify_sync_path(p)]
+        if not rel_paths:
+            return results
+        
+        # 更新后的清单条目，以及已从源中移除的路径
+        entries = {}
+        for rel_path in rel_paths:
+            entries.update(self._scan_sync_path(source_home, rel_path))
+        removed_prefixes = tuple(
+            p for p in rel_paths if not os.path.exists(os.path.join(source_home, p))
+        )
         
-        for desktop_dir in desktop_dirs:
-            source_desktop = os.path.join(source_home, desktop_dir)
-            target_desktop = os.path.join(target_home, desktop_dir)
+        for target_username in target_users:
+            if target_username == source_user:
+                continue
             
-            if os.path.exists(source_desktop):
-                os.makedirs(target_desktop, exist_ok=True)
+            try:
+                target_home = os.path.join(self.config.base_user_home, target_username)
+                start_time = time.time()
+                for rel_path in rel_paths:
+                    self._sync_single_path(source_home, target_home, target_username, rel_path)
                 
-                # 复制文件
-                for root, dirs, files in os.walk(source_desktop):
-                    for file in files:
-                        if file.endswith(('.desktop', '.sh', '.png', '.jpg', '.jpeg', '.svg', '.ico')):
-                            source_file = os.path.join(root, file)
-                            rel_path = os.path.relpath(source_file, source_desktop)
-                            target_file = os.path.join(target_desktop, rel_path)
-                            
-                            os.makedirs(os.path.dirname(target_file), exist_ok=True)
-                            shutil.copy2(source_file, target_file)
-                            
-                            # 修复.desktop文件路径
-                            if file.endswith('.desktop'):
-                                self._fix_desktop_file(target_file, target_username)
-                            
-                            shutil.chown(target_file, target_username, target_username)
+                removed = [
+                    p for p in self.sync_manifests.get_target(source_user, target_username)
+                    if p in removed_prefixes or p.startswith(tuple(r + "/" for r in removed_prefixes))
+                ]
+                self.sync_manifests.update_paths(source_user, target_username, entries, removed)
+                self.sync_manifests.record_throughput(
+                    sum(entry[0] for entry in entries.values()),
+                    len(entries), time.time() - start_time
+                )
                 
-                shutil.chown(target_desktop, target_username, target_username)
-    
-    def _sync_icons(self, source_home: str, target_home: str, target_username: str):
-        """同步图标"""
-        source_icons = os.path.join(source_home, ".local/share/icons")
-        target_icons = os.path.join(target_home, ".local/share/icons")
-        
-        if os.path.exists(source_icons):
-            os.makedirs(os.path.dirname(target_icons), exist_ok=True)
-            shutil.copytree(source_icons, target_icons, dirs_exist_ok=True)
-            shutil.chown(target_icons, target_username, target_username)
-    
-    def _sync_autostart(self, source_home: str, target_home: str, target_username: str):
-        """同步自启动应用"""
-        source_autostart = os.path.join(source_home, ".config/autostart")
-        target_autostart = os.path.join(target_home, ".config/autostart")
-        
-        if os.path.exists(source_autostart):
-            os.makedirs(target_autostart, exist_ok=True)
-            
-            for file in os.listdir(source_autostart):
-                if file.endswith('.desktop'):
-                    source_file = os.path.join(source_autostart, file)
-                    target_file = os.path.join(target_autostart, file)
-                    
-                    shutil.copy2(source_file, target_file)
-                    self._fix_desktop_file(target_file, target_username)
-                    shutil.chown(target_file, target_username, target_username)
-            
-            shutil.chown(target_autostart, target_username, target_username)
+                results[target_username] = True
+                self.log_operation("sync_desktop_paths", target_username,
+                                 f"增量同步 {len(rel_paths)} 个路径 (源: {source_user})")
+            except Exception as e:
+                results[target_username] = False
+                self.log_operation("sync_desktop_paths", target_username,
+                                 error_message=str(e), success=False)
+        
+        self.sync_manifests.save()
+        return results
+    
+    def get_source_home(self, source_user: str) -> str:
+        """桌面同步源用户的主目录"""
+        return os.path.join(self.config.source_home_base, source_user)
+    
+    @staticmethod
+    def desktop_sync_roots(sync_desktop: bool = True, sync_icons: bool = True,
+                           sync_autostart: bool = True) -> List[str]:
+        """需要同步的目录列表（相对用户主目录）"""
+        roots = []
+        if sync_desktop:
+            roots.extend(DESKTOP_DIRS)
+        if sync_icons:
+            roots.append(ICONS_DIR)
+        if sync_autostart:
+            roots.append(AUTOSTART_DIR)
+        return roots
+    
+    @staticmethod
+    def classify_sync_path(rel_path: str) -> Optional[str]:
+        """判断相对路径属于哪类同步内容: desktop, icons, autostart，不需要同步返回None"""
+        parts = Path(rel_path).parts
+        if len(parts) < 2:
+            return None
+        
+        if parts[0] in DESKTOP_DIRS:
+            return "desktop"
+        if rel_path.startswith(ICONS_DIR + "/"):
+            return "icons"
+        if rel_path.startswith(AUTOSTART_DIR + "/") and len(parts) == 3:
+            return "autostart"
+        return None
+    
+    def _sync_single_path(self, source_home: str, target_home: str,
+                          target_username: str, rel_path: str):
+        """同步单个路径"""
+        category = self.classify_sync_path(rel_path)
+        source_path = os.path.join(source_home, rel_path)
+        target_path = os.path.join(target_home, rel_path)
+        
+        if os.path.isdir(source_path) and not os.path.islink(source_path):
+            # 新目录（创建或移入），递归同步其中的文件
+            for root, dirs, files in os.walk(source_path):
+                for file in files:
+                    sub_rel = os.path.relpath(os.path.join(root, file), source_home)
+                    if self.classify_sync_path(sub_rel):
+                        self._sync_single_path(source_home, target_home, target_username, sub_rel)
+        elif os.path.isfile(source_path):
+            if self._is_synced_file(category, rel_path):
+                fix_paths = category in ("desktop", "autostart") and rel_path.endswith('.desktop')
+                self._copy_sync_file(source_path, target_path, target_username, fix_paths)
+        elif os.path.isdir(target_path) and not os.path.islink(target_path):
+            # 源目录已删除，只清理会被同步的文件，保留目标用户自己的文件
+            for root, dirs, files in os.walk(target_path, topdown=False):
+                for file in files:
+                    if self._is_synced_file(category, file):
+                        os.remove(os.path.join(root, file))
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+        elif os.path.lexists(target_path) and self._is_synced_file(category, rel_path):
+            os.remove(target_path)
+    
+    @staticmethod
+    def _is_synced_file(category: Optional[str], file_name: str) -> bool:
+        """按同步类型判断文件是否需要同步"""
+        if category == "desktop":
+            return file_name.endswith(DESKTOP_FILE_EXTENSIONS)
+        if category == "autostart":
+            return file_name.endswith('.desktop')
+        return category == "icons"
+    
+    def _copy_sync_file(self, source_file: str, target_file: str,
+                        target_username: str, fix_paths: bool = False):
+        """复制单个同步文件并设置所有者"""
+        target_dir = os.path.dirname(target_file)
+        
+        # 逐级创建缺失的目录，新建目录归目标用户所有
+        missing_dirs = []
+        parent = target_dir
+        while parent and not os.path.isdir(parent):
+            missing_dirs.append(parent)
+            parent = os.path.dirname(parent)
+        for dir_path in reversed(missing_dirs):
+            os.makedirs(dir_path, exist_ok=True)
+            shutil.chown(dir_path, target_username, target_username)
+        
+        shutil.copy2(source_file, target_file)
+        
+        # 修复.desktop文件路径
+        if fix_paths:
+            self._fix_desktop_file(target_file, target_username)
+        
+        shutil.chown(target_file, target_username, target_username)
     
     def _fix_desktop_file(self, desktop_file: str, target_username: str):
         """修复desktop文件中的路径"""
@@ -686,6 +1345,29 @@ fi
         except Exception as e:
             self.logger.error(f"修复desktop文件失败 {desktop_file}: {e}")
     
+    def get_user_statistics(self, username: Optional[str] = None) -> List[UserStatistics]:
+        """用户统计: 会话数、活跃时长、最后登录时间（来自客户端连接跟踪）、传输量及错误数"""
+        users = [u for u in self.load_users_data() if username is None or u.username == username]
+        error_counts: Dict[str, int] = {}
+        for log in self.operation_logs:
+            if not log.success and log.username:
+                error_counts[log.username] = error_counts.get(log.username, 0) + 1
+        
+        statistics = []
+        for user in users:
+            stats = self.connections.user_statistics(user.username)
+            statistics.append(UserStatistics(
+                username=user.username,
+                total_sessions=stats["total_sessions"],
+                active_time=round(stats["active_time"], 1),
+                last_login=stats["last_login"],
+                data_transferred=self.throughput.data_transferred(user.username),
+                display_count=len(user.displays),
+                error_count=error_counts.get(user.username, 0)
+            ))
+        return statistics
+    
+    @timed("operation_logs")
     def get_operation_logs(self, limit: int = 100) -> List[OperationLog]:
         """获取操作日志"""
         return self.operation_logs[-limit:] if self.operation_logs else []
\ No newline at end of file
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 预启动显示器池
+作者: Xander Xu
+
+预先为池账号（<warm_pool_prefix>1、2、...，每个账号一个显示器）启动warm_pool_size个
+空闲显示器，用户登录时直接分配一个已运行的显示器并重置其VNC密码，无需等待su、
+XFCE启动和固定的3秒。后台线程持续补足空闲显示器；可用内存低于warm_pool_min_available_memory
+时逐个停止空闲显示器以缩小池。用户释放后显示器停止、池账号主目录清空，再重新启动备用。
+"""
+
+import os
+import json
+import time
+import shutil
+import secrets
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import psutil
+
+from .models import VNCUser, VNCDisplay, ServiceStatus
+
+
+# 保留的分配耗时样本数
+LATENCY_SAMPLES = 200
+
+
+class PoolExhausted(Exception):
+    """没有空闲的预启动显示器"""
+
+
+class WarmPool:
+    """预启动显示器池"""
+
+    def __init__(self, manager, pool_file: str = "warm_pool.json"):
+        self.manager = manager
+        self.logger = manager.logger
+        self.pool_file = pool_file
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 池账号，按序号排列
+        self.accounts: List[VNCUser] = []
+        # 显示器编号 -> {"username": 使用者, "assigned_time": 分配时刻}
+        self.assignments: Dict[int, Dict] = {}
+        # 正在停止（缩小池或释放中）的显示器，不再分配，维护线程也不处理
+        self._stopping = set()
+        self.hits = 0
+        self.misses = 0
+        self.started_count = 0
+        self.shrunk_count = 0
+        self.acquire_latency: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.last_maintain_time: Optional[float] = None
+        self.load()
+
+    def load(self):
+        """从文件加载池账号和分配"""
+        if not os.path.exists(self.pool_file):
+            return
+        with open(self.pool_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.accounts = [VNCUser(**account) for account in data.get("accounts", [])]
+        self.assignments = {int(display_num): entry for display_num, entry in data.get("assignments", {}).items()}
+
+    def save(self):
+        """保存池账号和分配到文件（调用方持有锁）"""
+        data = {
+            "accounts": [account.model_dump() for account in self.accounts],
+            "assignments": {str(display_num): entry for display_num, entry in sorted(self.assignments.items())}
+        }
+        tmp_file = f"{self.pool_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.chmod(tmp_file, 0o600)
+        os.replace(tmp_file, self.pool_file)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动后台补充线程"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="warm-pool", daemon=True)
+        self._thread.start()
+        self.logger.info(
+            f"预启动显示器池已启动: 空闲显示器 {self.manager.config.warm_pool_size} 个, "
+            f"检查间隔 {self.manager.config.warm_pool_refill_interval}s"
+        )
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        self._wake.set()
+        thread.join(timeout=10)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.maintain()
+            except Exception as e:
+                self.logger.error(f"预启动显示器池维护失败: {e}")
+            self._wake.wait(max(self.manager.config.warm_pool_refill_interval, 1))
+            self._wake.clear()
+
+    def memory_pressure(self) -> bool:
+        memory = psutil.virtual_memory()
+        return memory.available / memory.total < self.manager.config.warm_pool_min_available_memory
+
+    def _account_display(self, account: VNCUser) -> VNCDisplay:
+        return account.displays[0]
+
+    def _idle_accounts(self, process_map: Dict[int, psutil.Process]) -> List[VNCUser]:
+        """已运行且未分配的池账号（调用方持有锁）"""
+        return [
+            account for account in self.accounts
+            if self._account_display(account).display_number in process_map
+            and self._account_display(account).display_number not in self.assignments
+            and self._account_display(account).display_number not in self._stopping
+        ]
+
+    def _create_account(self, index: int) -> VNCUser:
+        """创建池账号: 系统用户、VNC密码、证书和启动脚本"""
+        config = self.manager.config
+        username = f"{config.warm_pool_prefix}{index}"
+        password = secrets.token_urlsafe(12)
+        home_dir = os.path.join(config.base_user_home, username)
+        if not self.manager.create_system_user(username, password, home_dir):
+            raise Exception(f"创建池账号 {username} 失败")
+        if not self.manager.setup_vnc_password(username, password, home_dir, force=True):
+            raise Exception(f"设置池账号 {username} 的VNC密码失败")
+
+        cert_file, key_file = None, None
+        if config.warm_pool_https:
+            cert_file, key_file = self.manager.generate_ssl_certificate(username)
+        display_num = config.warm_pool_base_display + index
+        websocket_port = config.warm_pool_base_websocket_port + index
+        self.manager.create_vnc_startup_script(username, display_num, websocket_port, cert_file, key_file)
+        self.manager.create_xstartup_script(username)
+
+        return VNCUser(
+            username=username,
+            password=password,
+            home_directory=home_dir,
+            displays=[VNCDisplay(display_number=display_num, websocket_port=websocket_port,
+                                 status=ServiceStatus.STOPPED,
+                                 log_file=self.manager.display_log_file(username, display_num))],
+            https_enabled=config.warm_pool_https,
+            cert_file=cert_file,
+            key_file=key_file
+        )
+
+    def maintain(self):
+        """补足或缩小空闲显示器，清理进程已退出的分配"""
+        config = self.manager.config
+        process_map = self.manager.get_display_process_map()
+        pressure = self.memory_pressure()
+
+        with self._lock:
+            # 分配出去的显示器进程已退出，视为会话结束；正在释放的由 release 处理
+            lost = [display_num for display_num in self.assignments
+                    if display_num not in process_map and display_num not in self._stopping]
+            for display_num in lost:
+                entry = self.assignments.pop(display_num)
+                self.logger.info(f"池显示器 :{display_num} 已退出，结束 {entry['username']} 的分配")
+            if lost:
+                self.save()
+
+            idle = self._idle_accounts(process_map)
+            to_stop, to_start, to_create = [], [], 0
+            if pressure:
+                # 内存不足时每轮停止一个空闲显示器，直到压力解除
+                to_stop = idle[-1:]
+            elif len(idle) > config.warm_pool_size:
+                to_stop = idle[config.warm_pool_size:]
+            elif len(idle) < config.warm_pool_size:
+                needed = config.warm_pool_size - len(idle)
+                to_start = [
+                    account for account in self.accounts
+                    if self._account_display(account).display_number not in process_map
+                    and self._account_display(account).display_number not in self.assignments
+                    and self._account_display(account).display_number not in self._stopping
+                ][:needed]
+                to_create = min(needed - len(to_start), config.warm_pool_max_accounts - len(self.accounts))
+            self._stopping.update(self._account_display(account).display_number for account in to_stop)
+            self.last_maintain_time = time.time()
+
+        # 会话异常结束的池账号同样清空主目录后再复用
+        for account in self.accounts:
+            if self._account_display(account).display_number in lost:
+                self._reset_home(account)
+
+        # 创建系统用户较慢，在锁外进行；池账号只由本线程创建
+        for _ in range(max(to_create, 0)):
+            account = self._create_account(len(self.accounts) + 1)
+            with self._lock:
+                self.accounts.append(account)
+                self.save()
+            to_start.append(account)
+
+        for account in to_stop:
+            display_num = self._account_display(account).display_number
+            stopped = self.manager.stop_vnc_display(account.username, display_num)
+            with self._lock:
+                self._stopping.discard(display_num)
+                self.shrunk_count += int(stopped)
+            if stopped:
+                self.logger.info(f"池显示器 :{display_num} 已停止（{'内存不足' if pressure else '超出池大小'}）")
+
+        for account in to_start:
+            if self._stop_event.is_set():
+                break
+            display_num = self._account_display(account).display_number
+            if self.manager.start_vnc_display(account.username, display_num):
+                with self._lock:
+                    self.started_count += 1
+
+        if lost or to_stop or to_start:
+            self.manager.bump_state_version()
+
+    def acquire(self, username: str) -> Dict:
+        """为用户分配一个空闲的预启动显示器，重置VNC密码后返回连接信息"""
+        start = time.perf_counter()
+        process_map = self.manager.get_display_process_map()
+        with self._lock:
+            idle = self._idle_accounts(process_map)
+            if not idle:
+                self.misses += 1
+                raise PoolExhausted("没有空闲的预启动显示器")
+            account = idle[0]
+            display = self._account_display(account)
+            self.assignments[display.display_number] = {"username": username, "assigned_time": time.time()}
+
+        # 每次分配更换VNC密码，上一个使用者的密码随之失效
+        password = secrets.token_urlsafe(12)
+        if not self.manager.setup_vnc_password(account.username, password, account.home_directory, force=True):
+            with self._lock:
+                self.assignments.pop(display.display_number, None)
+            raise Exception(f"重置池账号 {account.username} 的VNC密码失败")
+
+        with self._lock:
+            account.password = password
+            self.save()
+            self.hits += 1
+            self.acquire_latency.append(time.perf_counter() - start)
+        self.manager.bump_state_version()
+        # 立即补充空闲显示器
+        self._wake.set()
+        self.manager.log_operation(
+            "pool_acquire", username,
+            f"分配预启动显示器 :{display.display_number} (池账号 {account.username})"
+        )
+        return {
+            "username": username,
+            "pool_account": account.username,
+            "display_number": display.display_number,
+            "websocket_port": display.websocket_port,
+            "vnc_username": account.username,
+            "vnc_password": password,
+            "https_enabled": account.https_enabled,
+            "proxy_path": f"/session/{username}/{display.display_number}/",
+            "latency_ms": round((time.perf_counter() - start) * 1000, 3)
+        }
+
+    def release(self, display_num: int) -> bool:
+        """结束分配: 停止显示器并清空池账号主目录，随后由后台线程重新启动备用"""
+        with self._lock:
+            entry = self.assignments.get(display_num)
+            account = next((a for a in self.accounts
+                            if self._account_display(a).display_number == display_num), None)
+            if entry is None or account is None or display_num in self._stopping:
+                return False
+            # 释放完成前维护线程不把它当作已退出的分配处理，也不重新启动
+            self._stopping.add(display_num)
+
+        try:
+            self.manager.stop_vnc_display(account.username, display_num)
+            self._reset_home(account)
+        finally:
+            with self._lock:
+                self.assignments.pop(display_num, None)
+                self._stopping.discard(display_num)
+                self.save()
+        self.manager.bump_state_version()
+        self._wake.set()
+        self.manager.log_operation(
+            "pool_release", entry["username"],
+            f"释放预启动显示器 :{display_num} (池账号 {account.username})"
+        )
+        return True
+
+    def release_user(self, username: str) -> int:
+        """释放用户的全部池显示器，返回释放数"""
+        with self._lock:
+            display_nums = [num for num, entry in self.assignments.items() if entry["username"] == username]
+        return sum(1 for display_num in display_nums if self.release(display_num))
+
+    def _reset_home(self, account: VNCUser):
+        """清空池账号主目录（保留.vnc），避免上一个使用者的文件留给下一个"""
+        home_dir = account.home_directory
+        try:
+            entries = os.listdir(home_dir)
+        except OSError:
+            return
+        for entry in entries:
+            if entry == ".vnc":
+                continue
+            path = os.path.join(home_dir, entry)
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                self.logger.warning(f"清理池账号主目录失败 {path}: {e}")
+
+    def find_account(self, username: str) -> Optional[VNCUser]:
+        """查找池账号"""
+        with self._lock:
+            return next((account for account in self.accounts if account.username == username), None)
+
+    def routes(self) -> List[Tuple[str, VNCDisplay, bool]]:
+        """已分配的显示器: (使用者, 显示器, 是否HTTPS)，供反向代理按使用者路由"""
+        with self._lock:
+            routes = []
+            for account in self.accounts:
+                display = self._account_display(account)
+                entry = self.assignments.get(display.display_number)
+                if entry is not None:
+                    routes.append((entry["username"], display, account.https_enabled))
+            return routes
+
+    def status(self) -> Dict:
+        """池状态及各池账号显示器的状态"""
+        config = self.manager.config
+        process_map = self.manager.get_display_process_map()
+        with self._lock:
+            accounts = []
+            for account in self.accounts:
+                display = self._account_display(account)
+                entry = self.assignments.get(display.display_number)
+                if entry is not None:
+                    state = "assigned"
+                elif display.display_number in process_map:
+                    state = "idle"
+                else:
+                    state = "stopped"
+                accounts.append({
+                    "pool_account": account.username,
+                    "display_number": display.display_number,
+                    "websocket_port": display.websocket_port,
+                    "state": state,
+                    "assigned_to": entry["username"] if entry else None,
+                    "assigned_time": entry["assigned_time"] if entry else None
+                })
+            latency = sorted(self.acquire_latency)
+            return {
+                "running": self.is_running(),
+                "size": config.warm_pool_size,
+                "max_accounts": config.warm_pool_max_accounts,
+                "idle": sum(1 for account in accounts if account["state"] == "idle"),
+                "assigned": len(self.assignments),
+                "memory_pressure": self.memory_pressure(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "started_count": self.started_count,
+                "shrunk_count": self.shrunk_count,
+                "acquire_p50_ms": round(latency[len(latency) // 2] * 1000, 3) if latency else None,
+                "acquire_max_ms": round(latency[-1] * 1000, 3) if latency else None,
+                "last_maintain_time": self.last_maintain_time,
+                "accounts": accounts
+            }
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 统一入口反向代理
+作者: Xander Xu
+
+所有显示器通过一个端口访问: /session/<用户名>/<显示器编号>/ 转发到对应显示器的
+websocket端口（含其网页客户端和websocket升级请求）。
+- TLS在代理处终止一次，开启会话票据以支持会话恢复
+- 每个路由预先建立少量后端连接（含后端TLS握手），新连接到达时直接取用
+- 每个路由限制并发websocket连接数，超出返回503；网页客户端的静态资源请求不受限制
+- 只改写每个连接的第一个请求的路径；非websocket升级的请求和响应都改为 Connection: close，
+  响应转发完即关闭连接，浏览器的下一个请求走新连接并重新路由
+"""
+
+import ssl
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from .activation import pipe_stream
+
+# 请求头最大长度
+MAX_HEADER_SIZE = 16 * 1024
+
+# 预建后端连接的最长空闲时间（秒），超过后丢弃重建
+POOL_MAX_IDLE = 15.0
+
+# 最近有访问的路由才维护连接池（秒）
+POOL_ACTIVE_WINDOW = 600.0
+
+# 连接池维护间隔（秒）
+POOL_MAINTAIN_INTERVAL = 5.0
+
+ROUTE_PREFIX = "/session/"
+
+
+class Route:
+    """单个显示器的路由状态"""
+
+    def __init__(self, username: str, display_number: int, backend_port: int, backend_tls: bool):
+        self.username = username
+        self.display_number = display_number
+        self.backend_port = backend_port
+        self.backend_tls = backend_tls
+        self.pool: Deque[Tuple[asyncio.StreamReader, asyncio.StreamWriter, float]] = deque()
+        self.active = 0
+        # 进行中的websocket连接数，受 proxy_max_connections_per_route 限制
+        self.websockets = 0
+        self.total = 0
+        self.rejected = 0
+        self.pool_hits = 0
+        self.last_used: float = 0.0
+        self.refilling = False
+
+    def status(self) -> Dict:
+        return {
+            "username": self.username,
+            "display_number": self.display_number,
+            "backend_port": self.backend_port,
+            "backend_tls": self.backend_tls,
+            "active": self.active,
+            "websockets": self.websockets,
+            "total": self.total,
+            "rejected": self.rejected,
+            "pool_size": len(self.pool),
+            "pool_hits": self.pool_hits,
+            "last_used": self.last_used or None
+        }
+
+
+def _http_response(status: str, body: str = "", headers: Dict[str, str] = None) -> bytes:
+    payload = body.encode("utf-8")
+    lines = [f"HTTP/1.1 {status}", "Content-Type: text/plain; charset=utf-8",
+             f"Content-Length: {len(payload)}", "Connection: close"]
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload
+
+
+def _is_upgrade(header_block: str) -> bool:
+    """请求头是否为协议升级（websocket）"""
+    upgrade = False
+    connection_tokens = set()
+    for line in header_block.split("\r\n"):
+        name, sep, value = line.partition(":")
+        if not sep:
+            continue
+        name = name.strip().lower()
+        if name == "upgrade":
+            upgrade = True
+        elif name == "connection":
+            connection_tokens.update(token.strip().lower() for token in value.split(","))
+    return upgrade and "upgrade" in connection_tokens
+
+
+def _connection_close(header_block: str) -> str:
+    """去掉keep-alive相关头并加上 Connection: close"""
+    kept = [line for line in header_block.split("\r\n")
+            if line and line.partition(":")[0].strip().lower() not in ("connection", "keep-alive")]
+    return "\r\n".join(kept + ["Connection: close", "", ""])
+
+
+class SessionProxy:
+    """单端口反向代理"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.logger = manager.logger
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._maintain_task: Optional[asyncio.Task] = None
+        self._routes_version: Optional[int] = None
+        self.routes: Dict[Tuple[str, int], Route] = {}
+        self.tls_enabled = False
+        self.tls_handshakes = 0
+        self.tls_resumed = 0
+        self.not_found = 0
+        self.started_time: Optional[float] = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """在后台线程中启动代理"""
+        if self.is_running():
+            return
+        server_ssl = self._server_ssl_context()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="session-proxy", daemon=True)
+        self._thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self._serve(server_ssl), self._loop).result(timeout=30)
+        except Exception:
+            self._shutdown_loop()
+            raise
+        self.started_time = time.time()
+        self.manager.log_operation(
+            "proxy_start",
+            details=f"反向代理已启动: 端口 {self.manager.config.proxy_port}, TLS {'开启' if server_ssl else '关闭'}"
+        )
+
+    def stop(self):
+        if not self.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(timeout=30)
+        self._shutdown_loop()
+        self.manager.log_operation("proxy_stop", details="反向代理已停止")
+
+    def _shutdown_loop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+        self._loop.close()
+        self._thread = None
+        self._loop = None
+
+    def pooled_connections(self) -> Dict[int, int]:
+        """显示器编号 -> 预建的空闲后端连接数（尚未分配给客户端）"""
+        return {route.display_number: len(route.pool) for route in list(self.routes.values()) if route.pool}
+
+    def status(self) -> Dict:
+        config = self.manager.config
+        routes = [route.status() for route in list(self.routes.values()) if route.total or route.pool]
+        return {
+            "running": self.is_running(),
+            "port": config.proxy_port,
+            "tls_enabled": self.tls_enabled,
+            "tls_handshakes": self.tls_handshakes,
+            "tls_resumed": self.tls_resumed,
+            "max_connections_per_route": config.proxy_max_connections_per_route,
+            "pool_size": config.proxy_pool_size,
+            "not_found": self.not_found,
+            "route_count": len(self.routes),
+            "routes": routes,
+            "started_time": self.started_time
+        }
+
+    def _server_ssl_context(self) -> Optional[ssl.SSLContext]:
+        """代理TLS配置，未指定证书时使用管理器生成的自签名证书"""
+        config = self.manager.config
+        self.tls_enabled = config.proxy_https
+        if not config.proxy_https:
+            return None
+        cert_file, key_file = config.proxy_cert_file, config.proxy_key_file
+        if not cert_file or not key_file:
+            cert_file, key_file = self.manager.generate_ssl_certificate("session-proxy")
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        context.load_cert_chain(cert_file, key_file)
+        # 会话票据（TLS 1.2/1.3会话恢复），重连时免去完整握手
+        context.options &= ~ssl.OP_NO_TICKET
+        return context
+
+    @staticmethod
+    def _backend_ssl_context() -> ssl.SSLContext:
+        # 后端为本机显示器的自签名证书
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+
+    # ------------------------------------------------------------------
+    # 以下方法在代理线程的事件循环中执行
+    # ------------------------------------------------------------------
+
+    async def _serve(self, server_ssl: Optional[ssl.SSLContext]):
+        self._backend_ssl = self._backend_ssl_context()
+        self._server = await asyncio.start_server(
+            self._handle_client, host="0.0.0.0", port=self.manager.config.proxy_port, ssl=server_ssl
+        )
+        self._maintain_task = asyncio.ensure_future(self._maintain_pools())
+
+    async def _close(self):
+        if self._maintain_task:
+            self._maintain_task.cancel()
+            self._maintain_task = None
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for route in self.routes.values():
+            self._drain_pool(route)
+        # 结束仍在转发的连接，事件循环关闭前完成清理
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _refresh_routes(self):
+        """用户数据变化后重建路由表，保留已有路由的统计和连接池"""
+        version = self.manager.state_version
+        if version == self._routes_version:
+            return
+        # 用户自己的显示器，以及分配给用户的预启动池显示器
+        targets = [(user.username, display, user.https_enabled)
+                   for user in self.manager.load_users_data() for display in user.displays]
+        targets += self.manager.warm_pool.routes()
+        routes = {}
+        for username, display, https_enabled in targets:
+            key = (username, display.display_number)
+            backend_port = self.manager.display_backend_port(display.websocket_port)
+            route = self.routes.get(key)
+            if (route is None or route.backend_port != backend_port
+                    or route.backend_tls != https_enabled):
+                if route is not None:
+                    self._drain_pool(route)
+                route = Route(username, display.display_number, backend_port, https_enabled)
+            routes[key] = route
+        for key in set(self.routes) - set(routes):
+            self._drain_pool(self.routes[key])
+        self.routes = routes
+        self._routes_version = version
+
+    @staticmethod
+    def _parse_route(target: str) -> Optional[Tuple[str, int, str]]:
+        """解析 /session/<用户名>/<显示器>/<路径>，返回 (用户名, 显示器, 转发路径)"""
+        if not target.startswith(ROUTE_PREFIX):
+            return None
+        parts = target[len(ROUTE_PREFIX):].split("/", 2)
+        if len(parts) < 2 or not parts[0]:
+            return None
+        display = parts[1].split("?", 1)[0]
+        if not display.isdigit():
+            return None
+        if len(parts) == 3:
+            rest = "/" + parts[2]
+        else:
+            # 没有结尾斜杠，交由调用方重定向
+            rest = ""
+        return parts[0], int(display), rest
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        ssl_object = writer.get_extra_info("ssl_object")
+        if ssl_object is not None:
+            self.tls_handshakes += 1
+            if ssl_object.session_reused:
+                self.tls_resumed += 1
+
+        route = None
+        backend_writer = None
+        try:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            if len(head) > MAX_HEADER_SIZE:
+                writer.write(_http_response("431 Request Header Fields Too Large"))
+                return
+
+            request_line, _, header_block = head.decode("latin-1").partition("\r\n")
+            try:
+                method, target, version = request_line.split(" ", 2)
+            except ValueError:
+                writer.write(_http_response("400 Bad Request"))
+                return
+
+            parsed = self._parse_route(target)
+            self._refresh_routes()
+            route = self.routes.get(parsed[:2]) if parsed else None
+            if route is None:
+                self.not_found += 1
+                writer.write(_http_response("404 Not Found", "未知会话"))
+                return
+            if not parsed[2]:
+                location = f"{ROUTE_PREFIX}{parsed[0]}/{parsed[1]}/"
+                writer.write(_http_response("301 Moved Permanently", headers={"Location": location}))
+                return
+
+            # 每个非升级请求占用一个短连接，浏览器并行加载静态资源，只限制websocket
+            upgrade = _is_upgrade(header_block)
+            if upgrade and route.websockets >= self.manager.config.proxy_max_connections_per_route:
+                route.rejected += 1
+                writer.write(_http_response("503 Service Unavailable", "会话连接数已达上限",
+                                            headers={"Retry-After": "5"}))
+                return
+
+            route.active += 1
+            route.websockets += int(upgrade)
+            route.total += 1
+            route.last_used = time.time()
+            try:
+                backend_reader, backend_writer = await self._checkout(route)
+                peer = writer.get_extra_info("peername")
+                forwarded = f"X-Forwarded-For: {peer[0]}\r\n" if peer else ""
+                backend_writer.write(
+                    f"{method} {parsed[2]} {version}\r\n{forwarded}".encode("latin-1") +
+                    (header_block if upgrade else _connection_close(header_block)).encode("latin-1")
+                )
+                if upgrade:
+                    await asyncio.gather(
+                        pipe_stream(reader, backend_writer),
+                        pipe_stream(backend_reader, writer)
+                    )
+                else:
+                    # 同一连接上的后续请求路径未改写，只转发这一个请求和响应
+                    request_task = asyncio.ensure_future(pipe_stream(reader, backend_writer))
+                    try:
+                        await self._relay_response(backend_reader, writer)
+                    finally:
+                        request_task.cancel()
+            finally:
+                route.active -= 1
+                route.websockets -= int(upgrade)
+        except OSError as e:
+            if route is not None:
+                self.logger.warning(f"代理 {route.username}:{route.display_number} 转发失败: {e}")
+                if backend_writer is None:
+                    writer.write(_http_response("502 Bad Gateway", "显示器未运行或无法连接"))
+        except asyncio.CancelledError:
+            # 代理停止
+            pass
+        finally:
+            try:
+                await writer.drain()
+            except OSError:
+                pass
+            writer.close()
+            if backend_writer is not None:
+                backend_writer.close()
+
+    async def _relay_response(self, backend_reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """转发非升级请求的响应，响应头改为 Connection: close"""
+        try:
+            head = await backend_reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.write(_http_response("502 Bad Gateway", "显示器返回了无效的响应"))
+            return
+        status_line, _, header_block = head.decode("latin-1").partition("\r\n")
+        writer.write(f"{status_line}\r\n{_connection_close(header_block)}".encode("latin-1"))
+        await pipe_stream(backend_reader, writer)
+
+    async def _connect_backend(self, route: Route):
+        return await asyncio.open_connection(
+            "127.0.0.1", route.backend_port,
+            ssl=self._backend_ssl if route.backend_tls else None
+        )
+
+    async def _checkout(self, route: Route):
+        """优先取用预建的后端连接，取用后异步补充"""
+        now = time.time()
+        connection = None
+        while route.pool:
+            reader, writer, created = route.pool.popleft()
+            if now - created < POOL_MAX_IDLE and not reader.at_eof() and not writer.is_closing():
+                connection = (reader, writer)
+                route.pool_hits += 1
+                break
+            writer.close()
+        if connection is None:
+            connection = await self._connect_backend(route)
+        asyncio.ensure_future(self._refill(route))
+        return connection
+
+    async def _refill(self, route: Route):
+        if route.refilling:
+            return
+        route.refilling = True
+        try:
+            while len(route.pool) < self.manager.config.proxy_pool_size:
+                reader, writer = await self._connect_backend(route)
+                route.pool.append((reader, writer, time.time()))
+        except OSError:
+            # 显示器未运行，下次访问时再建立
+            pass
+        finally:
+            route.refilling = False
+
+    def _drain_pool(self, route: Route):
+        while route.pool:
+            route.pool.popleft()[1].close()
+
+    async def _maintain_pools(self):
+        """丢弃过期的预建连接，为最近有访问的路由补充连接池"""
+        while True:
+            await asyncio.sleep(POOL_MAINTAIN_INTERVAL)
+            now = time.time()
+            for route in list(self.routes.values()):
+                while route.pool and now - route.pool[0][2] >= POOL_MAX_IDLE:
+                    route.pool.popleft()[1].close()
+                if now - route.last_used < POOL_ACTIVE_WINDOW:
+                    asyncio.ensure_future(self._refill(route))
+                else:
+                    self._drain_pool(route)
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KasmVNC多用户管理系统 - 性能基准测试
+作者: Xander Xu
+
+可在普通Linux主机上运行：fake_bin 下的桩程序（kasmvncserver、kasmvncpasswd、
+useradd、openssl 等）放在PATH最前面，用户主目录、证书、日志都放在临时目录，
+模拟10-5000个用户，测量 /api/users、/api/status、批量控制、create_users、
+sync_desktop 的延迟和吞吐量，结果保存为JSON，便于在不同提交之间比较。
+
+桩用户不存在于 /etc/passwd，因此测试期间 shutil.chown 被替换为空操作，
+监管器查询用户时未知用户视为当前用户（不切换身份）。
+
+用法:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 10,100,1000 --output result.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/old.json
+"""
+
+import os
+import pwd
+import sys
+import json
+import time
+import shutil
+import getpass
+import socket
+import logging
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+import http.client
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+APP_DIR = BENCH_DIR.parent
+FAKE_BIN = BENCH_DIR / "fake_bin"
+RESULTS_DIR = BENCH_DIR / "results"
+
+sys.path.insert(0, str(APP_DIR))
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """延迟统计（毫秒）"""
+    ordered = sorted(samples)
+    count = len(ordered)
+
+    def percentile(p):
+        return ordered[min(count - 1, int(round(p / 100 * (count - 1))))]
+
+    total = sum(ordered)
+    return {
+        "count": count,
+        "mean_ms": round(total / count * 1000, 3),
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(percentile(95) * 1000, 3),
+        "p99_ms": round(percentile(99) * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "throughput_per_s": round(count / total, 2) if total > 0 else None
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(APP_DIR),
+                                capture_output=True, text=True)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class BenchClient:
+    """基于http.client的保持连接客户端"""
+
+    def __init__(self, port: int):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+
+    def request(self, method: str, path: str, body: Optional[dict] = None,
+                headers: Optional[Dict[str, str]] = None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        start = time.perf_counter()
+        self.conn.request(method, path, body=payload, headers=headers)
+        response = self.conn.getresponse()
+        data = response.read()
+        elapsed = time.perf_counter() - start
+        return response.status, response.getheaders(), data, elapsed
+
+
+class BenchmarkRunner:
+    """基准测试执行器"""
+
+    def __init__(self, args):
+        self.args = args
+        self.results: List[Dict] = []
+        self.fake_servers: List[subprocess.Popen] = []
+        self.work_dir = Path(tempfile.mkdtemp(prefix="kasmvnc-bench-"))
+
+    # ------------------------------------------------------------------
+    # 环境准备
+    # ------------------------------------------------------------------
+
+    def setup(self):
+        """准备桩程序、临时目录和服务"""
+        os.environ["PATH"] = f"{FAKE_BIN}{os.pathsep}{os.environ.get('PATH', '')}"
+        os.chdir(self.work_dir)
+
+        from app.startup_profile import FAST_START_ENV
+        os.environ[FAST_START_ENV] = "1"
+
+        # 桩用户不存在于系统中，跳过所有者设置；监管器切换身份时视为当前用户
+        shutil.chown = lambda *args, **kwargs: None
+        pwd.getpwnam = lambda name, _getpwnam=pwd.getpwnam: _getpwnam(getpass.getuser())
+
+        import app.main as main_module
+        from app.models import ConfigSettings
+
+        main_module.config = ConfigSettings(
+            base_user_home=str(self.work_dir / "home"),
+            cert_dir=str(self.work_dir / "certs"),
+            log_dir=str(self.work_dir / "logs"),
+            source_home_base=str(self.work_dir / "source"),
+            response_cache_ttl=0,
+            volatile_cache_ttl=0
+        )
+        self.main = main_module
+        self.manager = main_module.get_vnc_manager()
+        logging.getLogger().setLevel(logging.WARNING)
+
+        import uvicorn
+        self.port = free_port()
+        self.server = uvicorn.Server(uvicorn.Config(
+            main_module.app, host="127.0.0.1", port=self.port,
+            log_level="warning", access_log=False
+        ))
+        self.server_thread = threading.Thread(target=self.server.run, daemon=True)
+        self.server_thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        self.client = BenchClient(self.port)
+
+    def teardown(self):
+        """停止服务并清理桩进程和临时目录"""
+        self.stop_fake_servers()
+        self.server.should_exit = True
+        self.server_thread.join(timeout=10)
+        self._kill_leftover_stubs()
+        os.chdir(str(APP_DIR))
+        if not self.args.keep_temp:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _kill_leftover_stubs(self):
+        """清理由启动脚本拉起、未被停止的桩进程"""
+        import psutil
+        for proc in psutil.process_iter(["cmdline"]):
+            try:
+                if any(str(FAKE_BIN) in arg for arg in proc.info["cmdline"] or []):
+                    proc.kill()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+    # ------------------------------------------------------------------
+    # 数据生成
+    # ------------------------------------------------------------------
+
+    def write_users(self, count: int):
+        """生成模拟用户数据（每用户两个显示器，显示器号和端口互不重复）"""
+        from app.models import VNCUser, VNCDisplay, ServiceStatus
+
+        home = self.work_dir / "home"
+        users = [
+            VNCUser(
+                username=f"user{i}",
+                password=f"zxt{i}000",
+                home_directory=str(home / f"user{i}"),
+                displays=[
+                    VNCDisplay(
+                        display_number=10000 + i * 2 + j,
+                        websocket_port=20000 + i * 2 + j,
+                        status=ServiceStatus.STOPPED
+                    )
+                    for j in range(2)
+                ],
+                https_enabled=i % 2 == 0
+            )
+            for i in range(1, count + 1)
+        ]
+        self.manager.save_users_data(users)
+        return users
+
+    def start_fake_servers(self, users):
+        """按比例为部分显示器启动桩服务，使进程扫描开销接近真实情况"""
+        displays = [d.display_number for u in users for d in u.displays]
+        running = min(int(len(displays) * self.args.running_fraction), self.args.max_running)
+        step = max(1, len(displays) // running) if running else 0
+        for display_num in displays[::step][:running] if running else []:
+            self.fake_servers.append(subprocess.Popen(
+                [str(FAKE_BIN / "kasmvncserver"), f":{display_num}", "-fg"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            ))
+        return running
+
+    def stop_fake_servers(self):
+        for proc in self.fake_servers:
+            proc.terminate()
+        for proc in self.fake_servers:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self.fake_servers = []
+
+    def write_source_desktop(self, file_count: int) -> str:
+        """生成同步源用户的桌面、图标、自启动文件"""
+        source_user = "benchsrc"
+        source_home = self.work_dir / "source" / source_user
+        shutil.rmtree(source_home, ignore_errors=True)
+        desktop = source_home / "Desktop"
+        icons = source_home / ".local/share/icons/hicolor/48x48/apps"
+        autostart = source_home / ".config/autostart"
+        for path in (desktop, icons, autostart):
+            path.mkdir(parents=True, exist_ok=True)
+
+        for i in range(file_count):
+            if i % 3 == 0:
+                (desktop / f"app{i}.desktop").write_text(
+                    f"[Desktop Entry]\nName=App {i}\nExec=/home/tang/bin/app{i}\n", encoding="utf-8")
+            elif i % 3 == 1:
+                (icons / f"app{i}.png").write_bytes(os.urandom(8 * 1024))
+            else:
+                (autostart / f"auto{i}.desktop").write_text(
+                    f"[Desktop Entry]\nName=Auto {i}\nExec=/home/tang/bin/auto{i}\n", encoding="utf-8")
+        return source_user
+
+    # ------------------------------------------------------------------
+    # 测试项
+    # ------------------------------------------------------------------
+
+    def record(self, name: str, users: int, samples: List[float], **extra):
+        result = {"benchmark": name, "users": users, **summarize(samples), **extra}
+        self.results.append(result)
+        print(f"  {name:<28} users={users:<5} p50={result['p50_ms']:>10.3f} ms  "
+              f"p95={result['p95_ms']:>10.3f} ms  {result['throughput_per_s']} /s")
+
+    def timed_requests(self, method: str, path: str, iterations: int,
+                       headers: Dict[str, str] = None, expect=(200,)) -> List[float]:
+        samples = []
+        for _ in range(iterations):
+            status, _, data, elapsed = self.client.request(method, path, headers=headers)
+            if status not in expect:
+                raise RuntimeError(f"{method} {path} 返回 {status}: {data[:200]!r}")
+            samples.append(elapsed)
+        return samples
+
+    def bench_read_endpoints(self, size: int):
+        """只读接口: 无缓存、缓存命中、条件请求、分页投影"""
+        users = self.write_users(size)
+        running = self.start_fake_servers(users)
+        iterations = self.args.iterations
+        config = self.manager.config
+        try:
+            config.response_cache_ttl = 0
+            config.volatile_cache_ttl = 0
+            self.record("api_users", size, self.timed_requests("GET", "/api/users", iterations),
+                        running_displays=running)
+            self.record("api_users_page_projection", size,
+                        self.timed_requests("GET", "/api/users?limit=50&fields=username,https_enabled",
+                                            iterations))
+            self.record("api_status", size, self.timed_requests("GET", "/api/status", iterations),
+                        running_displays=running)
+
+            config.response_cache_ttl = 3600
+            _, headers, _, _ = self.client.request("GET", "/api/users")
+            etag = dict(headers).get("etag")
+            self.record("api_users_cached", size, self.timed_requests("GET", "/api/users", iterations))
+            self.record("api_users_not_modified", size,
+                        self.timed_requests("GET", "/api/users", iterations,
+                                            headers={"If-None-Match": etag}, expect=(304,)))
+        finally:
+            config.response_cache_ttl = 0
+            self.stop_fake_servers()
+
+    def bench_create_users(self, size: int, record: bool = True):
+        """批量创建用户（桩useradd/openssl/kasmvncpasswd）"""
+        from app.models import CreateUserRequest
+
+        shutil.rmtree(self.work_dir / "home", ignore_errors=True)
+        # 跳过请求模型的数量上限校验，以测量更大规模
+        request = CreateUserRequest.model_construct(
+            user_count=size, enable_https=True, base_display=1010,
+            base_port=15901, base_websocket_port=4000
+        )
+        start = time.perf_counter()
+        users = self.manager.create_users(request)
+        elapsed = time.perf_counter() - start
+        if not record:
+            return
+        self.record("create_users", size, [elapsed], created=len(users),
+                    per_user_ms=round(elapsed / max(len(users), 1) * 1000, 3))
+
+    def bench_batch_control(self, size: int):
+        """批量启动、停止（真实走启动脚本和桩kasmvncserver）"""
+        self.bench_create_users(size, record=False)
+        for action in ("start", "stop"):
+            status, _, data, elapsed = self.client.request(
+                "POST", f"/api/services/batch-control?action={action}")
+            if status != 200:
+                raise RuntimeError(f"batch-control {action} 返回 {status}: {data[:200]!r}")
+            message = json.loads(data).get("message")
+            self.record(f"batch_control_{action}", size, [elapsed], message=message)
+
+    def bench_sync_desktop(self, size: int):
+        """桌面同步: 首次全量、无变更重复同步、模拟运行计划"""
+        self.write_users(size)
+        source_user = self.write_source_desktop(self.args.sync_files)
+        for user in range(1, size + 1):
+            (self.work_dir / "home" / f"user{user}").mkdir(parents=True, exist_ok=True)
+        self.manager.sync_manifests.sources = {}
+
+        start = time.perf_counter()
+        self.manager.sync_desktop(source_user, [])
+        self.record("sync_desktop_full", size, [time.perf_counter() - start],
+                    files=self.args.sync_files)
+
+        start = time.perf_counter()
+        self.manager.sync_desktop(source_user, [])
+        self.record("sync_desktop_unchanged", size, [time.perf_counter() - start],
+                    files=self.args.sync_files)
+
+        samples = self.timed_requests_post_sync(source_user)
+        self.record("sync_desktop_plan", size, samples, files=self.args.sync_files)
+
+    def timed_requests_post_sync(self, source_user: str) -> List[float]:
+        samples = []
+        for _ in range(max(1, self.args.iterations // 4)):
+            status, _, data, elapsed = self.client.request(
+                "POST", "/api/desktop/sync", body={"source_user": source_user, "dry_run": True})
+            if status != 200:
+                raise RuntimeError(f"desktop sync plan 返回 {status}: {data[:200]!r}")
+            samples.append(elapsed)
+        return samples
+
+    def run(self):
+        self.setup()
+        try:
+            print(f"📂 临时目录: {self.work_dir}")
+            for size in self.args.sizes:
+                print(f"\n▶ 只读接口 ({size} 用户)")
+                self.bench_read_endpoints(size)
+            for size in self.args.sync_sizes:
+                print(f"\n▶ 桌面同步 ({size} 目标用户)")
+                self.bench_sync_desktop(size)
+            for size in self.args.create_sizes:
+                print(f"\n▶ 创建用户 ({size} 用户)")
+                self.bench_create_users(size)
+            for size in self.args.control_sizes:
+                print(f"\n▶ 批量控制 ({size} 用户)")
+                self.bench_batch_control(size)
+        finally:
+            self.teardown()
+
+        return {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "args": {k: v for k, v in vars(self.args).items() if k not in ("output", "compare")}
+            },
+            "results": self.results
+        }
+
+
+def compare_results(old: Dict, new: Dict):
+    """按测试项和用户数对比p50延迟"""
+    old_map = {(r["benchmark"], r["users"]): r for r in old.get("results", [])}
+    print(f"\n📊 对比 {old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    print(f"{'测试项':<28} {'用户数':>6} {'旧p50(ms)':>12} {'新p50(ms)':>12} {'变化':>9}")
+    for result in new["results"]:
+        previous = old_map.get((result["benchmark"], result["users"]))
+        if not previous:
+            continue
+        change = (result["p50_ms"] - previous["p50_ms"]) / previous["p50_ms"] * 100 \
+            if previous["p50_ms"] else 0.0
+        print(f"{result['benchmark']:<28} {result['users']:>6} {previous['p50_ms']:>12.3f} "
+              f"{result['p50_ms']:>12.3f} {change:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KasmVNC多用户管理系统性能基准测试')
+    parser.add_argument('--sizes', type=parse_sizes, default=[10, 100, 1000, 5000],
+                        help='只读接口测试的用户数 (默认: 10,100,1000,5000)')
+    parser.add_argument('--iterations', type=int, default=20, help='每项请求次数 (默认: 20)')
+    parser.add_argument('--sync-sizes', type=parse_sizes, default=[10, 100],
+                        help='桌面同步测试的目标用户数 (默认: 10,100)')
+    parser.add_argument('--sync-files', type=int, default=300, help='同步源文件数 (默认: 300)')
+    parser.add_argument('--create-sizes', type=parse_sizes, default=[10, 50],
+                        help='create_users测试的用户数 (默认: 10,50)')
+    parser.add_argument('--control-sizes', type=parse_sizes, default=[2],
+                        help='批量启停测试的用户数，每个显示器启动需等待约3秒 (默认: 2)')
+    parser.add_argument('--running-fraction', type=float, default=0.1,
+                        help='只读接口测试时处于运行状态的显示器比例 (默认: 0.1)')
+    parser.add_argument('--max-running', type=int, default=200,
+                        help='同时运行的桩服务进程上限 (默认: 200)')
+    parser.add_argument('--output', help='结果JSON路径 (默认: benchmarks/results/<时间>_<提交>.json)')
+    parser.add_argument('--compare', help='与之前的结果JSON对比')
+    parser.add_argument('--keep-temp', action='store_true', help='保留临时目录')
+    args = parser.parse_args()
+
+    result = BenchmarkRunner(args).run()
+
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        time.strftime('%Y%m%d-%H%M%S') + f"_{result['meta']['commit'] or 'unknown'}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 结果已保存: {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_results(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ KasmVNC多用户管理系统 - Nuitka打包脚本
 """
 
 import os
+import re
 import sys
 import shutil
 import subprocess
@@ -80,8 +81,20 @@ def download_bootstrap_resources():
         print("✅ CSS路径修复完成")
 
 
-def build_with_nuitka():
-    """使用Nuitka打包应用"""
+def read_app_version():
+    """读取应用版本号"""
+    content = Path('app/main.py').read_text(encoding='utf-8')
+    match = re.search(r'^VERSION = "([^"]+)"', content, re.MULTILINE)
+    return match.group(1) if match else "dev"
+
+
+def build_with_nuitka(onedir=False, cached_unpack=True):
+    """
+    使用Nuitka打包应用
+    
+    - onedir: 生成目录形式，启动时无需解压
+    - cached_unpack: 单文件模式下解压到固定缓存目录，仅首次运行时解压
+    """
     print("🔨 开始Nuitka打包...")
     
     # 检查Nuitka是否安装
@@ -95,7 +108,14 @@ def build_with_nuitka():
     build_cmd = [
         'nuitka',
         '--standalone',
-        '--onefile',
+    ]
+    if not onedir:
+        build_cmd.append('--onefile')
+        if cached_unpack:
+            build_cmd.append(
+                f'--onefile-tempdir-spec={{CACHE_DIR}}/kasmvnc-manager/{read_app_version()}'
+            )
+    build_cmd += [
         '--enable-plugin=multiprocessing',
         '--include-data-dir=static=static',
         '--include-data-dir=templates=templates',
@@ -116,7 +136,10 @@ def build_with_nuitka():
         # 执行打包
         result = subprocess.run(build_cmd, check=True, capture_output=True, text=True)
         print("✅ Nuitka打包成功！")
-        print(f"📦 输出文件: dist/kasmvnc-manager")
+        if onedir:
+            print(f"📦 输出目录: dist/run.dist (可执行文件 kasmvnc-manager)")
+        else:
+            print(f"📦 输出文件: dist/kasmvnc-manager")
         return True
     except subprocess.CalledProcessError as e:
         print(f"❌ Nuitka打包失败:")
@@ -125,8 +148,12 @@ def build_with_nuitka():
         return False
 
 
-def build_with_pyinstaller():
-    """使用PyInstaller打包应用（备选方案）"""
+def build_with_pyinstaller(onedir=False):
+    """
+    使用PyInstaller打包应用（备选方案）
+    
+    - onedir: 生成目录形式，启动时无需解压到临时目录
+    """
     print("🔨 开始PyInstaller打包...")
     
     # 检查PyInstaller是否安装
@@ -174,14 +201,9 @@ a = Analysis(
 )
 
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
-
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.zipfiles,
-    a.datas,
-    [],
+'''
+    
+    exe_options = '''
     name='kasmvnc-manager',
     debug=False,
     bootloader_ignore_signals=False,
@@ -194,7 +216,37 @@ exe = EXE(
     target_arch=None,
     codesign_identity=None,
     entitlements_file=None,
+'''
+    
+    if onedir:
+        # 目录模式: 依赖文件放在可执行文件旁，启动时无需解压
+        spec_content += f'''
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,{exe_options})
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='kasmvnc-manager',
 )
+'''
+    else:
+        spec_content += f'''
+exe = EXE(
+    pyz,
+    a.scripts,
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    [],{exe_options})
 '''
     
     with open('kasmvnc-manager.spec', 'w', encoding='utf-8') as f:
@@ -207,7 +259,10 @@ exe = EXE(
     try:
         result = subprocess.run(build_cmd, check=True, capture_output=True, text=True)
         print("✅ PyInstaller打包成功！")
-        print(f"📦 输出文件: dist/kasmvnc-manager")
+        if onedir:
+            print(f"📦 输出目录: dist/kasmvnc-manager/")
+        else:
+            print(f"📦 输出文件: dist/kasmvnc-manager")
         return True
     except subprocess.CalledProcessError as e:
         print(f"❌ PyInstaller打包失败:")
@@ -227,6 +282,10 @@ def main():
                        help='仅下载资源文件，不进行打包')
     parser.add_argument('--skip-download', action='store_true',
                        help='跳过资源下载，直接打包')
+    parser.add_argument('--onedir', action='store_true',
+                       help='生成目录形式而非单文件，启动时无需解压（启动最快）')
+    parser.add_argument('--no-unpack-cache', action='store_true',
+                       help='Nuitka单文件模式下每次运行都解压到临时目录（默认解压到缓存目录并复用）')
     
     args = parser.parse_args()
     
@@ -252,9 +311,9 @@ def main():
     
     # 选择打包工具
     if args.tool == 'nuitka':
-        success = build_with_nuitka()
+        success = build_with_nuitka(onedir=args.onedir, cached_unpack=not args.no_unpack_cache)
     else:
-        success = build_with_pyinstaller()
+        success = build_with_pyinstaller(onedir=args.onedir)
     
     if success:
         print("\n✅ 打包完成！")
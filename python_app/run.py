@@ -7,7 +7,6 @@ KasmVNC多用户管理系统 - 启动脚本
 
 import os
 import sys
-import uvicorn
 import argparse
 from pathlib import Path
 
@@ -15,7 +14,8 @@ from pathlib import Path
 app_dir = Path(__file__).parent
 sys.path.insert(0, str(app_dir))
 
-from app.main import app
+from app.startup_profile import startup_profile, FAST_START_ENV
+startup_profile.mark("import_start")
 
 
 def main():
@@ -28,18 +28,31 @@ def main():
                        choices=['debug', 'info', 'warning', 'error'],
                        help='日志级别 (默认: info)')
     parser.add_argument('--workers', type=int, default=1, help='工作进程数 (默认: 1)')
+    parser.add_argument('--fast-start', action='store_true',
+                       help='快速启动: 延迟构建管理器，依赖检查在后台进行')
     
     args = parser.parse_args()
     
+    if args.fast_start:
+        os.environ[FAST_START_ENV] = "1"
+    
     print("🚀 启动KasmVNC多用户管理系统...")
     print(f"📡 服务地址: http://{args.host}:{args.port}")
     print(f"📝 API文档: http://{args.host}:{args.port}/api/docs")
     print(f"🌐 Web界面: http://{args.host}:{args.port}")
     print("=" * 50)
     
+    import uvicorn
+    
+    # 单进程运行时直接传入应用对象，避免uvicorn按字符串再次导入
+    if args.reload or args.workers > 1:
+        target = "app.main:app"
+    else:
+        from app.main import app as target
+    
     # 启动服务器
     uvicorn.run(
-        "app.main:app",
+        target,
         host=args.host,
         port=args.port,
         reload=args.reload,
@@ -229,9 +229,6 @@ kasmvncserver :\${DISPLAY_NUM} \\
 
 # 启动音频服务
 pulseaudio --start --daemonize
-
-# 显示日志
-tail -f ~/.vnc/*:\${DISPLAY_NUM}.log
 EOF
 
     chmod +x "$script_file"
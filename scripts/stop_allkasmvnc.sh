@@ -11,6 +11,9 @@ LOG_DIR="$PROJECT_DIR/logs"
 
 USER_LIST_FILE=${1:-"$PROJECT_DIR/user_info.txt"}
 BASE_USER_HOME="/home/share/user"
+# 所有进程同时收到SIGTERM后统一等待的时间（秒），超时后只强制停止未退出的进程
+STOP_TIMEOUT=${KASMVNC_STOP_TIMEOUT:-10}
+KILL_TIMEOUT=5
 
 # 颜色输出
 RED='\033[0;31m'
@@ -92,39 +95,78 @@ stop_user_vnc() {
     fi
 }
 
+# 等待一组进程退出，超时后输出仍在运行的PID
+wait_pids() {
+    local timeout=$1
+    shift
+    local pids=("$@")
+    local deadline=$((SECONDS + timeout))
+    
+    while [[ ${#pids[@]} -gt 0 ]]; do
+        local alive=()
+        for pid in "${pids[@]}"; do
+            if kill -0 "$pid" 2>/dev/null; then
+                alive+=("$pid")
+            fi
+        done
+        pids=("${alive[@]}")
+        if [[ ${#pids[@]} -eq 0 || $SECONDS -ge $deadline ]]; then
+            break
+        fi
+        sleep 0.2
+    done
+    
+    echo "${pids[@]}"
+}
+
+# 进程对应的显示器编号
+get_pid_displays() {
+    for pid in "$@"; do
+        ps -p "$pid" -o args --no-headers 2>/dev/null | grep -o ':[0-9]\+' | head -1 | sed 's/://'
+    done | sort -un
+}
+
+# 批量停止进程: 同时发送SIGTERM，统一等待，只对超时未退出的进程发送SIGKILL
+# 总耗时受 STOP_TIMEOUT + KILL_TIMEOUT 约束，与进程数量无关
+fleet_stop() {
+    local pids=("$@")
+    local displays=($(get_pid_displays "${pids[@]}"))
+    
+    log_info "向 ${#pids[@]} 个进程发送停止信号: ${pids[*]}"
+    kill -TERM "${pids[@]}" 2>/dev/null || true
+    
+    local remaining=($(wait_pids "$STOP_TIMEOUT" "${pids[@]}"))
+    if [[ ${#remaining[@]} -gt 0 ]]; then
+        log_warning "优雅停止超时，强制终止剩余进程: ${remaining[*]}"
+        kill -9 "${remaining[@]}" 2>/dev/null || true
+        remaining=($(wait_pids "$KILL_TIMEOUT" "${remaining[@]}"))
+    fi
+    
+    # 一次性清理已停止显示器的锁文件和套接字
+    local lock_files=()
+    for display in "${displays[@]}"; do
+        lock_files+=("/tmp/.X${display}-lock" "/tmp/.X11-unix/X${display}")
+    done
+    if [[ ${#lock_files[@]} -gt 0 ]]; then
+        rm -f "${lock_files[@]}" 2>/dev/null || true
+    fi
+    
+    [[ ${#remaining[@]} -eq 0 ]]
+}
+
 # 强制停止所有KasmVNC进程
 force_stop_all() {
     log_warning "执行强制停止所有KasmVNC进程..."
     
     # 查找所有kasmvncserver进程
-    local pids=$(pgrep -f kasmvncserver || true)
+    local pids=($(pgrep -f kasmvncserver || true))
     
-    if [[ -z "$pids" ]]; then
+    if [[ ${#pids[@]} -eq 0 ]]; then
         log_info "没有发现运行中的KasmVNC进程"
         return 0
     fi
     
-    log_info "发现运行中的KasmVNC进程: $(echo $pids | tr '\n' ' ')"
-    
-    # 尝试优雅停止
-    for pid in $pids; do
-        log_info "停止进程 $pid..."
-        kill "$pid" 2>/dev/null || true
-    done
-    
-    # 等待进程停止
-    sleep 5
-    
-    # 检查仍在运行的进程
-    local remaining_pids=$(pgrep -f kasmvncserver || true)
-    
-    if [[ -n "$remaining_pids" ]]; then
-        log_warning "强制终止剩余进程: $(echo $remaining_pids | tr '\n' ' ')"
-        for pid in $remaining_pids; do
-            kill -9 "$pid" 2>/dev/null || true
-        done
-        sleep 2
-    fi
+    fleet_stop "${pids[@]}" || true
     
     # 清理锁文件和套接字
     log_info "清理临时文件..."
@@ -146,22 +188,22 @@ stop_all_audio() {
     
     local users=($(get_all_users))
     local stopped_count=0
+    local audio_pids=()
     
     for username in "${users[@]}"; do
         if [[ -n "$username" ]]; then
-            local audio_pids=$(pgrep -u "$username" pulseaudio 2>/dev/null || true)
-            if [[ -n "$audio_pids" ]]; then
+            local user_pids=($(pgrep -u "$username" pulseaudio 2>/dev/null || true))
+            if [[ ${#user_pids[@]} -gt 0 ]]; then
                 log_info "停止用户 $username 的音频服务..."
-                for pid in $audio_pids; do
-                    kill "$pid" 2>/dev/null || true
-                done
+                audio_pids+=("${user_pids[@]}")
                 stopped_count=$((stopped_count + 1))
             fi
         fi
     done
     
     if [[ $stopped_count -gt 0 ]]; then
-        sleep 2
+        kill "${audio_pids[@]}" 2>/dev/null || true
+        wait_pids "$KILL_TIMEOUT" "${audio_pids[@]}" >/dev/null
         log_success "已停止 $stopped_count 个用户的音频服务"
     else
         log_info "没有发现运行中的用户音频服务"
@@ -197,54 +239,37 @@ show_all_status() {
     log_info "总结: $running_users/$total_users 个用户运行中，共 $total_displays 个显示器"
 }
 
-# 并行停止多个用户
+# 并行停止多个用户: 所有用户的进程一起停止
 parallel_stop() {
     local users=("$@")
     local total_count=${#users[@]}
     local success_count=0
     local failed_users=()
+    local pids=()
     
     log_info "并行停止 $total_count 个用户的VNC服务..."
     
-    # 创建临时目录存储结果
-    local temp_dir=$(mktemp -d)
-    
-    # 并行停止
-    local pids=()
-    for i in "${!users[@]}"; do
-        local username="${users[$i]}"
+    for username in "${users[@]}"; do
         if [[ -n "$username" ]]; then
-            (
-                if stop_user_vnc "$username"; then
-                    echo "SUCCESS" > "$temp_dir/$username.result"
-                else
-                    echo "FAILED" > "$temp_dir/$username.result"
-                fi
-            ) &
-            pids+=($!)
+            pids+=($(pgrep -u "$username" -f kasmvncserver 2>/dev/null || true))
         fi
     done
     
-    # 等待所有后台进程完成
-    for pid in "${pids[@]}"; do
-        wait "$pid"
-    done
+    if [[ ${#pids[@]} -gt 0 ]]; then
+        fleet_stop "${pids[@]}" || true
+    fi
     
     # 统计结果
     for username in "${users[@]}"; do
-        if [[ -n "$username" && -f "$temp_dir/$username.result" ]]; then
-            local result=$(cat "$temp_dir/$username.result")
-            if [[ "$result" == "SUCCESS" ]]; then
-                success_count=$((success_count + 1))
-            else
+        if [[ -n "$username" ]]; then
+            if pgrep -u "$username" -f kasmvncserver >/dev/null 2>&1; then
                 failed_users+=("$username")
+            else
+                success_count=$((success_count + 1))
             fi
         fi
     done
     
-    # 清理临时目录
-    rm -rf "$temp_dir"
-    
     # 显示结果
     log_info "停止完成: $success_count/$total_count 个用户停止成功"
     
@@ -402,6 +427,9 @@ case "${1:-}" in
         echo "  -s, --status   仅显示当前状态"
         echo "  -f, --force    强制停止所有进程"
         echo ""
+        echo "环境变量:"
+        echo "  KASMVNC_STOP_TIMEOUT: 统一等待进程退出的时间（秒），默认 10"
+        echo ""
         echo "参数说明:"
         echo "  用户信息文件: 可选，包含用户信息的文件路径"
         echo "                默认: $USER_LIST_FILE"
@@ -409,6 +437,7 @@ case "${1:-}" in
         echo "功能:"
         echo "  - 自动发现并停止所有KasmVNC用户的VNC服务"
         echo "  - 支持并行、顺序和强制三种停止模式"
+        echo "  - 并行和强制模式同时向所有进程发送停止信号，只对超时未退出的进程强制终止"
         echo "  - 显示停止前后的服务状态"
         echo ""
         echo "示例:"